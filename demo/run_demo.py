@@ -2,20 +2,30 @@
 import asyncio
 import json
 import sys
+import time
 from pathlib import Path
 from playwright.async_api import async_playwright
 
 from thirdlayer_prototype.db.storage import Storage
 from thirdlayer_prototype.agent.executor import Executor
 from thirdlayer_prototype.agent.loop import AgentLoop
+from thirdlayer_prototype.agent.pool import AgentPool, drive_session
+from thirdlayer_prototype.agent.predictor import VariableOrderPredictor
+from thirdlayer_prototype.agent.tracing import JsonlSpanSink, Tracer
 from demo.wikipedia_workflow import get_wikipedia_workflow
 
 
+CONTEXT_ORDER = 4
+
+POOL_SIZE = 4
+POOL_SESSIONS = 16
+
+
 async def run_recording_mode():
     """Record Wikipedia workflow and store transitions."""
     print("=== RECORDING MODE ===\n")
     
-    storage = Storage("thirdlayer.db")
+    storage = Storage("thirdlayer.db", context_order=CONTEXT_ORDER)
     storage.connect()
     
     workflow = get_wikipedia_workflow()
@@ -27,6 +37,10 @@ async def run_recording_mode():
         
         print(f"Recording {len(workflow)} actions...\n")
         
+        urls = []
+        successes = []
+        timestamps = []
+        
         for i, action in enumerate(workflow):
             print(f"Step {i+1}: {action}")
             result = await executor.execute(action)
@@ -35,23 +49,20 @@ async def run_recording_mode():
                 print(f"  ✓ Success")
                 if result.extracted_text:
                     print(f"  Extracted: {result.extracted_text[:100]}...")
-                
-                storage.record_action(action, url=page.url, success=True)
-                
-                if i > 0:
-                    storage.record_transition_first_order(workflow[i-1], action)
-                
-                if i > 1:
-                    storage.record_transition_second_order(workflow[i-2], workflow[i-1], action)
             else:
                 print(f"  ✗ Failed: {result.error}")
-                storage.record_action(action, url=page.url, success=False)
+            
+            urls.append(page.url)
+            successes.append(result.success)
+            timestamps.append(time.time())
             
             print()
             await asyncio.sleep(1)
         
         await browser.close()
     
+    storage.record_session(workflow, urls=urls, successes=successes, timestamps=timestamps)
+    
     print(f"Total transitions recorded: {storage.get_total_transition_count()}")
     storage.close()
     print("\n=== RECORDING COMPLETE ===\n")
@@ -61,7 +72,7 @@ async def run_prediction_mode():
     """Run agent loop using learned transitions."""
     print("=== PREDICTION MODE ===\n")
     
-    storage = Storage("thirdlayer.db")
+    storage = Storage("thirdlayer.db", cache_transitions=True, context_order=CONTEXT_ORDER)
     storage.connect()
     
     total_transitions = storage.get_total_transition_count()
@@ -74,6 +85,10 @@ async def run_prediction_mode():
     
     workflow = get_wikipedia_workflow()
     
+    # Spans go to the file GET /traces/recent reads.
+    sink = JsonlSpanSink()
+    sink.start()
+    
     async with async_playwright() as p:
         browser = await p.chromium.launch(headless=False)
         page = await browser.new_page()
@@ -83,6 +98,9 @@ async def run_prediction_mode():
             storage=storage,
             confidence_threshold=0.3,
             dry_run=False,
+            predictor=VariableOrderPredictor(storage),
+            speculative=True,
+            tracer=Tracer(sink=sink),
         )
         
         first_action = workflow[0]
@@ -96,6 +114,7 @@ async def run_prediction_mode():
         else:
             print(f"  ✗ Failed: {result.error}\n")
             await browser.close()
+            await sink.close()
             storage.close()
             return
         
@@ -137,6 +156,7 @@ async def run_prediction_mode():
             await asyncio.sleep(1)
         
         await browser.close()
+    await sink.close()
     
     print("\n=== FINAL METRICS ===")
     metrics = agent.get_metrics()
@@ -146,10 +166,50 @@ async def run_prediction_mode():
     print("\n=== PREDICTION COMPLETE ===\n")
 
 
+async def run_pool_mode():
+    """Run many prediction sessions concurrently on one headless browser."""
+    print("=== POOL MODE ===\n")
+    
+    storage = Storage("thirdlayer.db", cache_transitions=True, context_order=CONTEXT_ORDER)
+    storage.connect()
+    
+    if storage.get_total_transition_count() == 0:
+        print("No transitions in database. Run recording mode first.")
+        storage.close()
+        return
+    
+    workflow = get_wikipedia_workflow()
+    sink = JsonlSpanSink()
+    sink.start()
+    
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        async with AgentPool(
+            browser,
+            storage,
+            size=POOL_SIZE,
+            predictor=VariableOrderPredictor(storage),
+            confidence_threshold=0.3,
+            speculative=True,
+            tracer=Tracer(sink=sink),
+        ) as pool:
+            await pool.run_all(
+                [drive_session(workflow[0], max_steps=len(workflow)) for _ in range(POOL_SESSIONS)],
+                return_exceptions=True,
+            )
+            stats = pool.get_stats()
+        await browser.close()
+    await sink.close()
+    
+    print(json.dumps(stats, indent=2))
+    storage.close()
+    print("\n=== POOL COMPLETE ===\n")
+
+
 async def main():
     """Main demo entrypoint."""
     if len(sys.argv) < 2:
-        print("Usage: python demo/run_demo.py [record|predict]")
+        print("Usage: python demo/run_demo.py [record|predict|pool]")
         sys.exit(1)
     
     mode = sys.argv[1]
@@ -158,9 +218,11 @@ async def main():
         await run_recording_mode()
     elif mode == "predict":
         await run_prediction_mode()
+    elif mode == "pool":
+        await run_pool_mode()
     else:
         print(f"Unknown mode: {mode}")
-        print("Usage: python demo/run_demo.py [record|predict]")
+        print("Usage: python demo/run_demo.py [record|predict|pool]")
         sys.exit(1)
 
 
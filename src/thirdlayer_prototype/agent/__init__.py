@@ -1,22 +1,32 @@
 """Agent package initialization."""
 from thirdlayer_prototype.agent.loop import AgentLoop
 from thirdlayer_prototype.agent.observer import Observer
-from thirdlayer_prototype.agent.predictor import Predictor, Prediction
+from thirdlayer_prototype.agent.predictor import Predictor, Prediction, VariableOrderPredictor
 from thirdlayer_prototype.agent.planner import Planner, Plan
 from thirdlayer_prototype.agent.validator import Validator, ValidationResult
+from thirdlayer_prototype.agent.denylist import Denylist
 from thirdlayer_prototype.agent.executor import Executor, ExecutionResult
 from thirdlayer_prototype.agent.metrics import Metrics
+from thirdlayer_prototype.agent.tracing import Tracer, JsonlSpanSink
+from thirdlayer_prototype.agent.pool import AgentPool
+from thirdlayer_prototype.agent.snapshot_predictor import SnapshotPredictor
 
 __all__ = [
     "AgentLoop",
     "Observer",
     "Predictor",
     "Prediction",
+    "VariableOrderPredictor",
     "Planner",
     "Plan",
     "Validator",
     "ValidationResult",
+    "Denylist",
     "Executor",
     "ExecutionResult",
     "Metrics",
+    "Tracer",
+    "JsonlSpanSink",
+    "AgentPool",
+    "SnapshotPredictor",
 ]
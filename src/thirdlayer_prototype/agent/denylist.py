@@ -0,0 +1,136 @@
+"""Compiled denylist for selector and URL safety checks.
+
+Patterns are case-insensitive substrings compiled into an Aho-Corasick
+automaton, so a check costs O(len(text)) however many patterns are loaded.
+Verdicts are cached per action signature.
+"""
+import json
+from collections import deque
+from typing import Any, Iterable
+
+from thirdlayer_prototype.models.action import Action
+
+
+DENYLIST_PATTERNS = [
+    "logout",
+    "log-out",
+    "sign-out",
+    "signout",
+    "delete",
+    "remove",
+    "submit",
+    "purchase",
+    "buy",
+    "payment",
+    "checkout",
+    "account",
+    "settings",
+    "preferences",
+]
+
+# Upper bound on cached verdicts; the oldest entries are evicted first.
+_VERDICT_CACHE_MAX_SIZE = 100_000
+
+
+class PatternMatcher:
+    """Aho-Corasick automaton over lowercase substring patterns."""
+    
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = list(dict.fromkeys(p.lower() for p in patterns if p))
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._match: list[str | None] = [None]
+        for pattern in self.patterns:
+            self._add(pattern)
+        self._link()
+    
+    def _add(self, pattern: str) -> None:
+        """Add one pattern to the trie."""
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._match.append(None)
+                self._goto[state][char] = next_state
+            state = next_state
+        self._match[state] = pattern
+    
+    def _link(self) -> None:
+        """Compute failure links breadth-first and propagate matches along them."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                if self._match[next_state] is None:
+                    self._match[next_state] = self._match[self._fail[next_state]]
+    
+    def search(self, text: str) -> str | None:
+        """Get the first pattern found in text, or None."""
+        goto, fail, match = self._goto, self._fail, self._match
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if match[state] is not None:
+                return match[state]
+        return None
+
+
+class Denylist:
+    """Selector and URL denylist with per-action verdict caching."""
+    
+    def __init__(
+        self,
+        selector_patterns: Iterable[str] = DENYLIST_PATTERNS,
+        url_patterns: Iterable[str] = (),
+    ):
+        self.selectors = PatternMatcher(selector_patterns)
+        self.urls = PatternMatcher(url_patterns)
+        self._verdicts: dict[str, str | None] = {}
+    
+    @classmethod
+    def from_dict(cls, config: dict[str, Any]) -> "Denylist":
+        """Create from a config dict.
+        
+        Keys are selector_patterns (defaults to DENYLIST_PATTERNS)
+        and url_patterns (defaults to none).
+        """
+        return cls(
+            selector_patterns=config.get("selector_patterns", DENYLIST_PATTERNS),
+            url_patterns=config.get("url_patterns", ()),
+        )
+    
+    @classmethod
+    def from_file(cls, path: str) -> "Denylist":
+        """Load from a JSON config file (see from_dict)."""
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+    
+    def check(self, action: Action) -> str | None:
+        """Get the denylist reason for action, or None if it is allowed."""
+        signature = action.signature()
+        try:
+            return self._verdicts[signature]
+        except KeyError:
+            pass
+        
+        verdict = None
+        if action.selector and self.selectors.search(action.selector) is not None:
+            verdict = "selector_matches_denylist_pattern"
+        elif action.type == "navigate" and action.url and self.urls.search(action.url) is not None:
+            verdict = "url_matches_denylist_pattern"
+        
+        if len(self._verdicts) >= _VERDICT_CACHE_MAX_SIZE:
+            del self._verdicts[next(iter(self._verdicts))]
+        self._verdicts[signature] = verdict
+        return verdict
@@ -1,22 +1,60 @@
 """Main agent decision loop."""
+import asyncio
 import json
 import time
-from typing import Any
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Iterator, TypeVar
 from playwright.async_api import Page
 
 from thirdlayer_prototype.models.action import Action
-from thirdlayer_prototype.models.state import BrowserState
+from thirdlayer_prototype.models.state import BrowserState, page_pattern
 from thirdlayer_prototype.db.storage import Storage
 from thirdlayer_prototype.agent.observer import Observer
-from thirdlayer_prototype.agent.predictor import Predictor
+from thirdlayer_prototype.agent.predictor import Prediction, Predictor
 from thirdlayer_prototype.agent.planner import Planner
-from thirdlayer_prototype.agent.validator import Validator
-from thirdlayer_prototype.agent.executor import Executor
+from thirdlayer_prototype.agent.validator import ValidationResult, Validator
+from thirdlayer_prototype.agent.denylist import Denylist
+from thirdlayer_prototype.agent.executor import ExecutionResult, Executor
 from thirdlayer_prototype.agent.metrics import Metrics
+from thirdlayer_prototype.agent.tracing import Span, Tracer, new_id
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class Speculation:
+    """Next-step work computed while the current action executes.
+    
+    Holds the predictions for the history that will exist if action
+    succeeds, plus the static validation of every candidate above the
+    threshold; only the DOM check is left for the next step. url is the
+    page action is taken on: the next page is not known yet, so the
+    predictions assume the same kind of page.
+    """
+    
+    action: Action
+    history_length: int
+    use_second_order: bool
+    url: str
+    predictions: list[Prediction]
+    static_validations: list[ValidationResult]
 
 
 class AgentLoop:
-    """Deterministic agent decision loop."""
+    """Deterministic agent decision loop.
+    
+    Every candidate above the confidence threshold is validated in one page
+    round trip, and the planner executes the best valid one.
+    
+    With speculative enabled, the next step's predictions and static
+    validation are computed while the current action executes. They are
+    kept if the action succeeds and discarded otherwise, so the next step
+    only has to observe the page and check the candidate selectors,
+    concurrently. With page context, they are also discarded when the
+    action led to another kind of page.
+    """
     
     def __init__(
         self,
@@ -24,19 +62,31 @@ class AgentLoop:
         storage: Storage,
         confidence_threshold: float = 0.5,
         dry_run: bool = False,
+        predictor: Predictor | None = None,
+        speculative: bool = False,
+        denylist: Denylist | None = None,
+        event_driven_observer: bool = False,
+        tracer: Tracer | None = None,
     ):
         self.page = page
         self.storage = storage
         self.dry_run = dry_run
+        self.speculative = speculative
         
-        self.observer = Observer(page)
-        self.predictor = Predictor(storage)
+        self.observer = Observer(page, event_driven=event_driven_observer)
+        self.predictor = predictor or Predictor(storage)
         self.planner = Planner(confidence_threshold)
-        self.validator = Validator(page)
+        self.validator = Validator(page, denylist)
         self.executor = Executor(page)
         self.metrics = Metrics()
+        self.tracer = tracer
+        self.trace_id = new_id()
+        # Actions this loop executes are logged as one session, keyed like its traces.
+        self.session_id = self.trace_id
         
         self.action_history: list[Action] = []
+        self._speculation: Speculation | None = None
+        self._step_span: Span | None = None
     
     async def step(
         self,
@@ -52,17 +102,67 @@ class AgentLoop:
         Returns:
             Dictionary with step results and logs.
         """
-        step_start = time.time()
+        if self.tracer is None:
+            return await self._step(use_second_order, ground_truth_action)
         
-        state = await self.observer.observe()
+        with self.tracer.span(
+            "step", trace_id=self.trace_id, history_length=len(self.action_history)
+        ) as span:
+            self._step_span = span
+            try:
+                step_result = await self._step(use_second_order, ground_truth_action)
+            finally:
+                self._step_span = None
+            span.set(**_span_attributes(step_result))
+            return step_result
+    
+    async def _step(
+        self, use_second_order: bool, ground_truth_action: Action | None
+    ) -> dict[str, Any]:
+        """Run one step; see step()."""
+        step_start = time.perf_counter()
         
-        predictions = self.predictor.predict(
-            self.action_history,
-            k=5,
-            use_second_order=use_second_order,
-        )
+        state: BrowserState | None = None
+        pending = self._speculation is not None
+        speculation = self._claim_speculation(use_second_order)
+        if speculation is not None:
+            predictions = speculation.predictions
+            candidates = self.planner.candidates(predictions)
+            state, validations = await asyncio.gather(
+                self._timed("observe", self.observer.observe()),
+                self._timed(
+                    "validate",
+                    self.validator.validate_many(
+                        [c.action for c in candidates], speculation.static_validations
+                    ),
+                ),
+            )
+            if self.storage.page_context and (
+                page_pattern(state.url) != page_pattern(speculation.url)
+            ):
+                speculation = None
+        if pending:
+            self.metrics.record_speculation(hit=speculation is not None)
         
-        plan = self.planner.plan(predictions)
+        if speculation is None:
+            if state is None:
+                with self._stage("observe"):
+                    state = await self.observer.observe()
+            
+            with self._stage("predict"):
+                predictions = self.predictor.predict(
+                    self.action_history,
+                    k=5,
+                    use_second_order=use_second_order,
+                    url=state.url,
+                )
+            
+            candidates = self.planner.candidates(predictions)
+            with self._stage("validate"):
+                validations = await self.validator.validate_many([c.action for c in candidates])
+        
+        with self._stage("plan"):
+            plan = self.planner.plan(predictions, validations)
         
         step_result = {
             "timestamp": time.time(),
@@ -70,8 +170,10 @@ class AgentLoop:
             "predictions": [p.to_dict() for p in predictions],
             "plan": plan.to_dict(),
             "validation": None,
+            "validations": [v.to_dict() for v in validations],
             "execution": None,
             "ground_truth_match": None,
+            "speculative": speculation is not None,
         }
         
         if plan.prediction:
@@ -84,60 +186,143 @@ class AgentLoop:
         elif plan.prediction:
             self.metrics.record_prediction(correct=None)
         
-        if plan.should_execute and plan.prediction:
-            validation = await self.validator.validate(plan.prediction.action)
-            step_result["validation"] = validation.to_dict()
-            
-            if not validation.valid:
+        if validations:
+            # Candidates ranked above the chosen one (all of them, if none
+            # was valid) were filtered out.
+            rank = (
+                next(i for i, c in enumerate(candidates) if c is plan.prediction)
+                if plan.should_execute
+                else len(validations)
+            )
+            for _ in range(rank):
                 self.metrics.record_unsafe_filtered()
+            step_result["validation"] = validations[rank if plan.should_execute else 0].to_dict()
+        
+        if plan.should_execute and plan.prediction:
+            if self.dry_run:
                 step_result["execution"] = {
                     "attempted": False,
-                    "reason": "validation_failed",
+                    "reason": "dry_run_mode",
+                    "would_execute": plan.prediction.action.to_dict(),
                 }
             else:
-                if self.dry_run:
-                    step_result["execution"] = {
-                        "attempted": False,
-                        "reason": "dry_run_mode",
-                        "would_execute": plan.prediction.action.to_dict(),
-                    }
-                else:
-                    execution = await self.executor.execute(plan.prediction.action)
-                    step_result["execution"] = {
-                        "attempted": True,
-                        **execution.to_dict(),
-                    }
-                    
-                    self.metrics.record_execution(execution.success)
-                    
-                    if execution.success:
+                execution, next_speculation = await self._execute(
+                    plan.prediction.action, use_second_order, state.url
+                )
+                step_result["execution"] = {
+                    "attempted": True,
+                    **execution.to_dict(),
+                }
+                
+                self.metrics.record_execution(execution.success)
+                
+                if execution.success:
+                    with self._stage("storage_write"), self.storage.batch():
                         self.storage.record_action(
                             plan.prediction.action,
                             url=state.url,
                             success=True,
+                            session_id=self.session_id,
                         )
                         
-                        if len(self.action_history) > 0:
-                            self.storage.record_transition_first_order(
-                                self.action_history[-1],
-                                plan.prediction.action,
-                            )
-                        
-                        if len(self.action_history) > 1:
-                            self.storage.record_transition_second_order(
-                                self.action_history[-2],
-                                self.action_history[-1],
-                                plan.prediction.action,
-                            )
-                        
-                        self.action_history.append(plan.prediction.action)
+                        self.storage.record_transitions(
+                            self.action_history,
+                            plan.prediction.action,
+                            url=state.url,
+                        )
+                    
+                    self.action_history.append(plan.prediction.action)
+                    self._speculation = next_speculation
+                elif next_speculation is not None:
+                    self.metrics.record_speculation(hit=False)
+        elif validations:
+            step_result["execution"] = {
+                "attempted": False,
+                "reason": "validation_failed",
+            }
         
-        decision_time = time.time() - step_start
+        decision_time = time.perf_counter() - step_start
         self.metrics.record_decision_time(decision_time)
         step_result["decision_time_ms"] = decision_time * 1000
         
         return step_result
     
+    async def _execute(
+        self, action: Action, use_second_order: bool, url: str
+    ) -> tuple[ExecutionResult, Speculation | None]:
+        """Execute action on the page at url, speculating on the next step while it runs."""
+        if not self.speculative:
+            return await self._timed("execute", self.executor.execute(action)), None
+        
+        task = asyncio.ensure_future(self._timed("execute", self.executor.execute(action)))
+        # Let the executor send its browser command before computing locally.
+        await asyncio.sleep(0)
+        speculation = self._speculate(action, use_second_order, url)
+        return await task, speculation
+    
+    async def _timed(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """Await awaitable, recording its duration as one run of stage."""
+        with self._stage(stage):
+            return await awaitable
+    
+    @contextmanager
+    def _stage(self, stage: str) -> Iterator[None]:
+        """Time the enclosed block as stage, with a child span when tracing."""
+        with self.metrics.time_stage(stage):
+            if self.tracer is None or self._step_span is None:
+                yield
+                return
+            with self.tracer.span(stage, parent=self._step_span):
+                yield
+    
+    def _speculate(
+        self, action: Action, use_second_order: bool, url: str
+    ) -> Speculation | None:
+        """Predict and statically validate the candidates for the step after action."""
+        if self.action_history and self._same_state(self.action_history[-1], action):
+            # Recording this step bumps counts out of the state of action
+            # (with templates, any action of the same template), which the
+            # next predictions read, so they would be stale.
+            return None
+        
+        # Timed like any predict, although it overlaps the execute stage.
+        with self._stage("predict"):
+            predictions = self.predictor.predict(
+                [*self.action_history, action],
+                k=5,
+                use_second_order=use_second_order,
+                url=url,
+            )
+        candidates = self.planner.candidates(predictions)
+        return Speculation(
+            action=action,
+            history_length=len(self.action_history) + 1,
+            use_second_order=use_second_order,
+            url=url,
+            predictions=predictions,
+            static_validations=[self.validator.check_static(c.action) for c in candidates],
+        )
+    
+    def _claim_speculation(self, use_second_order: bool) -> Speculation | None:
+        """Take the pending speculation if it was made for the current history."""
+        speculation, self._speculation = self._speculation, None
+        if speculation is None:
+            return None
+        hit = (
+            speculation.use_second_order == use_second_order
+            and speculation.history_length == len(self.action_history)
+            and self.action_history[-1] == speculation.action
+            and not (
+                len(self.action_history) >= 2
+                and self._same_state(self.action_history[-2], speculation.action)
+            )
+        )
+        return speculation if hit else None
+    
+    def _same_state(self, a: Action, b: Action) -> bool:
+        """Check whether a and b are one Markov state (the same template, when templating)."""
+        return a == b or self.storage._state_signature(a) == self.storage._state_signature(b)
+    
     def add_action_to_history(self, action: Action) -> None:
         """Manually add action to history (for recording mode)."""
         self.action_history.append(action)
@@ -145,3 +330,21 @@ class AgentLoop:
     def get_metrics(self) -> dict[str, Any]:
         """Get current metrics snapshot."""
         return self.metrics.to_dict()
+
+
+def _span_attributes(step_result: dict[str, Any]) -> dict[str, Any]:
+    """Compact summary of a step result for its trace span."""
+    validation = step_result["validation"] or {}
+    execution = step_result["execution"] or {}
+    return {
+        "url": step_result["url"],
+        "speculative": step_result["speculative"],
+        "predictions": step_result["predictions"],
+        "plan_reason": step_result["plan"]["reason"],
+        "should_execute": step_result["plan"]["should_execute"],
+        "validation": validation.get("reason"),
+        "executed": execution.get("attempted", False),
+        "execution_success": execution.get("success"),
+        "execution_error": execution.get("error") or execution.get("reason"),
+        "ground_truth_match": step_result["ground_truth_match"],
+    }
@@ -0,0 +1,120 @@
+"""Predictor answering from an in-memory transition matrix snapshot.
+
+Requires numpy (install the "matrix" extra).
+"""
+from typing import Mapping
+
+import numpy as np
+
+from thirdlayer_prototype.agent.predictor import Prediction, fill_predictions
+from thirdlayer_prototype.db.matrix import TransitionMatrix
+from thirdlayer_prototype.models.action import Action
+
+
+class MatrixPredictor:
+    """Markov predictor over a TransitionMatrix instead of live SQL queries.
+    
+    Same predict() contract as Predictor: second-order first, falling back
+    to first-order, with templates filled from the history over slot_values
+    (and second-order backing off when none of its templates can be filled).
+    """
+    
+    def __init__(self, matrix: TransitionMatrix, slot_values: Mapping[str, str] | None = None):
+        self.matrix = matrix
+        self.slot_values = dict(slot_values or {})
+    
+    @classmethod
+    def from_file(
+        cls, path: str, slot_values: Mapping[str, str] | None = None
+    ) -> "MatrixPredictor":
+        """Load a predictor from a .npz snapshot written by Storage.export_matrix."""
+        return cls(TransitionMatrix.load(path), slot_values)
+    
+    def predict_first_order(self, current_action: Action, k: int = 5) -> list[Prediction]:
+        """Predict next actions using the first-order rows.
+        
+        Returns top K predictions sorted by confidence (descending).
+        """
+        index = self.matrix.index_of(self._state_signature(current_action))
+        if index is None:
+            return []
+        columns, probs = self.matrix.first_order_row(index)
+        return self._top_k(columns, probs, k, "first_order")
+    
+    def predict_second_order(
+        self, prev_action: Action, current_action: Action, k: int = 5
+    ) -> list[Prediction]:
+        """Predict next actions using the second-order rows.
+        
+        Returns top K predictions sorted by confidence (descending).
+        """
+        prev = self.matrix.index_of(self._state_signature(prev_action))
+        current = self.matrix.index_of(self._state_signature(current_action))
+        if prev is None or current is None:
+            return []
+        columns, probs = self.matrix.second_order_row(prev, current)
+        return self._top_k(columns, probs, k, "second_order")
+    
+    def predict(
+        self,
+        action_history: list[Action],
+        k: int = 5,
+        use_second_order: bool = True,
+        url: str | None = None,
+    ) -> list[Prediction]:
+        """Predict next actions using best available model.
+        
+        Tries second-order if available and enabled, falls back to first-order.
+        The matrix holds no page context, so url is ignored.
+        """
+        if not action_history:
+            return []
+        
+        current_action = action_history[-1]
+        
+        if use_second_order and len(action_history) >= 2:
+            second_order_preds = self.fill(
+                self.predict_second_order(action_history[-2], current_action, k), action_history
+            )
+            if second_order_preds:
+                return second_order_preds
+        
+        return self.fill(self.predict_first_order(current_action, k), action_history)
+    
+    def fill(
+        self, predictions: list[Prediction], action_history: list[Action]
+    ) -> list[Prediction]:
+        """Fill predicted templates into executable actions, as Predictor.fill does."""
+        return fill_predictions(
+            self.matrix.templater, predictions, action_history, self.slot_values
+        )
+    
+    def _state_signature(self, action: Action) -> str:
+        """Signature of the matrix state of action: its template's, when templated."""
+        if self.matrix.templater is None:
+            return action.signature()
+        return self.matrix.templater.template(action).signature()
+    
+    def _top_k(
+        self, columns: np.ndarray, probs: np.ndarray, k: int, source: str
+    ) -> list[Prediction]:
+        """Select the K most probable columns of a row with argpartition.
+        
+        Ties at the K-th probability are broken by lowest column, matching
+        the SQL index order.
+        """
+        if len(probs) == 0 or k <= 0:
+            return []
+        if len(probs) > k:
+            kth = probs[np.argpartition(-probs, k - 1)[k - 1]]
+            keep = np.flatnonzero(probs >= kth)
+            columns, probs = columns[keep], probs[keep]
+        order = np.lexsort((columns, -probs))[:k]
+        return [
+            Prediction(
+                action=Action.from_json(self.matrix.vocab[columns[i]]),
+                confidence=float(probs[i]),
+                source=source,
+            )
+            for i in order
+        ]
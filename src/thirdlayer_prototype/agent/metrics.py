@@ -1,9 +1,88 @@
 """Metrics tracking and reporting."""
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-from typing import Any
+from typing import Any, Iterator
+import math
 import time
 
 
+# Stages of AgentLoop.step that get their own latency histogram.
+STAGES = ("observe", "predict", "plan", "validate", "execute", "storage_write")
+
+PERCENTILES = (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+
+
+@dataclass
+class LatencyHistogram:
+    """Fixed-memory streaming histogram of durations in seconds.
+    
+    Buckets grow geometrically by a factor of 2 ** (1 / buckets_per_octave)
+    from min_value to max_value, so any reported percentile is within that
+    relative error (about 4.4% by default) of the true value. Values outside
+    the range land in the first or last bucket; count, sum, min and max are
+    tracked exactly.
+    """
+    
+    min_value: float = 1e-6
+    max_value: float = 3600.0
+    buckets_per_octave: int = 16
+    count: int = 0
+    total: float = 0.0
+    min: float = math.inf
+    max: float = 0.0
+    buckets: list[int] = field(default_factory=list)
+    
+    def __post_init__(self):
+        self._log_growth = math.log(2) / self.buckets_per_octave
+        size = int(math.ceil(math.log(self.max_value / self.min_value) / self._log_growth)) + 1
+        if not self.buckets:
+            self.buckets = [0] * size
+    
+    def record(self, value: float) -> None:
+        """Add one duration."""
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[self._index(value)] += 1
+    
+    def _index(self, value: float) -> int:
+        """Bucket holding value: bucket i covers (min_value * g**(i-1), min_value * g**i]."""
+        if value <= self.min_value:
+            return 0
+        index = int(math.ceil(math.log(value / self.min_value) / self._log_growth))
+        return min(index, len(self.buckets) - 1)
+    
+    def mean(self) -> float:
+        """Mean of recorded values."""
+        return self.total / self.count if self.count else 0.0
+    
+    def percentile(self, q: float) -> float:
+        """Approximate nearest-rank percentile, q in [0, 1]."""
+        if not self.count:
+            return 0.0
+        if q <= 0:
+            return self.min
+        rank = max(1, int(math.ceil(q * self.count)))
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                if index == len(self.buckets) - 1:
+                    return self.max
+                upper = self.min_value * math.exp(index * self._log_growth)
+                return min(max(upper, self.min), self.max)
+        return self.max
+    
+    def summary_ms(self) -> dict[str, float]:
+        """Count, mean, p50/p95/p99 and max in milliseconds."""
+        summary = {"count": self.count, "mean": self.mean() * 1000}
+        for name, q in PERCENTILES:
+            summary[name] = self.percentile(q) * 1000
+        summary["max"] = self.max * 1000
+        return summary
+
+
 @dataclass
 class Metrics:
     """System metrics tracker."""
@@ -13,8 +92,13 @@ class Metrics:
     total_executions: int = 0
     successful_executions: int = 0
     unsafe_filtered: int = 0
+    speculation_hits: int = 0
+    speculation_misses: int = 0
     total_confidence: float = 0.0
-    decision_times: list[float] = field(default_factory=list)
+    decision_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    stage_latency: dict[str, LatencyHistogram] = field(
+        default_factory=lambda: {stage: LatencyHistogram() for stage in STAGES}
+    )
     start_time: float = field(default_factory=time.time)
     
     def record_prediction(self, correct: bool | None = None) -> None:
@@ -37,13 +121,36 @@ class Metrics:
         """Record an action filtered by safety validator."""
         self.unsafe_filtered += 1
     
+    def record_speculation(self, hit: bool) -> None:
+        """Record whether a speculated next step was used or discarded."""
+        if hit:
+            self.speculation_hits += 1
+        else:
+            self.speculation_misses += 1
+    
     def record_confidence(self, confidence: float) -> None:
         """Record confidence score."""
         self.total_confidence += confidence
     
     def record_decision_time(self, duration: float) -> None:
         """Record decision loop duration in seconds."""
-        self.decision_times.append(duration)
+        self.decision_latency.record(duration)
+    
+    def record_stage_time(self, stage: str, duration: float) -> None:
+        """Record one stage's duration in seconds."""
+        histogram = self.stage_latency.get(stage)
+        if histogram is None:
+            histogram = self.stage_latency[stage] = LatencyHistogram()
+        histogram.record(duration)
+    
+    @contextmanager
+    def time_stage(self, stage: str) -> Iterator[None]:
+        """Time the enclosed block as one run of stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage_time(stage, time.perf_counter() - start)
     
     def get_prediction_accuracy(self) -> float:
         """Calculate prediction accuracy when ground truth available."""
@@ -65,9 +172,7 @@ class Metrics:
     
     def get_average_decision_time(self) -> float:
         """Calculate average decision loop time in seconds."""
-        if not self.decision_times:
-            return 0.0
-        return sum(self.decision_times) / len(self.decision_times)
+        return self.decision_latency.mean()
     
     def get_uptime(self) -> float:
         """Get system uptime in seconds."""
@@ -84,6 +189,13 @@ class Metrics:
             "execution_success_rate": self.get_execution_success_rate(),
             "average_confidence": self.get_average_confidence(),
             "unsafe_filtered": self.unsafe_filtered,
+            "speculation_hits": self.speculation_hits,
+            "speculation_misses": self.speculation_misses,
             "average_decision_time_ms": self.get_average_decision_time() * 1000,
+            "decision_time_ms": self.decision_latency.summary_ms(),
+            "stage_time_ms": {
+                stage: histogram.summary_ms()
+                for stage, histogram in self.stage_latency.items()
+            },
             "uptime_seconds": self.get_uptime(),
         }
@@ -1,15 +1,32 @@
 """Observer captures current browser state."""
-from playwright.async_api import Page
+from playwright.async_api import Frame, Page
 import time
 
 from thirdlayer_prototype.models.state import BrowserState
 
 
 class Observer:
-    """Observes and captures browser state."""
+    """Observes and captures browser state.
     
-    def __init__(self, page: Page):
+    With event_driven, the observer follows the page's framenavigated,
+    domcontentloaded and load events and keeps the state in memory. observe()
+    then only asks the browser for the title after an event has made it
+    stale, and navigation_count tells callers whether the page changed since
+    they last looked.
+    """
+    
+    def __init__(self, page: Page, event_driven: bool = False):
         self.page = page
+        self.event_driven = event_driven
+        self.navigation_count = 0
+        self.load_state: str | None = None
+        self._title: str | None = None
+        self._event_count = 0
+        self._clean_at = -1
+        if event_driven:
+            page.on("framenavigated", self._on_frame_navigated)
+            page.on("domcontentloaded", self._on_domcontentloaded)
+            page.on("load", self._on_load)
     
     async def observe(self) -> BrowserState:
         """Capture current browser state snapshot.
@@ -17,10 +34,54 @@ class Observer:
         Returns BrowserState with url, title, timestamp.
         """
         url = self.page.url
-        title = await self.page.title()
+        if not self.event_driven:
+            title = await self.page.title()
+        elif self.is_dirty():
+            seen = self._event_count
+            title = await self.page.title()
+            # Events that arrived during the round trip leave the state dirty.
+            self._title = title
+            self._clean_at = seen
+        else:
+            title = self._title
         
         return BrowserState(
             url=url,
             title=title,
             timestamp=time.time(),
+            navigation_count=self.navigation_count,
+            load_state=self.load_state,
         )
+    
+    def is_dirty(self) -> bool:
+        """Whether a page event arrived since the title was last fetched."""
+        return self._clean_at != self._event_count
+    
+    def changed_since(self, navigation_count: int) -> bool:
+        """Whether the main frame navigated after the given navigation count."""
+        return self.navigation_count != navigation_count
+    
+    def close(self) -> None:
+        """Stop following page events."""
+        if self.event_driven:
+            self.page.remove_listener("framenavigated", self._on_frame_navigated)
+            self.page.remove_listener("domcontentloaded", self._on_domcontentloaded)
+            self.page.remove_listener("load", self._on_load)
+    
+    def _on_frame_navigated(self, frame: Frame) -> None:
+        """Count main-frame navigations; subframes do not change the page state."""
+        if frame.parent_frame is not None:
+            return
+        self.navigation_count += 1
+        self.load_state = "committed"
+        self._event_count += 1
+    
+    def _on_domcontentloaded(self, page: Page) -> None:
+        """Record that the DOM of the current document is parsed."""
+        self.load_state = "domcontentloaded"
+        self._event_count += 1
+    
+    def _on_load(self, page: Page) -> None:
+        """Record that the current document and its resources finished loading."""
+        self.load_state = "load"
+        self._event_count += 1
@@ -3,6 +3,7 @@ from dataclasses import dataclass
 from typing import Any
 
 from thirdlayer_prototype.agent.predictor import Prediction
+from thirdlayer_prototype.agent.validator import ValidationResult
 
 
 @dataclass
@@ -28,11 +29,26 @@ class Planner:
     def __init__(self, confidence_threshold: float = 0.5):
         self.confidence_threshold = confidence_threshold
     
-    def plan(self, predictions: list[Prediction]) -> Plan:
+    def candidates(self, predictions: list[Prediction]) -> list[Prediction]:
+        """Predictions confident enough to execute, highest first."""
+        return [p for p in predictions if p.confidence >= self.confidence_threshold]
+    
+    def plan(
+        self,
+        predictions: list[Prediction],
+        validations: list[ValidationResult] | None = None,
+    ) -> Plan:
         """Select action to execute from predictions.
         
+        With validations (aligned with predictions; missing entries count as
+        not validated), the highest-confidence valid prediction above the
+        threshold is selected instead of only the top one.
+        
         Returns Plan with execution decision and reason.
         """
+        if validations is not None:
+            return self._plan_validated(predictions, validations)
+        
         if not predictions:
             return Plan(
                 prediction=None,
@@ -54,3 +70,28 @@ class Planner:
             should_execute=True,
             reason=f"confidence_above_threshold_{top_prediction.confidence:.2f}",
         )
+    
+    def _plan_validated(
+        self, predictions: list[Prediction], validations: list[ValidationResult]
+    ) -> Plan:
+        """Select the first valid prediction above the threshold."""
+        if not predictions:
+            return self.plan(predictions)
+        
+        for rank, (prediction, validation) in enumerate(zip(predictions, validations)):
+            if prediction.confidence < self.confidence_threshold:
+                break
+            if not validation.valid:
+                continue
+            reason = f"confidence_above_threshold_{prediction.confidence:.2f}"
+            if rank > 0:
+                reason = f"fallback_to_rank_{rank + 1}_{reason}"
+            return Plan(prediction=prediction, should_execute=True, reason=reason)
+        
+        if predictions[0].confidence < self.confidence_threshold:
+            return self.plan(predictions)
+        return Plan(
+            prediction=predictions[0],
+            should_execute=False,
+            reason="no_valid_candidate_above_threshold",
+        )
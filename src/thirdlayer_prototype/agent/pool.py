@@ -0,0 +1,228 @@
+"""Concurrent agent sessions over one warm browser."""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable, TypeVar
+from playwright.async_api import Browser, BrowserContext, Page
+
+from thirdlayer_prototype.models.action import Action
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.agent.loop import AgentLoop
+from thirdlayer_prototype.agent.predictor import Predictor
+from thirdlayer_prototype.agent.denylist import Denylist
+from thirdlayer_prototype.agent.tracing import Tracer
+
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PoolSlot:
+    """One browser context and its page, leased to a session at a time."""
+    
+    context: BrowserContext
+    page: Page
+
+
+class AgentPool:
+    """Runs many AgentLoop sessions concurrently on one asyncio event loop.
+    
+    The pool opens size browser contexts (one page each) on a single
+    already-launched browser and leases them to sessions, so at most size
+    sessions run at once and none pays for a browser launch. All sessions
+    share one Storage, Predictor and Denylist. Storage writes are synchronous blocks
+    with no await inside, so on one event loop they never interleave.
+    """
+    
+    def __init__(
+        self,
+        browser: Browser,
+        storage: Storage,
+        size: int = 4,
+        predictor: Predictor | None = None,
+        confidence_threshold: float = 0.5,
+        dry_run: bool = False,
+        speculative: bool = False,
+        context_options: dict[str, Any] | None = None,
+        denylist: Denylist | None = None,
+        event_driven_observer: bool = True,
+        tracer: Tracer | None = None,
+    ):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.browser = browser
+        self.storage = storage
+        self.size = size
+        self.predictor = predictor or Predictor(storage)
+        self.confidence_threshold = confidence_threshold
+        self.dry_run = dry_run
+        self.speculative = speculative
+        self.context_options = context_options or {}
+        self.denylist = denylist or Denylist()
+        self.event_driven_observer = event_driven_observer
+        self.tracer = tracer
+        
+        self._slots: list[PoolSlot] = []
+        self._idle: asyncio.Queue[PoolSlot] = asyncio.Queue()
+        self.sessions_completed = 0
+        self.sessions_failed = 0
+        self.contexts_discarded = 0
+        self._busy_time = 0.0
+        self._started_at: float | None = None
+    
+    async def start(self) -> None:
+        """Open the pool's contexts and pages."""
+        contexts = await asyncio.gather(
+            *(self.browser.new_context(**self.context_options) for _ in range(self.size))
+        )
+        pages = await asyncio.gather(*(context.new_page() for context in contexts))
+        for context, page in zip(contexts, pages):
+            slot = PoolSlot(context=context, page=page)
+            self._slots.append(slot)
+            self._idle.put_nowait(slot)
+        self._started_at = time.perf_counter()
+    
+    async def close(self) -> None:
+        """Close every context; the browser itself stays open."""
+        await asyncio.gather(
+            *(slot.context.close() for slot in self._slots), return_exceptions=True
+        )
+        self._slots.clear()
+        self._idle = asyncio.Queue()
+    
+    async def __aenter__(self) -> "AgentPool":
+        await self.start()
+        return self
+    
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+    
+    async def run(self, session: Callable[[AgentLoop], Awaitable[T]]) -> T:
+        """Run one session on the next free slot.
+        
+        Waits while all slots are leased. The session gets a fresh AgentLoop
+        bound to the slot's page; the slot's cookies are cleared afterwards.
+        A context whose cookies cannot be cleared may still hold the
+        session's login, so it is closed and replaced by a fresh one.
+        """
+        if not self._slots:
+            raise RuntimeError("pool not started; call start() or use 'async with'")
+        slot = await self._idle.get()
+        start = time.perf_counter()
+        agent = None
+        try:
+            agent = AgentLoop(
+                page=slot.page,
+                storage=self.storage,
+                confidence_threshold=self.confidence_threshold,
+                dry_run=self.dry_run,
+                predictor=self.predictor,
+                speculative=self.speculative,
+                denylist=self.denylist,
+                event_driven_observer=self.event_driven_observer,
+                tracer=self.tracer,
+            )
+            result = await session(agent)
+            self.sessions_completed += 1
+            return result
+        except BaseException:
+            self.sessions_failed += 1
+            raise
+        finally:
+            self._busy_time += time.perf_counter() - start
+            if agent is not None:
+                agent.observer.close()
+            await self._release(slot)
+    
+    async def _release(self, slot: PoolSlot) -> None:
+        """Clear the slot's cookies and return it to the idle queue.
+        
+        When clearing fails, the context is discarded and a new slot takes
+        its place; if that cannot be opened either, the pool shrinks by one.
+        """
+        try:
+            await slot.context.clear_cookies()
+        except Exception:
+            logger.exception("clearing cookies failed; discarding the browser context")
+            self.contexts_discarded += 1
+            replacement = await self._replace(slot)
+            if replacement is not None:
+                self._idle.put_nowait(replacement)
+            return
+        self._idle.put_nowait(slot)
+    
+    async def _replace(self, slot: PoolSlot) -> PoolSlot | None:
+        """Close slot's context and open a new slot in its place.
+        
+        Returns None when the pool was closed meanwhile or the new context
+        could not be opened.
+        """
+        await asyncio.gather(slot.context.close(), return_exceptions=True)
+        if slot not in self._slots:
+            return None
+        self._slots.remove(slot)
+        context = None
+        try:
+            context = await self.browser.new_context(**self.context_options)
+            replacement = PoolSlot(context=context, page=await context.new_page())
+        except Exception:
+            logger.exception("opening a replacement browser context failed")
+            if context is not None:
+                await asyncio.gather(context.close(), return_exceptions=True)
+            return None
+        self._slots.append(replacement)
+        return replacement
+    
+    async def run_all(
+        self,
+        sessions: Iterable[Callable[[AgentLoop], Awaitable[T]]],
+        return_exceptions: bool = False,
+    ) -> list[T | BaseException]:
+        """Run many sessions concurrently, at most size at a time."""
+        return await asyncio.gather(
+            *(self.run(session) for session in sessions),
+            return_exceptions=return_exceptions,
+        )
+    
+    def get_stats(self) -> dict[str, Any]:
+        """Get session throughput since start()."""
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        return {
+            "size": self.size,
+            "sessions_completed": self.sessions_completed,
+            "sessions_failed": self.sessions_failed,
+            "contexts_discarded": self.contexts_discarded,
+            "elapsed_seconds": elapsed,
+            "sessions_per_second": self.sessions_completed / elapsed if elapsed else 0.0,
+            "slot_utilization": self._busy_time / (elapsed * self.size) if elapsed else 0.0,
+        }
+
+
+def drive_session(
+    start: Action,
+    max_steps: int = 20,
+    use_second_order: bool = True,
+) -> Callable[[AgentLoop], Awaitable[list[dict[str, Any]]]]:
+    """Build a session that executes start and then lets the agent drive.
+    
+    The session stops after max_steps steps or at the first step that does
+    not execute an action. Returns the step results.
+    """
+    async def session(agent: AgentLoop) -> list[dict[str, Any]]:
+        execution = await agent.executor.execute(start)
+        if not execution.success:
+            return []
+        agent.add_action_to_history(start)
+        
+        results = []
+        for _ in range(max_steps):
+            result = await agent.step(use_second_order=use_second_order)
+            results.append(result)
+            if not (result["execution"] or {}).get("success"):
+                break
+        return results
+    
+    return session
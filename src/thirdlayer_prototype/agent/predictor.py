@@ -1,8 +1,10 @@
 """Predictor generates candidate next actions using Markov model."""
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Mapping, Sequence
 
 from thirdlayer_prototype.models.action import Action
+from thirdlayer_prototype.models.state import page_pattern
+from thirdlayer_prototype.models.template import Templater
 from thirdlayer_prototype.db.storage import Storage
 
 
@@ -24,32 +26,42 @@ class Prediction:
 
 
 class Predictor:
-    """Markov-based action predictor."""
+    """Markov-based action predictor.
     
-    def __init__(self, storage: Storage):
+    Confidences are normalized over time-decayed transition weights, so with
+    a storage half-life recent behavior outweighs old behavior.
+    
+    When the storage records templates, predicted templates are filled from
+    the slots bound by the history (the latest value of each slot wins) over
+    slot_values, skipping history actions of the template's own type.
+    Templates with an unbound slot are dropped, since they cannot be
+    executed, and templates filling to an action already predicted are
+    dropped as duplicates. When every prediction of a model is dropped,
+    the next model down is tried.
+    
+    When the storage keeps page context and the current URL is given, the
+    transitions seen on that kind of page are tried first. A current action
+    seen fewer than min_page_support times on the page backs off to the
+    context-free counts.
+    """
+    
+    def __init__(
+        self,
+        storage: Storage,
+        slot_values: Mapping[str, str] | None = None,
+        min_page_support: int = 3,
+    ):
         self.storage = storage
+        self.slot_values = dict(slot_values or {})
+        self.min_page_support = min_page_support
     
     def predict_first_order(self, current_action: Action, k: int = 5) -> list[Prediction]:
         """Predict next actions using first-order Markov model.
         
         Returns top K predictions sorted by confidence (descending).
         """
-        transitions = self.storage.get_first_order_transitions(current_action)
-        
-        if not transitions:
-            return []
-        
-        total_count = sum(t["count"] for t in transitions)
-        
-        predictions = []
-        for trans in transitions[:k]:
-            action = Action.from_json(trans["to_action"])
-            confidence = trans["count"] / total_count
-            predictions.append(
-                Prediction(action=action, confidence=confidence, source="first_order")
-            )
-        
-        return predictions
+        transitions, total_weight = self.storage.get_first_order_top_k(current_action, k)
+        return _to_predictions(transitions, total_weight, "first_order")
     
     def predict_second_order(
         self, prev_action: Action, current_action: Action, k: int = 5
@@ -58,40 +70,295 @@ class Predictor:
         
         Returns top K predictions sorted by confidence (descending).
         """
-        transitions = self.storage.get_second_order_transitions(prev_action, current_action)
-        
-        if not transitions:
-            return []
-        
-        total_count = sum(t["count"] for t in transitions)
-        
-        predictions = []
-        for trans in transitions[:k]:
-            action = Action.from_json(trans["to_action"])
-            confidence = trans["count"] / total_count
-            predictions.append(
-                Prediction(action=action, confidence=confidence, source="second_order")
-            )
+        transitions, total_weight = self.storage.get_second_order_top_k(
+            prev_action, current_action, k
+        )
+        return _to_predictions(transitions, total_weight, "second_order")
+    
+    def predict_page(self, url: str, current_action: Action, k: int = 5) -> list[Prediction]:
+        """Predict next actions from the transitions seen on the page of url.
         
-        return predictions
+        Returns top K predictions sorted by confidence (descending), or none
+        when the page gives less than min_page_support observations.
+        """
+        transitions, total_weight = self.storage.get_page_top_k(
+            url, current_action, k, self.min_page_support
+        )
+        return _to_predictions(transitions, total_weight, "page")
     
     def predict(
-        self, action_history: list[Action], k: int = 5, use_second_order: bool = True
+        self,
+        action_history: list[Action],
+        k: int = 5,
+        use_second_order: bool = True,
+        url: str | None = None,
     ) -> list[Prediction]:
         """Predict next actions using best available model.
         
-        Tries second-order if available and enabled, falls back to first-order.
+        Tries the page of url if given and enabled, then second-order if
+        available and enabled, and falls back to first-order.
         """
         if not action_history:
             return []
         
         current_action = action_history[-1]
         
+        if url and self.storage.page_context:
+            page_preds = self.fill(self.predict_page(url, current_action, k), action_history)
+            if page_preds:
+                return page_preds
+        
         if use_second_order and len(action_history) >= 2:
             prev_action = action_history[-2]
-            second_order_preds = self.predict_second_order(prev_action, current_action, k)
+            second_order_preds = self.fill(
+                self.predict_second_order(prev_action, current_action, k), action_history
+            )
             
             if second_order_preds:
                 return second_order_preds
         
-        return self.predict_first_order(current_action, k)
+        return self.fill(self.predict_first_order(current_action, k), action_history)
+    
+    def predict_many(
+        self,
+        histories: Sequence[Sequence[Action]],
+        k: int = 5,
+        use_second_order: bool = True,
+        urls: Sequence[str | None] | None = None,
+    ) -> list[list[Prediction]]:
+        """Predict next actions for many histories at once.
+        
+        Same fallback rules as predict(), with urls aligned with histories,
+        but each distinct (prev, current) context is looked up once, using
+        set-based storage queries. Results are aligned with histories.
+        """
+        page_preds = self._predict_pages(histories, urls, k)
+        pair_keys = [
+            (history[-2], history[-1])
+            if use_second_order and len(history) >= 2 and not preds
+            else None
+            for history, preds in zip(histories, page_preds)
+        ]
+        second_order = self.storage.get_second_order_top_k_many(
+            {key for key in pair_keys if key is not None}, k
+        )
+        first_order = self.storage.get_first_order_top_k_many(
+            {
+                history[-1]
+                for history, key, preds in zip(histories, pair_keys, page_preds)
+                if history and key not in second_order and not preds
+            },
+            k,
+        )
+        
+        second_preds = {
+            key: _to_predictions(transitions, total, "second_order")
+            for key, (transitions, total) in second_order.items()
+        }
+        first_preds = {
+            key: _to_predictions(transitions, total, "first_order")
+            for key, (transitions, total) in first_order.items()
+        }
+        
+        results = []
+        for i, (history, key, preds) in enumerate(zip(histories, pair_keys, page_preds)):
+            if preds:
+                filled = self.fill(preds, history)
+            elif key in second_preds:
+                filled = self.fill(second_preds[key], history)
+            elif history:
+                results.append(self.fill(first_preds.get(history[-1], []), history))
+                continue
+            else:
+                results.append([])
+                continue
+            if not filled:
+                # Every template was unfillable; back off through predict(),
+                # rare enough to run per history.
+                url = urls[i] if urls is not None else None
+                filled = self.predict(list(history), k, use_second_order, url)
+            results.append(filled)
+        return results
+    
+    def _predict_pages(
+        self,
+        histories: Sequence[Sequence[Action]],
+        urls: Sequence[str | None] | None,
+        k: int,
+    ) -> list[list[Prediction]]:
+        """Page-conditioned predictions aligned with histories, one lookup per distinct context.
+        
+        Histories without a url, or whose page lacks support, get an empty list.
+        """
+        if urls is None or not self.storage.page_context:
+            return [[] for _ in histories]
+        predictions: dict[tuple[str, Action], list[Prediction]] = {}
+        results = []
+        for history, url in zip(histories, urls):
+            pattern = page_pattern(url) if history and url else ""
+            if not pattern:
+                results.append([])
+                continue
+            key = (pattern, history[-1])
+            if key not in predictions:
+                predictions[key] = self.predict_page(url, history[-1], k)
+            results.append(predictions[key])
+        return results
+    
+    def fill(
+        self, predictions: list[Prediction], action_history: Sequence[Action]
+    ) -> list[Prediction]:
+        """Fill predicted templates into executable actions.
+        
+        Returns a new list; predictions are returned as-is without a templater.
+        """
+        return fill_predictions(
+            self.storage.templater, predictions, action_history, self.slot_values
+        )
+
+
+class VariableOrderPredictor(Predictor):
+    """Variable-order Markov predictor backed by the storage context tree.
+    
+    Uses the longest previously seen context of up to the storage's
+    context_order actions, backing off to shorter contexts in the same walk,
+    and to a shorter context again when none of the longer context's
+    templates can be filled. The page of url, when given, is tried first as
+    in Predictor. Confidences are normalized over time-decayed context
+    weights, as in Predictor, while min_support counts raw observations.
+    """
+    
+    def __init__(
+        self,
+        storage: Storage,
+        min_support: int = 1,
+        slot_values: Mapping[str, str] | None = None,
+        min_page_support: int = 3,
+    ):
+        if storage.context_tree is None:
+            raise ValueError("storage must be opened with context_order > 0")
+        super().__init__(storage, slot_values, min_page_support)
+        self.min_support = min_support
+    
+    def predict(
+        self,
+        action_history: list[Action],
+        k: int = 5,
+        use_second_order: bool = True,
+        url: str | None = None,
+    ) -> list[Prediction]:
+        """Predict next actions from the longest matching context.
+        
+        With use_second_order disabled, only the most recent action is used.
+        Prediction source is order_N for the matched context length N.
+        """
+        if not action_history:
+            return []
+        
+        if url and self.storage.page_context:
+            predictions = self.fill(self.predict_page(url, action_history[-1], k), action_history)
+            if predictions:
+                return predictions
+        
+        context = action_history if use_second_order else action_history[-1:]
+        while True:
+            unfilled, order = self._predict_unfilled(context, k)
+            predictions = self.fill(unfilled, action_history)
+            if predictions or order <= 1:
+                return predictions
+            context = context[-(order - 1):]
+    
+    def _predict_unfilled(
+        self, context: Sequence[Action], k: int
+    ) -> tuple[list[Prediction], int]:
+        """Predict from the longest matching context without filling templates.
+        
+        Returns (predictions, length of the matched context).
+        """
+        transitions, total_weight, order = self.storage.get_context_top_k(
+            context, k, self.min_support
+        )
+        return _to_predictions(transitions, total_weight, f"order_{order}"), order
+    
+    def predict_many(
+        self,
+        histories: Sequence[Sequence[Action]],
+        k: int = 5,
+        use_second_order: bool = True,
+        urls: Sequence[str | None] | None = None,
+    ) -> list[list[Prediction]]:
+        """Predict next actions for many histories at once.
+        
+        The context tree lives in memory, so each distinct context is simply
+        walked once. Results are aligned with histories, and urls with them.
+        """
+        order = self.storage.context_tree.max_order if use_second_order else 1
+        page_preds = self._predict_pages(histories, urls, k)
+        predictions: dict[tuple[Action, ...], list[Prediction]] = {}
+        results = []
+        for i, (history, preds) in enumerate(zip(histories, page_preds)):
+            if not history:
+                results.append([])
+                continue
+            if not preds:
+                key = tuple(history[-order:])
+                if key not in predictions:
+                    predictions[key] = self._predict_unfilled(key, k)[0]
+                preds = predictions[key]
+            filled = self.fill(preds, history)
+            if preds and not filled:
+                # Every template was unfillable; back off through predict().
+                url = urls[i] if urls is not None else None
+                filled = self.predict(list(history), k, use_second_order, url)
+            results.append(filled)
+        return results
+
+
+def fill_predictions(
+    templater: Templater | None,
+    predictions: list[Prediction],
+    action_history: Sequence[Action],
+    slot_values: Mapping[str, str],
+) -> list[Prediction]:
+    """Fill predicted templates from the history's bindings over slot_values.
+    
+    Each template is filled from the history actions of other types. Only
+    the first (most confident) prediction of each filled action is kept.
+    Returns a new list; predictions are returned as-is without a templater.
+    """
+    if templater is None:
+        return list(predictions)
+    bindings_by_type: dict[str, dict[str, str]] = {}
+    seen: set[Action] = set()
+    filled = []
+    for prediction in predictions:
+        action_type = prediction.action.type
+        if action_type not in bindings_by_type:
+            bindings_by_type[action_type] = {
+                **slot_values, **templater.bindings(action_history, skip_type=action_type)
+            }
+        action = templater.fill(prediction.action, bindings_by_type[action_type])
+        if action is not None and action not in seen:
+            seen.add(action)
+            filled.append(Prediction(action, prediction.confidence, prediction.source))
+    return filled
+
+
+def _to_predictions(
+    transitions: list[dict[str, Any]], total_weight: float, source: str
+) -> list[Prediction]:
+    """Convert top-K transition rows into predictions.
+    
+    Confidence is the row's decayed weight over the source's total decayed
+    weight. A total that has decayed to zero yields no predictions.
+    """
+    if total_weight <= 0:
+        return []
+    return [
+        Prediction(
+            action=Action.from_json(trans["to_action"]),
+            confidence=trans["weight"] / total_weight,
+            source=source,
+        )
+        for trans in transitions
+    ]
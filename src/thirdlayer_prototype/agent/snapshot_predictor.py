@@ -0,0 +1,164 @@
+"""Predictor answering from a memory-mapped model snapshot.
+
+Needs no database connection, so a fleet of workers can share one frozen
+model file exported with Storage.export_snapshot().
+"""
+import threading
+from typing import Mapping
+
+from thirdlayer_prototype.agent.predictor import Prediction, fill_predictions
+from thirdlayer_prototype.db.snapshot import Snapshot
+from thirdlayer_prototype.models.action import Action
+
+
+class SnapshotPredictor:
+    """Markov predictor over a Snapshot instead of live SQL queries.
+    
+    Same predict() contract as Predictor: second-order first, falling back
+    to first-order, with the same confidences, and templates filled from the
+    history over slot_values with the rules stored in the snapshot
+    (second-order backing off when none of its templates can be filled).
+    
+    reload() maps a newer snapshot and replaces self.snapshot; it does not
+    unmap the old one. A prediction already running keeps its own reference
+    to the old snapshot, and the mapping is released when the last reference
+    is dropped (immediately under CPython's reference counting, at garbage
+    collection elsewhere). Callers that need the old mapping released at a
+    known point should hold on to it and close() it once no prediction uses
+    it.
+    """
+    
+    def __init__(self, path: str, slot_values: Mapping[str, str] | None = None):
+        self.path = path
+        self.slot_values = dict(slot_values or {})
+        self.snapshot = Snapshot(path)
+        self._reload_lock = threading.Lock()
+    
+    def predict_first_order(self, current_action: Action, k: int = 5) -> list[Prediction]:
+        """Predict next actions using the first-order rows.
+        
+        Returns top K predictions sorted by confidence (descending).
+        """
+        return _first_order(self.snapshot, current_action, k)
+    
+    def predict_second_order(
+        self, prev_action: Action, current_action: Action, k: int = 5
+    ) -> list[Prediction]:
+        """Predict next actions using the second-order rows.
+        
+        Returns top K predictions sorted by confidence (descending).
+        """
+        return _second_order(self.snapshot, prev_action, current_action, k)
+    
+    def predict(
+        self,
+        action_history: list[Action],
+        k: int = 5,
+        use_second_order: bool = True,
+        url: str | None = None,
+    ) -> list[Prediction]:
+        """Predict next actions using best available model.
+        
+        Tries second-order if available and enabled, falls back to first-order.
+        The snapshot holds no page context, so url is ignored.
+        """
+        if not action_history:
+            return []
+        
+        # One snapshot for the whole prediction, even if reload() runs meanwhile.
+        snapshot = self.snapshot
+        current_action = action_history[-1]
+        
+        if use_second_order and len(action_history) >= 2:
+            second_order_preds = self._fill(
+                snapshot,
+                _second_order(snapshot, action_history[-2], current_action, k),
+                action_history,
+            )
+            if second_order_preds:
+                return second_order_preds
+        
+        return self._fill(
+            snapshot, _first_order(snapshot, current_action, k), action_history
+        )
+    
+    def fill(
+        self, predictions: list[Prediction], action_history: list[Action]
+    ) -> list[Prediction]:
+        """Fill predicted templates into executable actions, as Predictor.fill does."""
+        return self._fill(self.snapshot, predictions, action_history)
+    
+    def _fill(
+        self, snapshot: Snapshot, predictions: list[Prediction], action_history: list[Action]
+    ) -> list[Prediction]:
+        """Fill predictions with the template rules of snapshot."""
+        return fill_predictions(
+            snapshot.templater, predictions, action_history, self.slot_values
+        )
+    
+    def reload(self, path: str | None = None) -> None:
+        """Map the snapshot at path (default: self.path) and swap it in.
+        
+        The replaced snapshot is not closed; see the class docstring.
+        Raises ValueError, keeping the current snapshot, if the file is not
+        a valid snapshot.
+        """
+        with self._reload_lock:
+            snapshot = Snapshot(path or self.path)
+            self.path = snapshot.path
+            self.snapshot = snapshot
+    
+    def reload_if_changed(self) -> bool:
+        """Reload when the file at self.path was replaced since it was mapped.
+        
+        Returns whether a new snapshot was swapped in.
+        """
+        if self.snapshot.same_file(self.path):
+            return False
+        self.reload()
+        return True
+    
+    def close(self) -> None:
+        """Unmap the current snapshot; predictions fail afterwards."""
+        self.snapshot.close()
+
+
+def _state_index(snapshot: Snapshot, action: Action) -> int | None:
+    """Vocab index of the state of action: its template's, when templated."""
+    if snapshot.templater is not None:
+        action = snapshot.templater.template(action)
+    return snapshot.index_of(action.signature())
+
+
+def _first_order(snapshot: Snapshot, current_action: Action, k: int) -> list[Prediction]:
+    """Top K unfilled first-order predictions from snapshot."""
+    index = _state_index(snapshot, current_action)
+    if index is None:
+        return []
+    return _to_predictions(snapshot, snapshot.first_order_top_k(index, k), "first_order")
+
+
+def _second_order(
+    snapshot: Snapshot, prev_action: Action, current_action: Action, k: int
+) -> list[Prediction]:
+    """Top K unfilled second-order predictions from snapshot."""
+    prev = _state_index(snapshot, prev_action)
+    current = _state_index(snapshot, current_action)
+    if prev is None or current is None:
+        return []
+    rows = snapshot.second_order_top_k(prev, current, k)
+    return _to_predictions(snapshot, rows, "second_order")
+
+
+def _to_predictions(
+    snapshot: Snapshot, rows: list[tuple[int, float]], source: str
+) -> list[Prediction]:
+    """Convert (successor index, confidence) rows into predictions."""
+    return [
+        Prediction(
+            action=Action.from_json(snapshot.signature(index)),
+            confidence=confidence,
+            source=source,
+        )
+        for index, confidence in rows
+    ]
@@ -0,0 +1,243 @@
+"""Structured trace spans for agent steps and stages.
+
+Finished spans go to a fixed-size in-memory ring buffer and, optionally, to
+a JSONL file written in batches by a background task. read_recent_spans()
+tails that file, so another process (the API server) can serve the spans.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Iterator
+
+
+@dataclass
+class Span:
+    """One timed unit of work: a loop step or one of its stages."""
+    
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None = None
+    start_time: float = 0.0
+    duration: float = 0.0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+    
+    def set(self, **attributes: Any) -> None:
+        """Attach attributes to the span."""
+        self.attributes.update(attributes)
+    
+    def to_dict(self) -> dict[str, Any]:
+        """Convert to dictionary."""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": self.duration * 1000,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class JsonlSpanSink:
+    """Appends spans to a JSONL file from a background task.
+    
+    emit() never blocks: spans are queued, and the writer task drains up to
+    batch_size of them per write, off the event loop. When the queue is
+    full, new spans are dropped and counted.
+    """
+    
+    def __init__(
+        self,
+        path: str = "thirdlayer_traces.jsonl",
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        max_queue: int = 10_000,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue(maxsize=max_queue)
+        self._task: asyncio.Task | None = None
+    
+    def start(self) -> None:
+        """Start the writer task on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    def emit(self, span: Span) -> None:
+        """Queue a finished span for writing."""
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except asyncio.QueueFull:
+            self.dropped += 1
+    
+    async def close(self) -> None:
+        """Write every queued span and stop the writer task."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+    
+    async def _run(self) -> None:
+        """Write queued spans in batches until close() queues the None sentinel."""
+        while True:
+            batch = []
+            record = await self._queue.get()
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= self.batch_size or self._queue.empty():
+                    break
+                record = self._queue.get_nowait()
+            if batch:
+                await asyncio.to_thread(self._write, batch)
+            if record is None:
+                return
+            if self._queue.qsize() < self.batch_size:
+                await asyncio.sleep(self.flush_interval)
+    
+    def _write(self, records: list[dict[str, Any]]) -> None:
+        """Append records to the file, one JSON object per line."""
+        with open(self.path, "a") as f:
+            f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+
+
+class Tracer:
+    """Records spans into a ring buffer of the most recent capacity spans."""
+    
+    def __init__(self, capacity: int = 2048, sink: JsonlSpanSink | None = None):
+        self.spans: deque[Span] = deque(maxlen=capacity)
+        self.sink = sink
+    
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        parent: Span | None = None,
+        trace_id: str | None = None,
+        **attributes: Any,
+    ) -> Iterator[Span]:
+        """Time the enclosed block as a span.
+        
+        Child spans inherit the parent's trace_id. An exception escaping the
+        block is recorded as the span's error and re-raised.
+        """
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else trace_id or new_id(),
+            span_id=new_id(),
+            parent_id=parent.span_id if parent else None,
+            start_time=time.time(),
+            attributes=attributes,
+        )
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}_{str(e)[:100]}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            self.spans.append(span)
+            if self.sink is not None:
+                self.sink.emit(span)
+    
+    def recent(
+        self,
+        limit: int = 100,
+        name: str | None = None,
+        trace_id: str | None = None,
+        min_duration_ms: float = 0.0,
+    ) -> list[dict[str, Any]]:
+        """Get the most recent matching spans, newest first."""
+        records = (span.to_dict() for span in reversed(self.spans))
+        return _filter_spans(records, limit, name, trace_id, min_duration_ms)
+
+
+def read_recent_spans(
+    path: str,
+    limit: int = 100,
+    name: str | None = None,
+    trace_id: str | None = None,
+    min_duration_ms: float = 0.0,
+    block_size: int = 64 * 1024,
+) -> list[dict[str, Any]]:
+    """Get the most recent matching spans from a JSONL sink file, newest first.
+    
+    The file is read backwards a block at a time and reading stops once
+    limit spans matched, so the cost depends on how far back the matches
+    are, not on the file size. A missing file has no spans; lines that do
+    not parse (a batch still being appended) are skipped.
+    """
+    try:
+        with open(path, "rb") as f:
+            return _filter_spans(
+                _parse_lines(_reversed_lines(f, block_size)),
+                limit,
+                name,
+                trace_id,
+                min_duration_ms,
+            )
+    except FileNotFoundError:
+        return []
+
+
+def _filter_spans(
+    records: Iterator[dict[str, Any]],
+    limit: int,
+    name: str | None,
+    trace_id: str | None,
+    min_duration_ms: float,
+) -> list[dict[str, Any]]:
+    """Take up to limit span records matching every given filter."""
+    results = []
+    for record in records:
+        if len(results) >= limit:
+            break
+        if name is not None and record["name"] != name:
+            continue
+        if trace_id is not None and record["trace_id"] != trace_id:
+            continue
+        if record["duration_ms"] < min_duration_ms:
+            continue
+        results.append(record)
+    return results
+
+
+def _reversed_lines(f: BinaryIO, block_size: int) -> Iterator[bytes]:
+    """Yield the lines of a binary file from last to first."""
+    position = f.seek(0, os.SEEK_END)
+    tail = b""
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        lines = (f.read(size) + tail).split(b"\n")
+        # The first piece may continue in the previous block.
+        tail = lines.pop(0)
+        yield from reversed(lines)
+    yield tail
+
+
+def _parse_lines(lines: Iterator[bytes]) -> Iterator[dict[str, Any]]:
+    """Decode JSON span records, skipping blank and partial lines."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+def new_id() -> str:
+    """Random 64-bit hex id for traces and spans."""
+    return os.urandom(8).hex()
@@ -4,24 +4,46 @@ from typing import Any
 from playwright.async_api import Page
 
 from thirdlayer_prototype.models.action import Action
+from thirdlayer_prototype.agent.denylist import Denylist
 
 
-DENYLIST_PATTERNS = [
-    "logout",
-    "log-out",
-    "sign-out",
-    "signout",
-    "delete",
-    "remove",
-    "submit",
-    "purchase",
-    "buy",
-    "payment",
-    "checkout",
-    "account",
-    "settings",
-    "preferences",
-]
+# Checks every selector in one round trip; null marks a selector that is not
+# valid CSS (e.g. a Playwright text= or xpath= selector). querySelector does
+# not look inside shadow roots, so false only means "not in the light DOM".
+# Searches the document, then every open shadow root (collected once, and
+# only if some selector is missing from the document). null marks a
+# selector querySelector cannot parse.
+_SELECTORS_EXIST_JS = """
+(selectors) => {
+    let roots = null;
+    const shadowRoots = () => {
+        if (roots === null) {
+            roots = [];
+            const pending = [document];
+            while (pending.length) {
+                for (const element of pending.pop().querySelectorAll("*")) {
+                    if (element.shadowRoot) {
+                        roots.push(element.shadowRoot);
+                        pending.push(element.shadowRoot);
+                    }
+                }
+            }
+        }
+        return roots;
+    };
+    return selectors.map((selector) => {
+        try {
+            return document.querySelector(selector) !== null
+                || shadowRoots().some((root) => root.querySelector(selector) !== null);
+        } catch (e) {
+            return null;
+        }
+    });
+}
+"""
+
+# Action types that target an element and need its selector on the page.
+SELECTOR_ACTION_TYPES = ("click", "type", "wait_for", "extract")
 
 
 @dataclass
@@ -37,10 +59,15 @@ class ValidationResult:
 
 
 class Validator:
-    """Validates actions before execution."""
+    """Validates actions before execution.
+    
+    Validation is split into static checks, which need only the action, and
+    a DOM check, which needs a page round trip. validate() runs both.
+    """
     
-    def __init__(self, page: Page):
+    def __init__(self, page: Page, denylist: Denylist | None = None):
         self.page = page
+        self.denylist = denylist or Denylist()
     
     async def validate(self, action: Action) -> ValidationResult:
         """Validate action for safety and feasibility.
@@ -49,24 +76,51 @@ class Validator:
         1. Denylist patterns (destructive actions)
         2. Selector existence (when relevant)
         """
-        if action.type in ["click", "type", "wait_for", "extract"]:
-            if not action.selector:
-                return ValidationResult(
-                    valid=False,
-                    reason=f"missing_selector_for_{action.type}",
-                )
-            
-            if self._is_denylisted(action.selector):
-                return ValidationResult(
+        result = self.check_static(action)
+        if not result.valid or not needs_dom_check(action):
+            return result
+        return await self.check_dom(action)
+    
+    async def validate_many(
+        self,
+        actions: list[Action],
+        static: list[ValidationResult] | None = None,
+    ) -> list[ValidationResult]:
+        """Validate many actions with a single page round trip.
+        
+        Args:
+            actions: Candidate actions, e.g. the planner's top K.
+            static: Precomputed check_static() results for actions, if any.
+        
+        Returns:
+            One ValidationResult per action, in order.
+        """
+        if static is None:
+            static = [self.check_static(action) for action in actions]
+        selectors = list(dict.fromkeys(
+            action.selector
+            for action, result in zip(actions, static)
+            if result.valid and needs_dom_check(action)
+        ))
+        found = await self._selectors_exist(selectors) if selectors else {}
+        
+        results = []
+        for action, result in zip(actions, static):
+            if result.valid and needs_dom_check(action) and not found[action.selector]:
+                result = ValidationResult(
                     valid=False,
-                    reason=f"selector_matches_denylist_pattern",
+                    reason=f"selector_not_found_{action.selector}",
                 )
-            
-            exists = await self._selector_exists(action.selector)
-            if not exists:
+            results.append(result)
+        return results
+    
+    def check_static(self, action: Action) -> ValidationResult:
+        """Run the checks that need no page: required fields and denylist."""
+        if action.type in SELECTOR_ACTION_TYPES:
+            if not action.selector:
                 return ValidationResult(
                     valid=False,
-                    reason=f"selector_not_found_{action.selector}",
+                    reason=f"missing_selector_for_{action.type}",
                 )
         
         if action.type == "navigate":
@@ -83,12 +137,42 @@ class Validator:
                     reason="missing_key_for_press",
                 )
         
+        denied = self.denylist.check(action)
+        if denied:
+            return ValidationResult(valid=False, reason=denied)
+        
+        return ValidationResult(valid=True, reason="passed_all_checks")
+    
+    async def check_dom(self, action: Action) -> ValidationResult:
+        """Check that the action's selector exists on the current page."""
+        exists = await self._selector_exists(action.selector)
+        if not exists:
+            return ValidationResult(
+                valid=False,
+                reason=f"selector_not_found_{action.selector}",
+            )
         return ValidationResult(valid=True, reason="passed_all_checks")
     
-    def _is_denylisted(self, selector: str) -> bool:
-        """Check if selector contains denylist patterns."""
-        selector_lower = selector.lower()
-        return any(pattern in selector_lower for pattern in DENYLIST_PATTERNS)
+    async def _selectors_exist(self, selectors: list[str]) -> dict[str, bool]:
+        """Check many selectors with one page.evaluate call.
+        
+        The page script searches the document and its open shadow roots, so
+        a missing selector costs no extra round trip. Only selectors the
+        browser cannot parse as CSS (Playwright's own engines, such as
+        text=), or all of them if the script fails, fall back to a locator
+        count each.
+        """
+        try:
+            found = await self.page.evaluate(_SELECTORS_EXIST_JS, selectors)
+        except Exception:
+            found = [None] * len(selectors)
+        
+        results = {}
+        for selector, exists in zip(selectors, found):
+            if exists is None:
+                exists = await self._selector_exists(selector)
+            results[selector] = exists
+        return results
     
     async def _selector_exists(self, selector: str, timeout: int = 2000) -> bool:
         """Check if selector exists on page.
@@ -100,3 +184,8 @@ class Validator:
             return count > 0
         except Exception:
             return False
+
+
+def needs_dom_check(action: Action) -> bool:
+    """Whether validating action requires a page round trip."""
+    return action.type in SELECTOR_ACTION_TYPES and bool(action.selector)
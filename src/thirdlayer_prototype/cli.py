@@ -0,0 +1,281 @@
+"""Command-line entry points for offline tooling.
+
+Usage: thirdlayer <command> [options]  (or python -m thirdlayer_prototype.cli)
+"""
+import argparse
+import itertools
+import json
+import sys
+
+from thirdlayer_prototype.agent.planner import Planner
+from thirdlayer_prototype.agent.predictor import Predictor, VariableOrderPredictor
+from thirdlayer_prototype.db.archive import archive_sessions, iter_archived_sessions
+from thirdlayer_prototype.db.compaction import Compactor, compact_database
+from thirdlayer_prototype.db.rebuild import rebuild_transitions
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.eval.replay import (
+    ReplayEvaluator,
+    load_sessions_from_jsonl,
+    split_sessions,
+    train_storage,
+)
+from thirdlayer_prototype.models.template import Templater
+
+
+def _make_predictor(storage: Storage, context_order: int) -> Predictor:
+    """Pick the predictor matching the requested model order."""
+    if context_order > 0:
+        return VariableOrderPredictor(storage)
+    return Predictor(storage)
+
+
+def run_replay(args: argparse.Namespace) -> int:
+    """Replay recorded sessions and print an accuracy/latency report."""
+    source_storage = None
+    if args.jsonl:
+        sessions = load_sessions_from_jsonl(args.jsonl)
+    else:
+        source_storage = Storage(
+            args.db, cache_transitions=True, context_order=args.context_order
+        )
+        source_storage.connect()
+        sessions = source_storage.iter_sessions(gap_seconds=args.gap)
+    if args.archive:
+        sessions = itertools.chain(iter_archived_sessions(args.archive), sessions)
+    
+    # A templated model is trained from the log, whatever the database holds.
+    templater = Templater() if args.templates else None
+    model_storage = source_storage
+    if args.test_fraction > 0 or source_storage is None or templater is not None:
+        train, test = split_sessions(
+            sessions, args.test_fraction, shuffle=args.shuffle, seed=args.seed
+        )
+        if args.test_fraction == 0:
+            test = train
+        model_storage = train_storage(
+            train, context_order=args.context_order, templater=templater
+        )
+        sessions = test
+    
+    evaluator = ReplayEvaluator(
+        _make_predictor(model_storage, args.context_order),
+        Planner(args.threshold),
+        k=args.k,
+        use_second_order=not args.first_order_only,
+    )
+    report = evaluator.evaluate(sessions)
+    print(json.dumps(report.to_dict(), indent=2))
+    
+    model_storage.close()
+    if source_storage is not None:
+        source_storage.close()
+    return 0
+
+
+def run_compact(args: argparse.Namespace) -> int:
+    """Compact the transition tables and print a before/after report."""
+    compactor = Compactor(
+        max_successors=args.max_successors,
+        min_count=args.min_count,
+        min_age_seconds=args.min_age,
+        vacuum_pages=args.vacuum_pages,
+        full_vacuum=args.full_vacuum,
+    )
+    report = compact_database(args.db, compactor)
+    print(json.dumps(report.to_dict(), indent=2))
+    return 0
+
+
+def run_archive(args: argparse.Namespace) -> int:
+    """Move old sessions from the actions log to archive segments."""
+    storage = Storage(args.db, wal=True, reader_pool_size=1)
+    storage.connect()
+    try:
+        report = archive_sessions(
+            storage,
+            args.dir,
+            older_than_seconds=args.older_than,
+            max_sessions_per_segment=args.max_sessions_per_segment,
+        )
+    finally:
+        storage.close()
+    print(json.dumps(report.to_dict(), indent=2))
+    return 0
+
+
+def run_rebuild(args: argparse.Namespace) -> int:
+    """Recount the transition tables from the actions log and archives."""
+    storage = Storage(args.db, wal=True, reader_pool_size=1, page_context=args.page_context)
+    storage.connect()
+    try:
+        report = rebuild_transitions(
+            storage,
+            archive_dir=args.archive,
+            workers=args.workers,
+            context_order=args.context_order,
+            half_life=args.half_life,
+            drop_failed=args.drop_failed,
+            templater=Templater() if args.templates else None,
+        )
+    finally:
+        storage.close()
+    print(json.dumps(report.to_dict(), indent=2))
+    return 0
+
+
+def run_snapshot(args: argparse.Namespace) -> int:
+    """Export the transition model to a memory-mappable snapshot file."""
+    storage = Storage(args.db)
+    storage.connect(read_only=True)
+    try:
+        info = storage.export_snapshot(args.out)
+    finally:
+        storage.close()
+    print(json.dumps({"path": args.out, **info.to_dict()}, indent=2))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser with one subcommand per tool."""
+    parser = argparse.ArgumentParser(prog="thirdlayer", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    replay = commands.add_parser(
+        "replay", help="evaluate prediction accuracy offline over recorded sessions"
+    )
+    replay.add_argument("--db", default="thirdlayer.db", help="SQLite database path")
+    replay.add_argument("--jsonl", help="read sessions from a JSONL file instead of --db")
+    replay.add_argument(
+        "--archive", help="replay the sessions archived in this directory first"
+    )
+    replay.add_argument(
+        "--test-fraction",
+        type=float,
+        default=0.0,
+        help="hold out this fraction of sessions and train on the rest (0 = in-sample)",
+    )
+    replay.add_argument("--shuffle", action="store_true", help="shuffle before splitting")
+    replay.add_argument("--seed", type=int, default=0, help="shuffle seed")
+    replay.add_argument("-k", type=int, default=5, help="number of candidates per step")
+    replay.add_argument("--threshold", type=float, default=0.5, help="planner threshold")
+    replay.add_argument(
+        "--context-order",
+        type=int,
+        default=0,
+        help="use the variable-order predictor with this max order (0 = first/second order)",
+    )
+    replay.add_argument(
+        "--first-order-only", action="store_true", help="disable second-order predictions"
+    )
+    replay.add_argument(
+        "--templates",
+        action="store_true",
+        help="train the model over action templates with the default rules",
+    )
+    replay.add_argument(
+        "--gap",
+        type=float,
+        default=1800.0,
+        help="seconds of inactivity that split the actions log into sessions",
+    )
+    replay.set_defaults(func=run_replay)
+    
+    compact = commands.add_parser(
+        "compact", help="prune long-tail transitions and return free pages to the filesystem"
+    )
+    compact.add_argument("--db", default="thirdlayer.db", help="SQLite database path")
+    compact.add_argument(
+        "--max-successors", type=int, default=64, help="successors kept per source state"
+    )
+    compact.add_argument(
+        "--min-count", type=int, default=2, help="drop successors seen fewer times than this"
+    )
+    compact.add_argument(
+        "--min-age",
+        type=float,
+        default=7 * 24 * 3600.0,
+        help="only drop low-count successors not seen for this many seconds",
+    )
+    compact.add_argument(
+        "--vacuum-pages", type=int, default=1000, help="pages freed per incremental vacuum step"
+    )
+    compact.add_argument(
+        "--full-vacuum",
+        action="store_true",
+        help="run one full VACUUM to enable incremental vacuum on older databases",
+    )
+    compact.set_defaults(func=run_compact)
+    
+    archive = commands.add_parser(
+        "archive", help="move old sessions from the actions log to compressed segment files"
+    )
+    archive.add_argument("--db", default="thirdlayer.db", help="SQLite database path")
+    archive.add_argument("--dir", default="archive", help="directory for segment files")
+    archive.add_argument(
+        "--older-than",
+        type=float,
+        default=30 * 24 * 3600.0,
+        help="archive sessions with no action for this many seconds",
+    )
+    archive.add_argument(
+        "--max-sessions-per-segment",
+        type=int,
+        default=10_000,
+        help="sessions written to each segment file",
+    )
+    archive.set_defaults(func=run_archive)
+    
+    rebuild = commands.add_parser(
+        "rebuild", help="recount the transition tables from the actions log and archives"
+    )
+    rebuild.add_argument("--db", default="thirdlayer.db", help="SQLite database path")
+    rebuild.add_argument("--archive", help="also count the sessions archived in this directory")
+    rebuild.add_argument(
+        "--workers", type=int, help="worker processes (default: one per core)"
+    )
+    rebuild.add_argument(
+        "--context-order",
+        type=int,
+        help="longest variable-order context to count (default: keep the current one)",
+    )
+    rebuild.add_argument(
+        "--half-life",
+        type=float,
+        help="decay half-life in seconds, 0 for none (default: keep the current one)",
+    )
+    rebuild.add_argument(
+        "--drop-failed",
+        action="store_true",
+        help="drop failed actions from sessions before counting, like the agent loop",
+    )
+    rebuild.add_argument(
+        "--templates",
+        action="store_true",
+        help="count transitions over action templates with the default rules "
+        "(default: keep the database's rules)",
+    )
+    rebuild.add_argument(
+        "--page-context",
+        action="store_true",
+        help="also count transitions per page pattern of the logged URLs",
+    )
+    rebuild.set_defaults(func=run_rebuild)
+    
+    snapshot = commands.add_parser(
+        "snapshot", help="export the transition model to a read-only, memory-mappable file"
+    )
+    snapshot.add_argument("--db", default="thirdlayer.db", help="SQLite database path")
+    snapshot.add_argument("--out", default="thirdlayer.snap", help="snapshot file path")
+    snapshot.set_defaults(func=run_snapshot)
+    
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    """CLI entrypoint."""
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 """Database package initialization."""
 from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.db.async_storage import AsyncStorage
 
-__all__ = ["Storage"]
+__all__ = ["Storage", "AsyncStorage"]
@@ -0,0 +1,220 @@
+"""Retention for the actions log: archive old sessions to compressed segments.
+
+Sessions whose last action is older than the retention window move out of
+the hot database into gzip JSONL segment files, one line per session:
+
+    {"session_id": ..., "actions": [...], "timestamps": [...],
+     "urls": [...], "successes": [...]}
+
+Segments are append-only: every archive run writes new files and never
+rewrites old ones. Learned transitions stay in the database; only the raw
+log moves, so the full history remains available for retraining.
+
+A segment is written as a .tmp file and fsynced. Its sessions are then
+deleted and the segment is recorded in archive_segments, in one transaction,
+and only then is the file renamed into place. A run interrupted in between
+is completed or rolled back by the next run.
+"""
+import gzip
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from thirdlayer_prototype.db.compaction import release_free_pages
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import Action
+
+
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+# Bound on bound parameters per statement when selecting sessions.
+_SESSION_CHUNK_SIZE = 500
+
+
+@dataclass
+class ArchiveReport:
+    """Segments written and what moved out of the hot database."""
+    
+    segments: list[str] = field(default_factory=list)
+    sessions: int = 0
+    actions: int = 0
+    
+    def to_dict(self) -> dict[str, Any]:
+        """Convert report to dictionary."""
+        return {
+            "segments": self.segments,
+            "sessions": self.sessions,
+            "actions": self.actions,
+        }
+
+
+def archive_sessions(
+    storage: Storage,
+    directory: str | os.PathLike,
+    older_than_seconds: float = 30 * 24 * 3600.0,
+    max_sessions_per_segment: int = 10_000,
+    now: float | None = None,
+) -> ArchiveReport:
+    """Move sessions idle for older_than_seconds into new archive segments.
+    
+    Freed pages are returned to the filesystem when the database uses
+    incremental auto_vacuum. Must not be called inside storage.batch().
+    """
+    if storage._batch_depth:
+        raise RuntimeError("cannot archive inside batch()")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    _recover_segments(storage, directory)
+    
+    now = time.time() if now is None else now
+    session_ids = [
+        row[0]
+        for row in storage.conn.execute(
+            """
+            SELECT session_id FROM actions
+            GROUP BY session_id
+            HAVING MAX(timestamp) < ?
+            ORDER BY MIN(timestamp)
+            """,
+            (now - older_than_seconds,),
+        )
+    ]
+    
+    report = ArchiveReport()
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now))
+    sequence = storage.conn.execute("SELECT COUNT(*) FROM archive_segments").fetchone()[0]
+    for begin in range(0, len(session_ids), max_sessions_per_segment):
+        chunk = session_ids[begin:begin + max_sessions_per_segment]
+        # The sequence number keeps names unique and sorting oldest first.
+        sequence += 1
+        name = f"segment-{sequence:06d}-{stamp}{SEGMENT_SUFFIX}"
+        actions, first, last = _write_segment(storage, directory / f"{name}.tmp", chunk)
+        
+        with storage.batch():
+            for ids in _chunks(chunk, _SESSION_CHUNK_SIZE):
+                placeholders = ", ".join("?" * len(ids))
+                storage.conn.execute(
+                    f"DELETE FROM actions WHERE session_id IN ({placeholders})", ids
+                )
+            storage.conn.execute(
+                """
+                INSERT INTO archive_segments
+                    (name, sessions, actions, first_timestamp, last_timestamp, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (name, len(chunk), actions, first, last, now),
+            )
+        os.replace(directory / f"{name}.tmp", directory / name)
+        
+        report.segments.append(name)
+        report.sessions += len(chunk)
+        report.actions += actions
+    
+    if report.segments:
+        release_free_pages(storage.conn)
+    return report
+
+
+def _write_segment(
+    storage: Storage, path: Path, session_ids: list[str]
+) -> tuple[int, float | None, float | None]:
+    """Write sessions to a gzip JSONL file and fsync it.
+    
+    Returns (actions written, first timestamp, last timestamp).
+    """
+    actions = 0
+    first = last = None
+    with open(path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for record in _session_records(storage, session_ids):
+                f.write((json.dumps(record) + "\n").encode("utf-8"))
+                actions += len(record["actions"])
+                first = record["timestamps"][0] if first is None else first
+                last = record["timestamps"][-1]
+        raw.flush()
+        os.fsync(raw.fileno())
+    return actions, first, last
+
+
+def _session_records(storage: Storage, session_ids: list[str]) -> Iterator[dict[str, Any]]:
+    """Read whole sessions from the actions table, in the given order."""
+    for ids in _chunks(session_ids, _SESSION_CHUNK_SIZE):
+        placeholders = ", ".join("?" * len(ids))
+        records: dict[str, dict[str, Any]] = {}
+        for session_id, action_json, timestamp, url, success in storage.conn.execute(
+            f"""
+            SELECT session_id, action_json, timestamp, url, success
+            FROM actions
+            WHERE session_id IN ({placeholders})
+            ORDER BY session_id, timestamp, id
+            """,
+            ids,
+        ):
+            record = records.get(session_id)
+            if record is None:
+                record = records[session_id] = {
+                    "session_id": session_id,
+                    "actions": [],
+                    "timestamps": [],
+                    "urls": [],
+                    "successes": [],
+                }
+            record["actions"].append(json.loads(action_json))
+            record["timestamps"].append(timestamp)
+            record["urls"].append(url)
+            record["successes"].append(bool(success))
+        for session_id in ids:
+            yield records[session_id]
+
+
+def _recover_segments(storage: Storage, directory: Path) -> None:
+    """Finish or discard segments left behind by an interrupted run.
+    
+    A .tmp file listed in archive_segments was committed and only needs its
+    rename; any other .tmp file never committed and is removed.
+    """
+    committed = {row[0] for row in storage.conn.execute("SELECT name FROM archive_segments")}
+    for tmp in directory.glob(f"*{SEGMENT_SUFFIX}.tmp"):
+        name = tmp.name[: -len(".tmp")]
+        if name in committed:
+            os.replace(tmp, directory / name)
+        else:
+            tmp.unlink()
+
+
+def list_segments(directory: str | os.PathLike) -> list[Path]:
+    """Get the segment files in a directory, oldest first."""
+    return sorted(Path(directory).glob(f"*{SEGMENT_SUFFIX}"))
+
+
+def iter_segment(path: str | os.PathLike) -> Iterator[dict[str, Any]]:
+    """Stream the session records of one segment file."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_archived_sessions(directory: str | os.PathLike) -> Iterator[list[Action]]:
+    """Stream archived sessions, oldest segment first.
+    
+    Failed actions are dropped, like Storage.iter_sessions().
+    """
+    for path in list_segments(directory):
+        for record in iter_segment(path):
+            session = [
+                Action.from_dict(action)
+                for action, success in zip(record["actions"], record["successes"])
+                if success
+            ]
+            if session:
+                yield session
+
+
+def _chunks(items: list[Any], size: int) -> Iterable[list[Any]]:
+    """Yield consecutive slices of at most size items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
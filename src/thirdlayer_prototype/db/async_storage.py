@@ -0,0 +1,84 @@
+"""Awaitable read-only storage facade for async callers.
+
+Runs Storage queries on a bounded thread pool so they never block the event
+loop. Each worker thread lazily opens its own read-only connection.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any
+
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import Action
+
+
+class AsyncStorage:
+    """Async facade over per-thread read-only Storage connections."""
+    
+    def __init__(self, db_path: str = "thirdlayer.db", max_workers: int = 4):
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="thirdlayer-db"
+        )
+        self._local = threading.local()
+        self._readers: list[Storage] = []
+        self._readers_lock = threading.Lock()
+    
+    def _reader(self) -> Storage:
+        """Get this worker thread's read-only Storage, opening it on first use."""
+        storage = getattr(self._local, "storage", None)
+        if storage is None:
+            storage = Storage(self.db_path)
+            storage.connect(read_only=True)
+            self._local.storage = storage
+            with self._readers_lock:
+                self._readers.append(storage)
+        return storage
+    
+    def _call(self, method: str, *args: Any) -> Any:
+        """Invoke a Storage method on the current worker's connection."""
+        return getattr(self._reader(), method)(*args)
+    
+    async def _run(self, method: str, *args: Any) -> Any:
+        """Run a Storage method on the thread pool and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(self._call, method, *args))
+    
+    async def get_top_transitions(self, k: int = 10) -> list[dict[str, Any]]:
+        """Get top K most common transitions (first-order)."""
+        return await self._run("get_top_transitions", k)
+    
+    async def get_total_transition_count(self) -> int:
+        """Get total number of recorded transitions."""
+        return await self._run("get_total_transition_count")
+    
+    async def get_recent_actions(self, limit: int = 10) -> list[Action]:
+        """Get most recent actions."""
+        return await self._run("get_recent_actions", limit)
+    
+    async def get_first_order_top_k(
+        self, from_action: Action, k: int = 5
+    ) -> tuple[list[dict[str, Any]], float]:
+        """Get the K highest-weighted first-order successors of an action."""
+        return await self._run("get_first_order_top_k", from_action, k)
+    
+    async def get_second_order_top_k(
+        self, from_action_1: Action, from_action_2: Action, k: int = 5
+    ) -> tuple[list[dict[str, Any]], float]:
+        """Get the K highest-weighted second-order successors of an action pair."""
+        return await self._run("get_second_order_top_k", from_action_1, from_action_2, k)
+    
+    async def get_page_top_k(
+        self, url: str, from_action: Action, k: int = 5, min_support: int = 1
+    ) -> tuple[list[dict[str, Any]], float]:
+        """Get the K highest-weighted successors of an action on the page of url."""
+        return await self._run("get_page_top_k", url, from_action, k, min_support)
+    
+    def close(self) -> None:
+        """Wait for running queries, then close every worker connection."""
+        self._executor.shutdown(wait=True)
+        with self._readers_lock:
+            for storage in self._readers:
+                storage.close()
+            self._readers.clear()
@@ -0,0 +1,184 @@
+"""In-memory mirror of the transition tables.
+
+Holds first-order, second-order and page-conditioned counts and stored
+decay weights as
+dict-of-counters so predictions can be answered without touching SQLite.
+Storage keeps it write-through.
+"""
+import heapq
+import sqlite3
+from collections import Counter
+
+
+class TransitionCache:
+    """Dict-of-counters copy of the transition tables keyed by action id.
+    
+    Weights are kept in the stored, epoch-scaled units; callers apply the
+    decay scale on read, as for rows read from SQLite.
+    """
+    
+    def __init__(self):
+        self.first_order: dict[int, Counter[int]] = {}
+        self.second_order: dict[tuple[int, int], Counter[int]] = {}
+        self.first_order_counts: dict[int, Counter[int]] = {}
+        self.second_order_counts: dict[tuple[int, int], Counter[int]] = {}
+        self.first_order_totals: dict[int, float] = {}
+        self.second_order_totals: dict[tuple[int, int], float] = {}
+        self.page: dict[tuple[int, int], Counter[int]] = {}
+        self.page_counts: dict[tuple[int, int], Counter[int]] = {}
+        self.page_totals: dict[tuple[int, int], float] = {}
+        self.page_count_totals: dict[tuple[int, int], int] = {}
+    
+    def load(self, conn: sqlite3.Connection) -> None:
+        """Warm the cache from the transition tables."""
+        self.clear()
+        for from_id, to_id, count, weight in conn.execute(
+            "SELECT from_id, to_id, count, weight FROM transitions_first_order"
+        ):
+            self.add_first_order(from_id, to_id, count, weight)
+        for id_1, id_2, to_id, count, weight in conn.execute(
+            "SELECT from_id_1, from_id_2, to_id, count, weight FROM transitions_second_order"
+        ):
+            self.add_second_order(id_1, id_2, to_id, count, weight)
+        for page_id, from_id, to_id, count, weight in conn.execute(
+            "SELECT page_id, from_id, to_id, count, weight FROM transitions_page"
+        ):
+            self.add_page(page_id, from_id, to_id, count, weight)
+        # Totals include the weight of rows removed by compaction.
+        for from_id, weight in conn.execute(
+            "SELECT from_id, weight FROM transition_totals_first_order"
+        ):
+            if from_id in self.first_order:
+                self.first_order_totals[from_id] = weight
+        for id_1, id_2, weight in conn.execute(
+            "SELECT from_id_1, from_id_2, weight FROM transition_totals_second_order"
+        ):
+            if (id_1, id_2) in self.second_order:
+                self.second_order_totals[(id_1, id_2)] = weight
+        for page_id, from_id, total, weight in conn.execute(
+            "SELECT page_id, from_id, total, weight FROM transition_totals_page"
+        ):
+            if (page_id, from_id) in self.page:
+                self.page_totals[(page_id, from_id)] = weight
+                self.page_count_totals[(page_id, from_id)] = total
+    
+    def clear(self) -> None:
+        """Drop all cached counts."""
+        self.first_order.clear()
+        self.second_order.clear()
+        self.first_order_counts.clear()
+        self.second_order_counts.clear()
+        self.first_order_totals.clear()
+        self.second_order_totals.clear()
+        self.page.clear()
+        self.page_counts.clear()
+        self.page_totals.clear()
+        self.page_count_totals.clear()
+    
+    def add_first_order(
+        self, from_id: int, to_id: int, count: int = 1, weight: float | None = None
+    ) -> None:
+        """Increment a first-order transition count and weight (default: count)."""
+        weight = count if weight is None else weight
+        counter = self.first_order.get(from_id)
+        if counter is None:
+            counter = self.first_order[from_id] = Counter()
+            self.first_order_counts[from_id] = Counter()
+        counter[to_id] += weight
+        self.first_order_counts[from_id][to_id] += count
+        self.first_order_totals[from_id] = self.first_order_totals.get(from_id, 0) + weight
+    
+    def add_second_order(
+        self, id_1: int, id_2: int, to_id: int, count: int = 1, weight: float | None = None
+    ) -> None:
+        """Increment a second-order transition count and weight (default: count)."""
+        weight = count if weight is None else weight
+        key = (id_1, id_2)
+        counter = self.second_order.get(key)
+        if counter is None:
+            counter = self.second_order[key] = Counter()
+            self.second_order_counts[key] = Counter()
+        counter[to_id] += weight
+        self.second_order_counts[key][to_id] += count
+        self.second_order_totals[key] = self.second_order_totals.get(key, 0) + weight
+    
+    def add_page(
+        self,
+        page_id: int,
+        from_id: int,
+        to_id: int,
+        count: int = 1,
+        weight: float | None = None,
+    ) -> None:
+        """Increment a page-conditioned transition count and weight (default: count)."""
+        weight = count if weight is None else weight
+        key = (page_id, from_id)
+        counter = self.page.get(key)
+        if counter is None:
+            counter = self.page[key] = Counter()
+            self.page_counts[key] = Counter()
+        counter[to_id] += weight
+        self.page_counts[key][to_id] += count
+        self.page_totals[key] = self.page_totals.get(key, 0) + weight
+        self.page_count_totals[key] = self.page_count_totals.get(key, 0) + count
+    
+    def get_first_order(self, from_id: int) -> list[tuple[int, int, float]]:
+        """Get (to_id, count, weight) rows from an action, sorted by weight descending."""
+        counter = self.first_order.get(from_id)
+        if not counter:
+            return []
+        return _with_counts(counter.most_common(), self.first_order_counts[from_id])
+    
+    def get_second_order(self, id_1: int, id_2: int) -> list[tuple[int, int, float]]:
+        """Get (to_id, count, weight) rows from an action pair, sorted by weight descending."""
+        counter = self.second_order.get((id_1, id_2))
+        if not counter:
+            return []
+        return _with_counts(counter.most_common(), self.second_order_counts[(id_1, id_2)])
+    
+    def get_first_order_top_k(
+        self, from_id: int, k: int
+    ) -> tuple[list[tuple[int, int, float]], float]:
+        """Get the K heaviest (to_id, count, weight) rows from an action plus its total weight."""
+        counter = self.first_order.get(from_id)
+        if not counter:
+            return [], 0
+        rows = _with_counts(_top_k(counter, k), self.first_order_counts[from_id])
+        return rows, self.first_order_totals[from_id]
+    
+    def get_second_order_top_k(
+        self, id_1: int, id_2: int, k: int
+    ) -> tuple[list[tuple[int, int, float]], float]:
+        """Get the K heaviest (to_id, count, weight) rows from a pair plus its total weight."""
+        key = (id_1, id_2)
+        counter = self.second_order.get(key)
+        if not counter:
+            return [], 0
+        rows = _with_counts(_top_k(counter, k), self.second_order_counts[key])
+        return rows, self.second_order_totals[key]
+    
+    def get_page_top_k(
+        self, page_id: int, from_id: int, k: int
+    ) -> tuple[list[tuple[int, int, float]], float, int]:
+        """Get the K heaviest (to_id, count, weight) rows from an action on a page.
+        
+        Returns (rows, total weight, total count).
+        """
+        key = (page_id, from_id)
+        counter = self.page.get(key)
+        if not counter:
+            return [], 0, 0
+        rows = _with_counts(_top_k(counter, k), self.page_counts[key])
+        return rows, self.page_totals[key], self.page_count_totals[key]
+
+
+def _top_k(counter: Counter[int], k: int) -> list[tuple[int, float]]:
+    """Select the K largest weights, breaking ties by id like the SQL index order."""
+    return heapq.nlargest(k, counter.items(), key=lambda item: (item[1], -item[0]))
+
+
+def _with_counts(
+    pairs: list[tuple[int, float]], counts: Counter[int]
+) -> list[tuple[int, int, float]]:
+    """Expand (to_id, weight) pairs into (to_id, count, weight) rows."""
+    return [(to_id, counts[to_id], weight) for to_id, weight in pairs]
@@ -0,0 +1,351 @@
+"""Compaction of the transition tables.
+
+Long-tail transitions (one-off type_text queries and the like) dominate the
+row count of both transition tables but almost never make a top-K
+prediction. Compaction keeps only the heaviest successors of every source,
+drops rows below a support threshold, rebuilds the indexes and hands freed
+pages back to the filesystem with incremental vacuum.
+
+Rows are removed in short per-chunk transactions, so a recorder sharing the
+database (in WAL mode) only ever waits for one chunk. Other processes'
+transition caches and context trees are not updated: a long-lived Storage
+opened with cache_transitions=True or a context_order keeps serving the
+pruned rows until it calls reload_cache() or reconnects.
+"""
+import asyncio
+import random
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import Action
+
+
+@dataclass(frozen=True)
+class _TransitionTable:
+    """Column layout of one transition table and its totals table."""
+    
+    name: str
+    totals: str
+    source: tuple[str, ...]
+
+
+_TABLES = (
+    _TransitionTable(
+        "transitions_first_order", "transition_totals_first_order", ("from_id",)
+    ),
+    _TransitionTable(
+        "transitions_second_order",
+        "transition_totals_second_order",
+        ("from_id_1", "from_id_2"),
+    ),
+    _TransitionTable("transitions_page", "transition_totals_page", ("page_id", "from_id")),
+    _TransitionTable("transitions_context", "transition_totals_context", ("context",)),
+)
+
+
+@dataclass
+class CompactionReport:
+    """Table, file and lookup-latency figures from before and after a compaction."""
+    
+    rows_before: dict[str, int] = field(default_factory=dict)
+    rows_after: dict[str, int] = field(default_factory=dict)
+    bytes_before: int = 0
+    bytes_after: int = 0
+    free_bytes_before: int = 0
+    free_bytes_after: int = 0
+    lookup_ms_before: dict[str, float] = field(default_factory=dict)
+    lookup_ms_after: dict[str, float] = field(default_factory=dict)
+    vacuum: str = "skipped"
+    duration_seconds: float = 0.0
+    
+    def to_dict(self) -> dict[str, Any]:
+        """Convert report to dictionary."""
+        return {
+            "rows_before": self.rows_before,
+            "rows_after": self.rows_after,
+            "rows_pruned": {
+                table: self.rows_before[table] - self.rows_after.get(table, 0)
+                for table in self.rows_before
+            },
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_after,
+            "free_bytes_before": self.free_bytes_before,
+            "free_bytes_after": self.free_bytes_after,
+            "lookup_ms_before": self.lookup_ms_before,
+            "lookup_ms_after": self.lookup_ms_after,
+            "vacuum": self.vacuum,
+            "duration_seconds": self.duration_seconds,
+        }
+
+
+class Compactor:
+    """Bounds the transition tables to their heavy hitters.
+    
+    Every source keeps at most max_successors successors, the ones with the
+    largest decayed weight. Space-Saving would approximate these top-K from a
+    stream; compaction sees exact weights, so it keeps the exact top-K.
+    Successors seen fewer than min_count times are dropped as well, once
+    they have gone min_age_seconds without a new observation, so new
+    transitions get time to build up support.
+    
+    The weight of removed rows stays in the per-source totals. Confidence of
+    the remaining successors is unchanged, so pruning never pushes one over
+    the planner threshold.
+    """
+    
+    def __init__(
+        self,
+        max_successors: int = 64,
+        min_count: int = 2,
+        min_age_seconds: float = 7 * 24 * 3600.0,
+        chunk_size: int = 500,
+        vacuum_pages: int = 1000,
+        full_vacuum: bool = False,
+        probe_sources: int = 200,
+    ):
+        if max_successors < 1:
+            raise ValueError("max_successors must be at least 1")
+        self.max_successors = max_successors
+        self.min_count = min_count
+        self.min_age_seconds = min_age_seconds
+        self.chunk_size = chunk_size
+        self.vacuum_pages = vacuum_pages
+        self.full_vacuum = full_vacuum
+        self.probe_sources = probe_sources
+    
+    def run(self, storage: Storage) -> CompactionReport:
+        """Compact storage's database and report before/after figures.
+        
+        Must not be called inside storage.batch().
+        """
+        if storage._batch_depth:
+            raise RuntimeError("cannot compact inside batch()")
+        start = time.perf_counter()
+        conn = storage.conn
+        report = CompactionReport()
+        probes = self._sample_sources(storage)
+        
+        report.rows_before = _row_counts(conn)
+        report.bytes_before, report.free_bytes_before = _file_sizes(conn)
+        report.lookup_ms_before = _probe_lookups(storage, probes)
+        
+        cutoff = time.time() - self.min_age_seconds
+        for table in _TABLES:
+            self._prune(conn, table, cutoff)
+        for table in _TABLES:
+            conn.execute(f"REINDEX {table.name}")
+        conn.commit()
+        storage.reload_cache()
+        
+        report.vacuum = self._vacuum(conn)
+        storage.checkpoint("TRUNCATE")
+        
+        report.rows_after = _row_counts(conn)
+        report.bytes_after, report.free_bytes_after = _file_sizes(conn)
+        report.lookup_ms_after = _probe_lookups(storage, probes)
+        report.duration_seconds = time.perf_counter() - start
+        return report
+    
+    def _sample_sources(self, storage: Storage) -> list[Action]:
+        """Pick random first-order sources to time lookups on."""
+        rows = storage.conn.execute(
+            """
+            SELECT v.signature
+            FROM transition_totals_first_order s
+            JOIN action_vocab v ON v.id = s.from_id
+            """
+        ).fetchall()
+        signatures = [row[0] for row in rows]
+        sample = random.sample(signatures, min(self.probe_sources, len(signatures)))
+        return [Action.from_json(signature) for signature in sample]
+    
+    def _prune(self, conn: sqlite3.Connection, table: _TransitionTable, cutoff: float) -> None:
+        """Delete rows outside the top-K or below min_count, one chunk at a time."""
+        partition = ", ".join(table.source)
+        key_columns = (*table.source, "to_id")
+        chunk_column = table.source[0]
+        sources = [
+            row[0]
+            for row in conn.execute(
+                f"SELECT DISTINCT {chunk_column} FROM {table.totals} ORDER BY {chunk_column}"
+            )
+        ]
+        
+        for begin in range(0, len(sources), self.chunk_size):
+            chunk = sources[begin:begin + self.chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            doomed = conn.execute(
+                f"""
+                SELECT {", ".join(key_columns)}, count, weight FROM (
+                    SELECT {", ".join(key_columns)}, count, weight, updated_at,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY {partition} ORDER BY weight DESC, to_id
+                        ) AS rank
+                    FROM {table.name}
+                    WHERE {chunk_column} IN ({placeholders})
+                )
+                WHERE rank > ? OR (count < ? AND updated_at < ?)
+                """,
+                (*chunk, self.max_successors, self.min_count, cutoff),
+            ).fetchall()
+            if not doomed:
+                continue
+            
+            width = len(key_columns)
+            removed: dict[tuple[int, ...], list[float]] = {}
+            for row in doomed:
+                entry = removed.setdefault(tuple(row[:width - 1]), [0, 0.0])
+                entry[0] += row[width]
+                entry[1] += row[width + 1]
+            
+            conn.executemany(
+                f"DELETE FROM {table.name} WHERE "
+                + " AND ".join(f"{column} = ?" for column in key_columns),
+                [tuple(row[:width]) for row in doomed],
+            )
+            # The delete triggers subtracted the rows; put their mass back.
+            conn.executemany(
+                f"UPDATE {table.totals} SET total = total + ?, weight = weight + ? WHERE "
+                + " AND ".join(f"{column} = ?" for column in table.source),
+                [(count, weight, *source) for source, (count, weight) in removed.items()],
+            )
+            conn.commit()
+    
+    def _vacuum(self, conn: sqlite3.Connection) -> str:
+        """Return free pages to the filesystem.
+        
+        Returns "incremental", "full" or "skipped". Databases created before
+        auto_vacuum was enabled are converted by one full VACUUM, only when
+        full_vacuum is set.
+        """
+        if release_free_pages(conn, self.vacuum_pages):
+            return "incremental"
+        if not self.full_vacuum:
+            return "skipped"
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return "full"
+
+
+def compact_database(db_path: str, compactor: Compactor | None = None) -> CompactionReport:
+    """Open db_path in WAL mode, compact it and close it.
+    
+    Safe to call from a worker thread: the connection is opened and closed
+    on the calling thread.
+    """
+    storage = Storage(db_path, wal=True, reader_pool_size=1)
+    storage.connect()
+    try:
+        return (compactor or Compactor()).run(storage)
+    finally:
+        storage.close()
+
+
+class CompactionTask:
+    """Runs compact_database() every interval seconds off the event loop.
+    
+    A failed run is recorded in last_error and the task carries on.
+    """
+    
+    def __init__(
+        self,
+        db_path: str,
+        interval: float = 6 * 3600.0,
+        compactor: Compactor | None = None,
+    ):
+        self.db_path = db_path
+        self.interval = interval
+        self.compactor = compactor or Compactor()
+        self.last_report: CompactionReport | None = None
+        self.last_error: str | None = None
+        self._stopping = asyncio.Event()
+        self._task: asyncio.Task | None = None
+    
+    def start(self) -> None:
+        """Start the periodic task on the running event loop."""
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def close(self) -> None:
+        """Stop the task, letting a compaction in progress finish."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+    
+    async def _run(self) -> None:
+        """Compact after every interval until close()."""
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                self.last_report = await asyncio.to_thread(
+                    compact_database, self.db_path, self.compactor
+                )
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}_{str(e)[:100]}"
+    
+    def to_dict(self) -> dict[str, Any]:
+        """Convert the latest outcome to dictionary."""
+        return {
+            "interval_seconds": self.interval,
+            "last_report": self.last_report.to_dict() if self.last_report else None,
+            "last_error": self.last_error,
+        }
+
+
+def release_free_pages(conn: sqlite3.Connection, step_pages: int = 1000) -> bool:
+    """Truncate the free pages off the database file, step_pages at a time.
+    
+    Each step commits, so other writers can interleave. Returns False, doing
+    nothing, when the database is not in incremental auto_vacuum mode.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return False
+    while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+        # executescript() steps the pragma to completion; execute() frees one page.
+        conn.executescript(f"PRAGMA incremental_vacuum({int(step_pages)})")
+    return True
+
+
+def _row_counts(conn: sqlite3.Connection) -> dict[str, int]:
+    """Count the rows of each transition table."""
+    return {
+        table.name: conn.execute(f"SELECT COUNT(*) FROM {table.name}").fetchone()[0]
+        for table in _TABLES
+    }
+
+
+def _file_sizes(conn: sqlite3.Connection) -> tuple[int, int]:
+    """Get (database size, free-page bytes) from the page counts."""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return pages * page_size, free * page_size
+
+
+def _probe_lookups(storage: Storage, sources: list[Action], k: int = 5) -> dict[str, float]:
+    """Time get_first_order_top_k over sources; mean/p50/p95/max in milliseconds."""
+    samples = []
+    for source in sources:
+        start = time.perf_counter()
+        storage.get_first_order_top_k(source, k)
+        samples.append((time.perf_counter() - start) * 1000)
+    if not samples:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    samples.sort()
+    return {
+        "mean": sum(samples) / len(samples),
+        "p50": samples[int(0.50 * (len(samples) - 1))],
+        "p95": samples[int(0.95 * (len(samples) - 1))],
+        "max": samples[-1],
+    }
@@ -0,0 +1,164 @@
+"""Context tree for variable-order Markov transitions.
+
+Each node is a context read backwards from the most recent action: the root's
+children are keyed by the last action, their children by the action before
+that, and so on up to max_order. Every node counts the actions that followed
+its context, so one walk from the root visits every order at once.
+
+Next to each count the node keeps the stored decay weight (see the decay
+notes in db/storage.py); rankings and confidences use the weights, and
+min_support the raw counts.
+"""
+import heapq
+import sqlite3
+from collections import Counter
+from typing import Iterable, Sequence
+
+
+class ContextNode:
+    """Successor counts and weights for one context plus deeper contexts below it."""
+    
+    __slots__ = ("children", "counts", "total", "weight", "weights")
+    
+    def __init__(self):
+        self.children: dict[int, ContextNode] = {}
+        self.counts: Counter[int] = Counter()
+        self.weights: dict[int, float] = {}
+        self.total = 0
+        self.weight = 0.0
+
+
+class ContextTree:
+    """Suffix trie of action-id contexts up to a fixed maximum order."""
+    
+    def __init__(self, max_order: int):
+        if max_order < 1:
+            raise ValueError("max_order must be at least 1")
+        self.max_order = max_order
+        self.root = ContextNode()
+    
+    def load(self, conn: sqlite3.Connection) -> None:
+        """Rebuild the tree from the transitions_context table.
+        
+        Node totals come from transition_totals_context, so they keep the
+        mass of rows removed by compaction. Contexts longer than max_order
+        are skipped.
+        """
+        self.clear()
+        for context, to_id, count, weight in conn.execute(
+            "SELECT context, to_id, count, weight FROM transitions_context"
+        ):
+            self.set_counts(decode_context(context), [(to_id, count, weight)])
+        for context, total, weight in conn.execute(
+            "SELECT context, total, weight FROM transition_totals_context"
+        ):
+            node = self._find(decode_context(context))
+            if node is not None:
+                node.total = total
+                node.weight = weight
+    
+    def clear(self) -> None:
+        """Drop all contexts."""
+        self.root = ContextNode()
+    
+    def update(
+        self, context: Sequence[int], to_id: int, count: int = 1, weight: float = 1.0
+    ) -> list[tuple[int, ...]]:
+        """Count to_id after every suffix of context in a single walk.
+        
+        Args:
+            context: Preceding action ids, oldest first.
+            to_id: Action id that followed the context.
+            count: Amount to add.
+            weight: Stored decay weight to add.
+        
+        Returns:
+            The updated contexts, most recent action first, shortest first.
+        """
+        node = self.root
+        touched = []
+        key: tuple[int, ...] = ()
+        for action_id in reversed(context[-self.max_order:]):
+            child = node.children.get(action_id)
+            if child is None:
+                child = node.children[action_id] = ContextNode()
+            node = child
+            node.counts[to_id] += count
+            node.weights[to_id] = node.weights.get(to_id, 0.0) + weight
+            node.total += count
+            node.weight += weight
+            key += (action_id,)
+            touched.append(key)
+        return touched
+    
+    def set_counts(
+        self, key: Sequence[int], counts: Iterable[tuple[int, int, float]]
+    ) -> None:
+        """Set the (successor, count, weight) entries of one context (most recent action first)."""
+        if not key or len(key) > self.max_order:
+            return
+        node = self.root
+        for action_id in key:
+            child = node.children.get(action_id)
+            if child is None:
+                child = node.children[action_id] = ContextNode()
+            node = child
+        for to_id, count, weight in counts:
+            node.total += count - node.counts[to_id]
+            node.weight += weight - node.weights.get(to_id, 0.0)
+            node.counts[to_id] = count
+            node.weights[to_id] = weight
+    
+    def _find(self, key: Sequence[int]) -> ContextNode | None:
+        """Get the node of a context (most recent action first), if it exists."""
+        if not key:
+            return None
+        node = self.root
+        for action_id in key:
+            node = node.children.get(action_id)
+            if node is None:
+                return None
+        return node
+    
+    def top_k(
+        self, context: Sequence[int | None], k: int, min_support: int = 1
+    ) -> tuple[list[tuple[int, int, float]], float, int]:
+        """Predict from the longest matching suffix of context.
+        
+        Walks from the most recent action backwards and keeps the deepest node
+        whose total count is at least min_support; shorter contexts are the
+        back-off.
+        
+        Returns:
+            (rows, weight, order) where rows are the (to_id, count, weight)
+            entries of the K largest weights, weight is the node's total
+            stored weight and order is the matched context length (0 if none).
+        """
+        node = self.root
+        best: ContextNode | None = None
+        order = 0
+        for depth, action_id in enumerate(reversed(context[-self.max_order:]), start=1):
+            node = node.children.get(action_id)
+            if node is None:
+                break
+            if node.total >= min_support:
+                best = node
+                order = depth
+        if best is None:
+            return [], 0.0, 0
+        pairs = heapq.nlargest(k, best.weights.items(), key=lambda item: (item[1], -item[0]))
+        return (
+            [(to_id, best.counts[to_id], weight) for to_id, weight in pairs],
+            best.weight,
+            order,
+        )
+
+
+def encode_context(key: Sequence[int]) -> str:
+    """Encode a context key for the transitions_context table."""
+    return " ".join(str(action_id) for action_id in key)
+
+
+def decode_context(text: str) -> tuple[int, ...]:
+    """Decode a context key from the transitions_context table."""
+    return tuple(int(part) for part in text.split())
@@ -0,0 +1,219 @@
+"""Sparse-matrix snapshot of the transition model.
+
+Exports the first- and second-order transition weights as CSR arrays
+(indptr/indices/data) over a dense vocab index, together with each row's
+total weight and the storage's template rules, saved as a single .npz file.
+Requires numpy (install the "matrix" extra).
+"""
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from thirdlayer_prototype.models.template import Templater
+
+if TYPE_CHECKING:
+    from thirdlayer_prototype.db.storage import Storage
+
+
+@dataclass
+class TransitionMatrix:
+    """CSR transition weights with per-source probabilities.
+    
+    Data holds the stored decay weights and the totals arrays each row's
+    total weight from the totals tables, which still counts successors
+    removed by compaction. Probabilities are weight over total, as
+    Predictor computes them. Matrices saved without totals fall back to
+    row sums.
+    
+    Rows and columns are dense vocab indices; vocab[i] is the action
+    signature for index i. Second-order rows are (prev, current) index pairs
+    listed in second_keys, sorted by prev * len(vocab) + current. When the
+    model is over templates, templater holds the rules to fill them with.
+    """
+    
+    vocab: list[str]
+    first_indptr: np.ndarray
+    first_indices: np.ndarray
+    first_data: np.ndarray
+    second_keys: np.ndarray
+    second_indptr: np.ndarray
+    second_indices: np.ndarray
+    second_data: np.ndarray
+    first_totals: np.ndarray | None = None
+    second_totals: np.ndarray | None = None
+    templater: Templater | None = None
+    first_probs: np.ndarray = field(init=False, repr=False)
+    second_probs: np.ndarray = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        if self.first_totals is None:
+            self.first_totals = row_sums(self.first_indptr, self.first_data)
+        if self.second_totals is None:
+            self.second_totals = row_sums(self.second_indptr, self.second_data)
+        self.first_probs = normalize_rows(self.first_indptr, self.first_data, self.first_totals)
+        self.second_probs = normalize_rows(
+            self.second_indptr, self.second_data, self.second_totals
+        )
+        self._second_codes = (
+            self.second_keys[:, 0].astype(np.int64) * len(self.vocab) + self.second_keys[:, 1]
+        )
+        self._index = {signature: i for i, signature in enumerate(self.vocab)}
+    
+    @classmethod
+    def from_storage(cls, storage: "Storage") -> "TransitionMatrix":
+        """Build the matrix from the storage transition tables."""
+        conn = storage.conn
+        vocab_rows = conn.execute("SELECT id, signature FROM action_vocab ORDER BY id").fetchall()
+        vocab_ids = np.array([row[0] for row in vocab_rows], dtype=np.int64)
+        vocab = [row[1] for row in vocab_rows]
+        n = len(vocab)
+        
+        first = np.array(
+            conn.execute(
+                """
+                SELECT t.from_id, t.to_id, t.weight, s.weight
+                FROM transitions_first_order t
+                JOIN transition_totals_first_order s ON s.from_id = t.from_id
+                ORDER BY t.from_id, t.to_id
+                """
+            ).fetchall(),
+            dtype=np.float64,
+        ).reshape(-1, 4)
+        first_ids = first[:, :2].astype(np.int64)
+        rows = np.searchsorted(vocab_ids, first_ids[:, 0])
+        first_indptr = _indptr(rows, n)
+        first_totals = np.zeros(n, dtype=np.float64)
+        first_totals[rows] = first[:, 3]
+        
+        second = np.array(
+            conn.execute(
+                """
+                SELECT t.from_id_1, t.from_id_2, t.to_id, t.weight, s.weight
+                FROM transitions_second_order t
+                JOIN transition_totals_second_order s
+                    ON s.from_id_1 = t.from_id_1 AND s.from_id_2 = t.from_id_2
+                ORDER BY t.from_id_1, t.from_id_2, t.to_id
+                """
+            ).fetchall(),
+            dtype=np.float64,
+        ).reshape(-1, 5)
+        second_ids = second[:, :3].astype(np.int64)
+        prev = np.searchsorted(vocab_ids, second_ids[:, 0])
+        current = np.searchsorted(vocab_ids, second_ids[:, 1])
+        codes, row_of = np.unique(prev * n + current, return_inverse=True)
+        second_keys = np.stack([codes // max(n, 1), codes % max(n, 1)], axis=1)
+        second_indptr = _indptr(row_of, len(codes))
+        second_totals = np.zeros(len(codes), dtype=np.float64)
+        second_totals[row_of] = second[:, 4]
+        
+        return cls(
+            vocab=vocab,
+            first_indptr=first_indptr,
+            first_indices=np.searchsorted(vocab_ids, first_ids[:, 1]).astype(np.int32),
+            first_data=first[:, 2],
+            second_keys=second_keys.astype(np.int32),
+            second_indptr=second_indptr,
+            second_indices=np.searchsorted(vocab_ids, second_ids[:, 2]).astype(np.int32),
+            second_data=second[:, 3],
+            first_totals=first_totals,
+            second_totals=second_totals,
+            templater=storage.templater,
+        )
+    
+    def save(self, path: str) -> None:
+        """Write the matrix to a compressed .npz file."""
+        encoded = [signature.encode("utf-8") for signature in self.vocab]
+        vocab_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=vocab_offsets[1:])
+        rules = {}
+        if self.templater is not None:
+            encoded_rules = self.templater.to_json().encode("utf-8")
+            rules["templater_rules"] = np.frombuffer(encoded_rules, dtype=np.uint8)
+        np.savez_compressed(
+            path,
+            vocab_blob=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            vocab_offsets=vocab_offsets,
+            first_indptr=self.first_indptr,
+            first_indices=self.first_indices,
+            first_data=self.first_data,
+            second_keys=self.second_keys,
+            second_indptr=self.second_indptr,
+            second_indices=self.second_indices,
+            second_data=self.second_data,
+            first_totals=self.first_totals,
+            second_totals=self.second_totals,
+            **rules,
+        )
+    
+    @classmethod
+    def load(cls, path: str) -> "TransitionMatrix":
+        """Read a matrix written by save()."""
+        with np.load(path) as arrays:
+            blob = arrays["vocab_blob"].tobytes()
+            offsets = arrays["vocab_offsets"]
+            vocab = [
+                blob[offsets[i]:offsets[i + 1]].decode("utf-8")
+                for i in range(len(offsets) - 1)
+            ]
+            templater = None
+            if "templater_rules" in arrays:
+                templater = Templater.from_json(arrays["templater_rules"].tobytes().decode("utf-8"))
+            return cls(
+                vocab=vocab,
+                first_indptr=arrays["first_indptr"],
+                first_indices=arrays["first_indices"],
+                first_data=arrays["first_data"],
+                second_keys=arrays["second_keys"],
+                second_indptr=arrays["second_indptr"],
+                second_indices=arrays["second_indices"],
+                second_data=arrays["second_data"],
+                first_totals=arrays.get("first_totals"),
+                second_totals=arrays.get("second_totals"),
+                templater=templater,
+            )
+    
+    def index_of(self, signature: str) -> int | None:
+        """Get the dense index of a signature, or None if unknown."""
+        return self._index.get(signature)
+    
+    def first_order_row(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        """Get (column indices, probabilities) for a first-order row."""
+        start, end = self.first_indptr[index], self.first_indptr[index + 1]
+        return self.first_indices[start:end], self.first_probs[start:end]
+    
+    def second_order_row(self, prev: int, current: int) -> tuple[np.ndarray, np.ndarray]:
+        """Get (column indices, probabilities) for a second-order row."""
+        code = prev * len(self.vocab) + current
+        row = int(np.searchsorted(self._second_codes, code))
+        if row == len(self._second_codes) or self._second_codes[row] != code:
+            return self.second_indices[:0], self.second_probs[:0]
+        start, end = self.second_indptr[row], self.second_indptr[row + 1]
+        return self.second_indices[start:end], self.second_probs[start:end]
+
+
+def row_sums(indptr: np.ndarray, data: np.ndarray) -> np.ndarray:
+    """Sum the entries of every CSR row."""
+    sums = np.zeros(len(indptr) - 1, dtype=np.float64)
+    lengths = np.diff(indptr)
+    if len(data):
+        sums[lengths > 0] = np.add.reduceat(data, indptr[:-1][lengths > 0])
+    return sums
+
+
+def normalize_rows(indptr: np.ndarray, data: np.ndarray, totals: np.ndarray) -> np.ndarray:
+    """Divide every CSR entry by its row's total; rows without weight get zero."""
+    denominators = np.repeat(totals, np.diff(indptr))
+    return np.divide(
+        data,
+        denominators,
+        out=np.zeros(len(data), dtype=np.float64),
+        where=denominators > 0,
+    )
+
+
+def _indptr(rows: np.ndarray, n_rows: int) -> np.ndarray:
+    """Build a CSR indptr from sorted row indices."""
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr
@@ -0,0 +1,480 @@
+"""Rebuild of the transition tables from the raw action history.
+
+Live recording only ever adds to the transition counts. After a change to
+the signature scheme, the model order or the filtering rules, the model is
+regenerated from the actions log and the archive segments in four phases:
+
+1. Map: the history is split into shards, session-id ranges of the actions
+   table plus one shard per archive segment, and counted on a
+   ProcessPoolExecutor. Workers re-derive every signature from the stored
+   action JSON, through the rebuild's templater when it has one, and count
+   first-, second-, context-order and page-conditioned n-grams under
+   shard-local ids.
+2. Reduce: the parent merges the partial counters as shards finish,
+   translating local ids to action_vocab ids.
+3. Load: the merged counts are bulk-loaded in key order into staging tables
+   without indexes or triggers, and the totals come from one GROUP BY.
+4. Swap: the live tables are dropped, the staging tables renamed in their
+   place and the indexes and triggers recreated from schema.sql.
+
+Load and swap share one transaction, so readers see either the old model or
+the new one, never a mix.
+"""
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator
+
+from thirdlayer_prototype.db.archive import iter_segment, list_segments
+from thirdlayer_prototype.db.context_tree import encode_context
+from thirdlayer_prototype.db.storage import Storage, _accumulate, _split_statements
+from thirdlayer_prototype.models.action import Action
+from thirdlayer_prototype.models.state import page_pattern
+from thirdlayer_prototype.models.template import Templater
+
+
+# Shards per worker; more shards than workers evens out skewed session sizes.
+_SHARDS_PER_WORKER = 4
+
+_STAGING_PREFIX = "rebuild_"
+
+_REBUILT_TABLES = (
+    "transitions_first_order",
+    "transitions_second_order",
+    "transitions_context",
+    "transitions_page",
+    "transition_totals_first_order",
+    "transition_totals_second_order",
+    "transition_totals_page",
+    "transition_totals_context",
+)
+
+
+@dataclass(frozen=True)
+class _Shard:
+    """A session-id range of the actions table, or one archive segment.
+    
+    The range is first_session <= session_id < last_session, open-ended when
+    last_session is None, over actions with id <= max_action_id.
+    """
+    
+    db_path: str | None = None
+    first_session: str | None = None
+    last_session: str | None = None
+    max_action_id: int = 0
+    segment: str | None = None
+
+
+@dataclass
+class _ShardCounts:
+    """N-gram counts of one shard, keyed by indexes into signatures."""
+    
+    signatures: list[str] = field(default_factory=list)
+    first_order: dict[tuple[int, int], list[Any]] = field(default_factory=dict)
+    second_order: dict[tuple[int, int, int], list[Any]] = field(default_factory=dict)
+    contexts: dict[tuple[tuple[int, ...], int], list[Any]] = field(default_factory=dict)
+    pages: dict[tuple[str, int, int], list[Any]] = field(default_factory=dict)
+    sessions: int = 0
+    actions: int = 0
+
+
+@dataclass
+class RebuildReport:
+    """What a rebuild read and the row counts of the tables it swapped in."""
+    
+    sessions: int = 0
+    actions: int = 0
+    shards: int = 0
+    workers: int = 0
+    context_order: int = 0
+    half_life: float = 0.0
+    rows: dict[str, int] = field(default_factory=dict)
+    duration_seconds: float = 0.0
+    
+    def to_dict(self) -> dict[str, Any]:
+        """Convert report to dictionary."""
+        return {
+            "sessions": self.sessions,
+            "actions": self.actions,
+            "shards": self.shards,
+            "workers": self.workers,
+            "context_order": self.context_order,
+            "half_life": self.half_life,
+            "rows": self.rows,
+            "duration_seconds": self.duration_seconds,
+        }
+
+
+def rebuild_transitions(
+    storage: Storage,
+    archive_dir: str | os.PathLike | None = None,
+    workers: int | None = None,
+    context_order: int | None = None,
+    half_life: float | None = None,
+    drop_failed: bool = False,
+    templater: Templater | None = None,
+) -> RebuildReport:
+    """Recount every transition table from the history and swap them in.
+    
+    Args:
+        storage: Connected storage over an on-disk database.
+        archive_dir: Directory of archive segments to count as well.
+        workers: Worker processes (default: one per core); 1 counts in process.
+        context_order: Longest context counted (default: the current one).
+        half_life: Decay half-life of the rebuilt weights (default: the current one).
+        drop_failed: Drop failed actions from each session before counting, the
+            history the agent loop keeps. By default they stay as sources and
+            only transitions into them are skipped, like record_session().
+        templater: Template rules to count over (default: storage.templater).
+            Other rules convert the model; they are stored with it and become
+            storage.templater.
+    
+    Page-conditioned transitions are counted, from the logged URLs, only
+    when storage.page_context is set.
+    
+    Transitions recorded by other connections while the rebuild runs are
+    replaced by the rebuilt tables, and other processes' transition caches go
+    stale; run it with recording paused. Must not be called inside
+    storage.batch().
+    """
+    if storage._batch_depth:
+        raise RuntimeError("cannot rebuild inside batch()")
+    if storage.db_path == ":memory:":
+        raise ValueError("rebuild needs an on-disk database")
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    if context_order is None:
+        context_order = _current_context_order(storage)
+    if half_life is None:
+        half_life = storage.half_life
+    if templater is None:
+        templater = storage.templater
+    epoch = time.time()
+    
+    shards = _plan_shards(storage, workers, archive_dir)
+    report = RebuildReport(
+        shards=len(shards), workers=workers, context_order=context_order, half_life=half_life
+    )
+    first_order: dict[tuple[int, int], list[Any]] = {}
+    second_order: dict[tuple[int, int, int], list[Any]] = {}
+    contexts: dict[tuple[str, int], list[Any]] = {}
+    pages: dict[tuple[int, int, int], list[Any]] = {}
+    merged = (first_order, second_order, contexts, pages)
+    args = (
+        context_order, drop_failed, epoch, half_life, templater, storage.page_context
+    )
+    
+    if workers == 1:
+        for shard in shards:
+            _merge(storage, _count_shard(shard, *args), *merged, report)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_count_shard, shard, *args) for shard in shards]
+            for future in as_completed(futures):
+                _merge(storage, future.result(), *merged, report)
+    
+    _load_and_swap(storage, *merged, half_life, epoch, templater)
+    report.rows = {
+        table: storage.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in _REBUILT_TABLES[:4]
+    }
+    report.duration_seconds = time.perf_counter() - start
+    return report
+
+
+def _current_context_order(storage: Storage) -> int:
+    """Get the context order of storage, or the longest stored context."""
+    if storage.context_tree is not None:
+        return storage.context_tree.max_order
+    row = storage.conn.execute(
+        """
+        SELECT MAX(LENGTH(context) - LENGTH(REPLACE(context, ' ', '')) + 1)
+        FROM transitions_context
+        """
+    ).fetchone()
+    return row[0] or 0
+
+
+def _plan_shards(
+    storage: Storage, workers: int, archive_dir: str | os.PathLike | None
+) -> list[_Shard]:
+    """Split the actions table into session-id ranges, plus one shard per segment."""
+    shards = []
+    if archive_dir is not None:
+        shards.extend(_Shard(segment=str(path)) for path in list_segments(archive_dir))
+    
+    max_action_id = storage.conn.execute("SELECT MAX(id) FROM actions").fetchone()[0]
+    if max_action_id is None:
+        return shards
+    session_ids = [
+        row[0]
+        for row in storage.conn.execute(
+            "SELECT DISTINCT session_id FROM actions WHERE id <= ? ORDER BY session_id",
+            (max_action_id,),
+        )
+    ]
+    step = max(1, -(-len(session_ids) // (workers * _SHARDS_PER_WORKER)))
+    bounds = session_ids[::step]
+    db_path = str(Path(storage.db_path).absolute())
+    for i, first_session in enumerate(bounds):
+        last_session = bounds[i + 1] if i + 1 < len(bounds) else None
+        shards.append(_Shard(db_path, first_session, last_session, max_action_id))
+    return shards
+
+
+def _shard_sessions(
+    shard: _Shard, templater: Templater | None
+) -> Iterator[tuple[list[str], list[bool], list[float], list[str]]]:
+    """Stream a shard's sessions as (state signatures, successes, timestamps, urls)."""
+    def state_signature(action: Action) -> str:
+        return (templater.template(action) if templater else action).signature()
+    
+    if shard.segment is not None:
+        for record in iter_segment(shard.segment):
+            signatures = [
+                state_signature(Action.from_dict(action)) for action in record["actions"]
+            ]
+            yield signatures, record["successes"], record["timestamps"], record["urls"]
+        return
+    
+    uri = Path(shard.db_path).as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        query = "SELECT session_id, action_json, success, timestamp, url FROM actions"
+        query += " WHERE id <= ? AND session_id >= ?"
+        params: list[Any] = [shard.max_action_id, shard.first_session]
+        if shard.last_session is not None:
+            query += " AND session_id < ?"
+            params.append(shard.last_session)
+        query += " ORDER BY session_id, timestamp, id"
+        
+        current = None
+        session: tuple[list[str], list[bool], list[float], list[str]] = ([], [], [], [])
+        for session_id, action_json, success, timestamp, url in conn.execute(query, params):
+            if session_id != current and session[0]:
+                yield session
+                session = ([], [], [], [])
+            current = session_id
+            session[0].append(state_signature(Action.from_json(action_json)))
+            session[1].append(bool(success))
+            session[2].append(timestamp)
+            session[3].append(url or "")
+        if session[0]:
+            yield session
+    finally:
+        conn.close()
+
+
+def _count_shard(
+    shard: _Shard,
+    context_order: int,
+    drop_failed: bool,
+    epoch: float,
+    half_life: float,
+    templater: Templater | None,
+    page_context: bool,
+) -> _ShardCounts:
+    """Count the n-grams of one shard; runs in a worker process.
+    
+    A transition into action i counts only when action i succeeded, with the
+    weight of an observation at its timestamp under a decay epoch of epoch.
+    With page_context, it is also counted under the page pattern of the URL
+    action i was taken on.
+    """
+    counts = _ShardCounts()
+    local_ids: dict[str, int] = {}
+    for signatures, successes, timestamps, urls in _shard_sessions(shard, templater):
+        counts.sessions += 1
+        counts.actions += len(signatures)
+        if drop_failed:
+            kept = [i for i, success in enumerate(successes) if success]
+            signatures = [signatures[i] for i in kept]
+            timestamps = [timestamps[i] for i in kept]
+            urls = [urls[i] for i in kept]
+            successes = [True] * len(kept)
+        
+        ids = [local_ids.setdefault(signature, len(local_ids)) for signature in signatures]
+        for i in range(1, len(ids)):
+            if not successes[i]:
+                continue
+            timestamp = timestamps[i]
+            weight = 2.0 ** ((timestamp - epoch) / half_life) if half_life else 1.0
+            _accumulate(counts.first_order, (ids[i - 1], ids[i]), weight, timestamp)
+            if i > 1:
+                _accumulate(
+                    counts.second_order, (ids[i - 2], ids[i - 1], ids[i]), weight, timestamp
+                )
+            for order in range(1, min(context_order, i) + 1):
+                _accumulate(
+                    counts.contexts,
+                    (tuple(reversed(ids[i - order:i])), ids[i]),
+                    weight,
+                    timestamp,
+                )
+            pattern = page_pattern(urls[i]) if page_context else ""
+            if pattern:
+                _accumulate(counts.pages, (pattern, ids[i - 1], ids[i]), weight, timestamp)
+    counts.signatures = list(local_ids)
+    return counts
+
+
+def _merge(
+    storage: Storage,
+    counts: _ShardCounts,
+    first_order: dict[tuple[int, int], list[Any]],
+    second_order: dict[tuple[int, int, int], list[Any]],
+    contexts: dict[tuple[str, int], list[Any]],
+    pages: dict[tuple[int, int, int], list[Any]],
+    report: RebuildReport,
+) -> None:
+    """Add one shard's counts to the totals under action_vocab and page_vocab ids."""
+    with storage.batch():
+        ids = [storage._action_id(signature) for signature in counts.signatures]
+        page_ids = {pattern: storage._page_id(pattern) for pattern, _, _ in counts.pages}
+    page_counts = {
+        (page_ids[pattern], from_id, to_id): entry
+        for (pattern, from_id, to_id), entry in counts.pages.items()
+    }
+    context_counts = {
+        (encode_context([ids[i] for i in context]), to_id): entry
+        for (context, to_id), entry in counts.contexts.items()
+    }
+    for merged, partial, width in (
+        (first_order, counts.first_order, 0),
+        (second_order, counts.second_order, 0),
+        (pages, page_counts, 1),
+        (contexts, context_counts, 1),
+    ):
+        for key, (count, weight, updated_at) in partial.items():
+            # Page and context keys lead with a page id or an encoded
+            # context, which are already global.
+            key = (*key[:width], *(ids[i] for i in key[width:]))
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [count, weight, updated_at]
+            else:
+                entry[0] += count
+                entry[1] += weight
+                entry[2] = max(entry[2], updated_at)
+    report.sessions += counts.sessions
+    report.actions += counts.actions
+
+
+def _load_and_swap(
+    storage: Storage,
+    first_order: dict[tuple[int, int], list[Any]],
+    second_order: dict[tuple[int, int, int], list[Any]],
+    contexts: dict[tuple[str, int], list[Any]],
+    pages: dict[tuple[int, int, int], list[Any]],
+    half_life: float,
+    epoch: float,
+    templater: Templater | None,
+) -> None:
+    """Bulk-load staging tables and swap them in for the live ones, atomically."""
+    conn = storage.conn
+    schema_path = Path(__file__).parent / "schema.sql"
+    with open(schema_path, "r") as f:
+        schema_sql = f.read()
+    
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in _REBUILT_TABLES:
+            staging = _STAGING_PREFIX + table
+            conn.execute(f"DROP TABLE IF EXISTS {staging}")
+            sql = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()[0]
+            conn.execute(re.sub(rf'^CREATE TABLE "?{table}"?', f"CREATE TABLE {staging}", sql))
+        
+        # Key order makes every insert an append to the staging b-trees.
+        conn.executemany(
+            f"""
+            INSERT INTO {_STAGING_PREFIX}transitions_first_order
+                (from_id, to_id, count, weight, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(*key, *first_order[key]) for key in sorted(first_order)],
+        )
+        conn.executemany(
+            f"""
+            INSERT INTO {_STAGING_PREFIX}transitions_second_order
+                (from_id_1, from_id_2, to_id, count, weight, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(*key, *second_order[key]) for key in sorted(second_order)],
+        )
+        conn.executemany(
+            f"""
+            INSERT INTO {_STAGING_PREFIX}transitions_context
+                (context, to_id, count, weight, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(*key, *contexts[key]) for key in sorted(contexts)],
+        )
+        conn.executemany(
+            f"""
+            INSERT INTO {_STAGING_PREFIX}transitions_page
+                (page_id, from_id, to_id, count, weight, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(*key, *pages[key]) for key in sorted(pages)],
+        )
+        conn.execute(
+            f"""
+            INSERT INTO {_STAGING_PREFIX}transition_totals_first_order (from_id, total, weight)
+            SELECT from_id, SUM(count), SUM(weight)
+            FROM {_STAGING_PREFIX}transitions_first_order
+            GROUP BY from_id
+            """
+        )
+        conn.execute(
+            f"""
+            INSERT INTO {_STAGING_PREFIX}transition_totals_second_order
+                (from_id_1, from_id_2, total, weight)
+            SELECT from_id_1, from_id_2, SUM(count), SUM(weight)
+            FROM {_STAGING_PREFIX}transitions_second_order
+            GROUP BY from_id_1, from_id_2
+            """
+        )
+        conn.execute(
+            f"""
+            INSERT INTO {_STAGING_PREFIX}transition_totals_page
+                (page_id, from_id, total, weight)
+            SELECT page_id, from_id, SUM(count), SUM(weight)
+            FROM {_STAGING_PREFIX}transitions_page
+            GROUP BY page_id, from_id
+            """
+        )
+        conn.execute(
+            f"""
+            INSERT INTO {_STAGING_PREFIX}transition_totals_context (context, total, weight)
+            SELECT context, SUM(count), SUM(weight)
+            FROM {_STAGING_PREFIX}transitions_context
+            GROUP BY context
+            """
+        )
+        
+        for table in _REBUILT_TABLES:
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {_STAGING_PREFIX}{table} RENAME TO {table}")
+        # Recreates the indexes and triggers dropped with the live tables.
+        for statement in _split_statements(schema_sql):
+            conn.execute(statement)
+        storage.half_life = half_life
+        storage.decay_epoch = epoch
+        storage._save_decay_clock()
+        storage._save_templater(templater)
+        conn.commit()
+    except BaseException:
+        storage._rollback()
+        raise
+    storage.templater = templater
+    
+    if storage.cache is not None:
+        storage.cache.load(conn)
+    if storage.context_tree is not None:
+        storage.context_tree.load(conn)
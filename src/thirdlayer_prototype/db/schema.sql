@@ -6,26 +6,230 @@ CREATE TABLE IF NOT EXISTS actions (
     action_json TEXT NOT NULL,
     timestamp REAL NOT NULL,
     url TEXT,
-    success INTEGER DEFAULT 1
+    success INTEGER DEFAULT 1,
+    session_id TEXT
 );
 
+-- Interned action signatures; transitions reference actions by integer id.
+CREATE TABLE IF NOT EXISTS action_vocab (
+    id INTEGER PRIMARY KEY,
+    signature TEXT NOT NULL UNIQUE
+);
+
+-- The primary key doubles as the lookup index for a source state.
+-- weight is the time-decayed count, scaled to the decay epoch in storage_meta;
+-- updated_at is the time of the latest observation.
 CREATE TABLE IF NOT EXISTS transitions_first_order (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    from_action TEXT NOT NULL,
-    to_action TEXT NOT NULL,
+    from_id INTEGER NOT NULL,
+    to_id INTEGER NOT NULL,
     count INTEGER DEFAULT 1,
-    UNIQUE(from_action, to_action)
-);
+    weight REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (from_id, to_id)
+) WITHOUT ROWID;
 
 CREATE TABLE IF NOT EXISTS transitions_second_order (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    from_action_1 TEXT NOT NULL,
-    from_action_2 TEXT NOT NULL,
-    to_action TEXT NOT NULL,
+    from_id_1 INTEGER NOT NULL,
+    from_id_2 INTEGER NOT NULL,
+    to_id INTEGER NOT NULL,
+    count INTEGER DEFAULT 1,
+    weight REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (from_id_1, from_id_2, to_id)
+) WITHOUT ROWID;
+
+-- Variable-order contexts: space-separated action ids, most recent first.
+CREATE TABLE IF NOT EXISTS transitions_context (
+    context TEXT NOT NULL,
+    to_id INTEGER NOT NULL,
     count INTEGER DEFAULT 1,
-    UNIQUE(from_action_1, from_action_2, to_action)
+    weight REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (context, to_id)
+) WITHOUT ROWID;
+
+-- Per-source denominators, kept in step with the transition rows by triggers.
+-- Rows removed by compaction stay counted here, so the probabilities of the
+-- remaining successors do not inflate.
+CREATE TABLE IF NOT EXISTS transition_totals_first_order (
+    from_id INTEGER PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    weight REAL NOT NULL DEFAULT 0
 );
 
-CREATE INDEX IF NOT EXISTS idx_transitions_first_from ON transitions_first_order(from_action);
-CREATE INDEX IF NOT EXISTS idx_transitions_second_from ON transitions_second_order(from_action_1, from_action_2);
+CREATE TABLE IF NOT EXISTS transition_totals_second_order (
+    from_id_1 INTEGER NOT NULL,
+    from_id_2 INTEGER NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    weight REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (from_id_1, from_id_2)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS transition_totals_context (
+    context TEXT PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    weight REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+-- Interned page patterns (see models/state.py page_pattern).
+CREATE TABLE IF NOT EXISTS page_vocab (
+    id INTEGER PRIMARY KEY,
+    pattern TEXT NOT NULL UNIQUE
+);
+
+-- First-order transitions conditioned on the page the next action was taken on.
+CREATE TABLE IF NOT EXISTS transitions_page (
+    page_id INTEGER NOT NULL,
+    from_id INTEGER NOT NULL,
+    to_id INTEGER NOT NULL,
+    count INTEGER DEFAULT 1,
+    weight REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (page_id, from_id, to_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS transition_totals_page (
+    page_id INTEGER NOT NULL,
+    from_id INTEGER NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    weight REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (page_id, from_id)
+) WITHOUT ROWID;
+
+-- Settings stored with the data: the decay half-life and epoch, and whether
+-- transitions are over templates.
+CREATE TABLE IF NOT EXISTS storage_meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+) WITHOUT ROWID;
+
+-- Template rules the transitions were recorded with, in rule order.
+CREATE TABLE IF NOT EXISTS template_rules (
+    position INTEGER PRIMARY KEY,
+    action_type TEXT NOT NULL,
+    attribute TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    selector TEXT,
+    -- JSON list of [group, slot] pairs
+    aliases TEXT NOT NULL DEFAULT '[]'
+);
+
+-- Covering indexes for top-K successor queries (ORDER BY weight DESC LIMIT k).
+CREATE INDEX IF NOT EXISTS idx_transitions_first_weight
+    ON transitions_first_order(from_id, weight DESC, count);
+CREATE INDEX IF NOT EXISTS idx_transitions_second_weight
+    ON transitions_second_order(from_id_1, from_id_2, weight DESC, count);
+CREATE INDEX IF NOT EXISTS idx_transitions_page_weight
+    ON transitions_page(page_id, from_id, weight DESC, count);
 CREATE INDEX IF NOT EXISTS idx_actions_timestamp ON actions(timestamp);
+CREATE INDEX IF NOT EXISTS idx_actions_session ON actions(session_id, timestamp);
+
+-- Archive segment files whose sessions have left the actions table.
+CREATE TABLE IF NOT EXISTS archive_segments (
+    name TEXT PRIMARY KEY,
+    sessions INTEGER NOT NULL,
+    actions INTEGER NOT NULL,
+    first_timestamp REAL,
+    last_timestamp REAL,
+    created_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_first_insert
+AFTER INSERT ON transitions_first_order
+BEGIN
+    INSERT INTO transition_totals_first_order (from_id, total, weight)
+    VALUES (NEW.from_id, NEW.count, NEW.weight)
+    ON CONFLICT(from_id) DO UPDATE
+    SET total = total + excluded.total, weight = weight + excluded.weight;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_first_update
+AFTER UPDATE OF count, weight ON transitions_first_order
+BEGIN
+    UPDATE transition_totals_first_order
+    SET total = total + NEW.count - OLD.count, weight = weight + NEW.weight - OLD.weight
+    WHERE from_id = NEW.from_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_first_delete
+AFTER DELETE ON transitions_first_order
+BEGIN
+    UPDATE transition_totals_first_order
+    SET total = total - OLD.count, weight = weight - OLD.weight
+    WHERE from_id = OLD.from_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_second_insert
+AFTER INSERT ON transitions_second_order
+BEGIN
+    INSERT INTO transition_totals_second_order (from_id_1, from_id_2, total, weight)
+    VALUES (NEW.from_id_1, NEW.from_id_2, NEW.count, NEW.weight)
+    ON CONFLICT(from_id_1, from_id_2) DO UPDATE
+    SET total = total + excluded.total, weight = weight + excluded.weight;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_second_update
+AFTER UPDATE OF count, weight ON transitions_second_order
+BEGIN
+    UPDATE transition_totals_second_order
+    SET total = total + NEW.count - OLD.count, weight = weight + NEW.weight - OLD.weight
+    WHERE from_id_1 = NEW.from_id_1 AND from_id_2 = NEW.from_id_2;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_second_delete
+AFTER DELETE ON transitions_second_order
+BEGIN
+    UPDATE transition_totals_second_order
+    SET total = total - OLD.count, weight = weight - OLD.weight
+    WHERE from_id_1 = OLD.from_id_1 AND from_id_2 = OLD.from_id_2;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_page_insert
+AFTER INSERT ON transitions_page
+BEGIN
+    INSERT INTO transition_totals_page (page_id, from_id, total, weight)
+    VALUES (NEW.page_id, NEW.from_id, NEW.count, NEW.weight)
+    ON CONFLICT(page_id, from_id) DO UPDATE
+    SET total = total + excluded.total, weight = weight + excluded.weight;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_page_update
+AFTER UPDATE OF count, weight ON transitions_page
+BEGIN
+    UPDATE transition_totals_page
+    SET total = total + NEW.count - OLD.count, weight = weight + NEW.weight - OLD.weight
+    WHERE page_id = NEW.page_id AND from_id = NEW.from_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_page_delete
+AFTER DELETE ON transitions_page
+BEGIN
+    UPDATE transition_totals_page
+    SET total = total - OLD.count, weight = weight - OLD.weight
+    WHERE page_id = OLD.page_id AND from_id = OLD.from_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_context_insert
+AFTER INSERT ON transitions_context
+BEGIN
+    INSERT INTO transition_totals_context (context, total, weight)
+    VALUES (NEW.context, NEW.count, NEW.weight)
+    ON CONFLICT(context) DO UPDATE
+    SET total = total + excluded.total, weight = weight + excluded.weight;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_context_update
+AFTER UPDATE OF count, weight ON transitions_context
+BEGIN
+    UPDATE transition_totals_context
+    SET total = total + NEW.count - OLD.count, weight = weight + NEW.weight - OLD.weight
+    WHERE context = NEW.context;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_transitions_context_delete
+AFTER DELETE ON transitions_context
+BEGIN
+    UPDATE transition_totals_context
+    SET total = total - OLD.count, weight = weight - OLD.weight
+    WHERE context = OLD.context;
+END;
@@ -0,0 +1,374 @@
+"""Read-only binary snapshot of the transition model.
+
+A snapshot freezes the first- and second-order model into one file laid
+out for mmap: a header, then fixed-width little-endian arrays, each
+starting on an 8-byte boundary.
+
+    header          magic, version, flags, creation time and the array lengths
+    vocab_offsets   int64[vocab + 1]         byte offsets into vocab_blob
+    vocab_blob      UTF-8 action signatures, sorted bytewise
+    first_indptr    int64[vocab + 1]         CSR row bounds, one row per vocab index
+    first_succ      int32[first_edges]       successor vocab indexes
+    first_conf      float64[first_edges]     successor confidences
+    second_codes    int64[second_rows]       prev * vocab + current, sorted
+    second_indptr   int64[second_rows + 1]
+    second_succ     int32[second_edges]
+    second_conf     float64[second_edges]
+    template_rules  UTF-8 JSON of the template rules (see Templater.to_json)
+
+A model recorded over templates sets the templated flag and stores its
+rules, so readers can map actions to states and fill predicted templates.
+Confidences are the weight over the source's total weight, as Predictor
+computes them, and every row is sorted by confidence, so top-K is a slice.
+Opening a snapshot maps the file and casts memoryviews over it; nothing is
+parsed or copied, and every process mapping the same file shares one copy
+in the page cache.
+"""
+import bisect
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Iterable
+
+from thirdlayer_prototype.models.template import Templater
+
+if TYPE_CHECKING:
+    from thirdlayer_prototype.db.storage import Storage
+
+
+SNAPSHOT_VERSION = 2
+
+_MAGIC = b"TLSNAP\x00\x00"
+
+# magic, version, flags, created_at, vocab size, vocab blob bytes,
+# first-order edges, second-order rows, second-order edges, template rules bytes
+_HEADER = struct.Struct("<8sIIdQQQQQQ")
+
+# Header flag: transitions are over templates and template_rules holds the rules.
+_FLAG_TEMPLATED = 1
+
+_ALIGNMENT = 8
+
+
+@dataclass
+class SnapshotInfo:
+    """Header fields and size of a snapshot file."""
+    
+    version: int
+    created_at: float
+    vocab_size: int
+    first_order_edges: int
+    second_order_rows: int
+    second_order_edges: int
+    bytes: int
+    templated: bool = False
+    
+    def to_dict(self) -> dict[str, Any]:
+        """Convert info to dictionary."""
+        return {
+            "version": self.version,
+            "created_at": self.created_at,
+            "vocab_size": self.vocab_size,
+            "first_order_edges": self.first_order_edges,
+            "second_order_rows": self.second_order_rows,
+            "second_order_edges": self.second_order_edges,
+            "bytes": self.bytes,
+            "templated": self.templated,
+        }
+
+
+def write_snapshot(storage: "Storage", path: str) -> SnapshotInfo:
+    """Export storage's first- and second-order model to a snapshot file.
+    
+    The tables are read in one transaction, and storage.templater's rules
+    are stored with them. The file is written next to path and renamed over
+    it, so readers see either the old snapshot or the new one, never a
+    partial file.
+    """
+    _check_byteorder()
+    with storage._reader() as conn:
+        owns_transaction = not conn.in_transaction
+        if owns_transaction:
+            conn.execute("BEGIN")
+        try:
+            vocab_rows = conn.execute("SELECT id, signature FROM action_vocab").fetchall()
+            first_rows = conn.execute(
+                """
+                SELECT t.from_id, t.to_id, t.weight, s.weight
+                FROM transitions_first_order t
+                JOIN transition_totals_first_order s ON s.from_id = t.from_id
+                """
+            ).fetchall()
+            second_rows = conn.execute(
+                """
+                SELECT t.from_id_1, t.from_id_2, t.to_id, t.weight, s.weight
+                FROM transitions_second_order t
+                JOIN transition_totals_second_order s
+                    ON s.from_id_1 = t.from_id_1 AND s.from_id_2 = t.from_id_2
+                """
+            ).fetchall()
+        finally:
+            if owns_transaction:
+                conn.rollback()
+    
+    encoded = sorted((row[1].encode("utf-8"), row[0]) for row in vocab_rows)
+    index = {action_id: i for i, (_, action_id) in enumerate(encoded)}
+    n = len(encoded)
+    vocab_offsets = array("q", [0])
+    for signature, _ in encoded:
+        vocab_offsets.append(vocab_offsets[-1] + len(signature))
+    vocab_blob = b"".join(signature for signature, _ in encoded)
+    
+    first: dict[int, list[tuple[float, int]]] = {}
+    for from_id, to_id, weight, total in first_rows:
+        if total > 0:
+            first.setdefault(index[from_id], []).append((weight / total, to_id))
+    first_indptr, first_succ, first_conf = _csr(range(n), first, index)
+    
+    second: dict[int, list[tuple[float, int]]] = {}
+    for id_1, id_2, to_id, weight, total in second_rows:
+        if total > 0:
+            code = index[id_1] * n + index[id_2]
+            second.setdefault(code, []).append((weight / total, to_id))
+    second_codes = array("q", sorted(second))
+    second_indptr, second_succ, second_conf = _csr(second_codes, second, index)
+    
+    templater = storage.templater
+    template_rules = templater.to_json().encode("utf-8") if templater is not None else b""
+    created_at = time.time()
+    header = _HEADER.pack(
+        _MAGIC,
+        SNAPSHOT_VERSION,
+        _FLAG_TEMPLATED if templater is not None else 0,
+        created_at,
+        n,
+        len(vocab_blob),
+        len(first_succ),
+        len(second_codes),
+        len(second_succ),
+        len(template_rules),
+    )
+    sections = [
+        vocab_offsets,
+        vocab_blob,
+        first_indptr,
+        first_succ,
+        first_conf,
+        second_codes,
+        second_indptr,
+        second_succ,
+        second_conf,
+        template_rules,
+    ]
+    
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        for section in sections:
+            f.write(b"\x00" * (-f.tell() % _ALIGNMENT))
+            f.write(section)
+        size = f.tell()
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return SnapshotInfo(
+        version=SNAPSHOT_VERSION,
+        created_at=created_at,
+        vocab_size=n,
+        first_order_edges=len(first_succ),
+        second_order_rows=len(second_codes),
+        second_order_edges=len(second_succ),
+        bytes=size,
+        templated=templater is not None,
+    )
+
+
+class Snapshot:
+    """Memory-mapped, read-only view of a snapshot file.
+    
+    Rows are addressed by vocab index, the position of a signature in the
+    sorted vocab. The file may be replaced while it is open; the mapping
+    keeps the old contents until close(). templater holds the stored
+    template rules, or None for a model over concrete actions.
+    """
+    
+    def __init__(self, path: str):
+        _check_byteorder()
+        self.path = path
+        with open(path, "rb") as f:
+            self._stat = os.fstat(f.fileno())
+            if self._stat.st_size < _HEADER.size:
+                raise ValueError(f"{path} is too small to be a snapshot")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._map_arrays()
+        except BaseException:
+            self._mmap.close()
+            raise
+    
+    def _map_arrays(self) -> None:
+        """Validate the header and cast a memoryview over every array."""
+        (
+            magic,
+            version,
+            flags,
+            created_at,
+            n,
+            blob_size,
+            first_edges,
+            second_rows,
+            second_edges,
+            rules_size,
+        ) = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            raise ValueError(f"{self.path} is not a snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(
+                f"{self.path} has snapshot version {version}, expected {SNAPSHOT_VERSION}"
+            )
+        
+        # Bounds are checked before any view exists, so a bad file can
+        # still be unmapped.
+        spans = []
+        offset = _HEADER.size
+        for typecode, length in (
+            ("q", n + 1),
+            ("B", blob_size),
+            ("q", n + 1),
+            ("i", first_edges),
+            ("d", first_edges),
+            ("q", second_rows),
+            ("q", second_rows + 1),
+            ("i", second_edges),
+            ("d", second_edges),
+            ("B", rules_size),
+        ):
+            offset += -offset % _ALIGNMENT
+            end = offset + length * struct.calcsize(typecode)
+            spans.append((typecode, offset, end))
+            offset = end
+        if offset > len(self._mmap):
+            raise ValueError(f"{self.path} is truncated")
+        
+        view = memoryview(self._mmap)
+        arrays = [view[start:end].cast(typecode) for typecode, start, end in spans]
+        (
+            self._vocab_offsets,
+            self._vocab_blob,
+            self._first_indptr,
+            self._first_succ,
+            self._first_conf,
+            self._second_codes,
+            self._second_indptr,
+            self._second_succ,
+            self._second_conf,
+            template_rules,
+        ) = arrays
+        self._views = [view, *arrays]
+        self.templater = (
+            Templater.from_json(template_rules.tobytes().decode("utf-8"))
+            if flags & _FLAG_TEMPLATED
+            else None
+        )
+        self.info = SnapshotInfo(
+            version=version,
+            created_at=created_at,
+            vocab_size=n,
+            first_order_edges=first_edges,
+            second_order_rows=second_rows,
+            second_order_edges=second_edges,
+            bytes=len(view),
+            templated=self.templater is not None,
+        )
+    
+    def __enter__(self) -> "Snapshot":
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+    
+    def close(self) -> None:
+        """Unmap the file; the snapshot cannot be read afterwards."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+    
+    def same_file(self, path: str | None = None) -> bool:
+        """Check whether path (default: self.path) still names the mapped file."""
+        try:
+            stat = os.stat(path or self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size) == (
+            self._stat.st_dev,
+            self._stat.st_ino,
+            self._stat.st_mtime_ns,
+            self._stat.st_size,
+        )
+    
+    def index_of(self, signature: str) -> int | None:
+        """Binary-search the sorted vocab for a signature's index."""
+        key = signature.encode("utf-8")
+        offsets = self._vocab_offsets
+        lo, hi = 0, self.info.vocab_size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = self._vocab_blob[offsets[mid]:offsets[mid + 1]].tobytes()
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return mid
+        return None
+    
+    def signature(self, index: int) -> str:
+        """Get the signature at a vocab index."""
+        start, end = self._vocab_offsets[index], self._vocab_offsets[index + 1]
+        return self._vocab_blob[start:end].tobytes().decode("utf-8")
+    
+    def first_order_top_k(self, index: int, k: int) -> list[tuple[int, float]]:
+        """Get up to K (successor index, confidence) pairs of an action."""
+        start = self._first_indptr[index]
+        end = min(self._first_indptr[index + 1], start + k)
+        return list(zip(self._first_succ[start:end], self._first_conf[start:end]))
+    
+    def second_order_top_k(self, prev: int, current: int, k: int) -> list[tuple[int, float]]:
+        """Get up to K (successor index, confidence) pairs of an action pair."""
+        code = prev * self.info.vocab_size + current
+        row = bisect.bisect_left(self._second_codes, code)
+        if row == len(self._second_codes) or self._second_codes[row] != code:
+            return []
+        start = self._second_indptr[row]
+        end = min(self._second_indptr[row + 1], start + k)
+        return list(zip(self._second_succ[start:end], self._second_conf[start:end]))
+
+
+def _csr(
+    keys: Iterable[int], rows: dict[int, list[tuple[float, int]]], index: dict[int, int]
+) -> tuple[array, array, array]:
+    """Lay out rows in key order as (indptr, successor indexes, confidences).
+    
+    Successors are sorted by confidence, ties by action id like the
+    transition cache.
+    """
+    indptr = array("q", [0])
+    successors = array("i")
+    confidences = array("d")
+    for key in keys:
+        for confidence, to_id in sorted(rows.get(key, ()), key=lambda e: (-e[0], e[1])):
+            successors.append(index[to_id])
+            confidences.append(confidence)
+        indptr.append(len(successors))
+    return indptr, successors, confidences
+
+
+def _check_byteorder() -> None:
+    """Snapshots are little-endian and mapped without conversion."""
+    if sys.byteorder != "little":
+        raise RuntimeError("snapshots need a little-endian host")
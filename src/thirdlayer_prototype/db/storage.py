@@ -4,182 +4,1511 @@ Uses stdlib sqlite3 with no ORM. Maintains schema consistency.
 """
 import sqlite3
 import json
+import os
+import queue
+import threading
 import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Sequence
 
+from thirdlayer_prototype.db.cache import TransitionCache
+from thirdlayer_prototype.db.context_tree import ContextTree, encode_context
 from thirdlayer_prototype.models.action import Action
+from thirdlayer_prototype.models.state import page_pattern
+from thirdlayer_prototype.models.template import TemplateRule, Templater
+
+if TYPE_CHECKING:
+    from thirdlayer_prototype.db.snapshot import SnapshotInfo
+
+
+SCHEMA_VERSION = 7
+
+# Bound on bound parameters per statement for set-based lookups.
+_QUERY_CHUNK_SIZE = 500
+
+# Connection tuning for wal mode, applied to the writer and every reader.
+_WAL_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16384",  # 16 MiB page cache per connection
+    "PRAGMA mmap_size = 268435456",  # 256 MiB
+)
+
+# Size the WAL file is truncated back to after a checkpoint resets it.
+_JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+_CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
+# Stored weights grow by 2x per half-life since the decay epoch; once the
+# epoch is this many half-lives old, the next write moves it forward.
+_REBASE_AFTER_HALF_LIVES = 64
+
+_TRANSITION_TABLES = ("transitions_first_order", "transitions_second_order", "transitions_page")
+_TOTALS_TABLES = (
+    "transition_totals_first_order",
+    "transition_totals_second_order",
+    "transition_totals_page",
+)
+
+_TRIGGERS = (
+    "trg_transitions_first_insert",
+    "trg_transitions_first_update",
+    "trg_transitions_first_delete",
+    "trg_transitions_second_insert",
+    "trg_transitions_second_update",
+    "trg_transitions_second_delete",
+    "trg_transitions_page_insert",
+    "trg_transitions_page_update",
+    "trg_transitions_page_delete",
+)
+
+# Inactivity gap that splits pre-v4 action logs into sessions.
+_LEGACY_SESSION_GAP_SECONDS = 1800.0
+
+_INSERT_ACTION = """
+    INSERT INTO actions (action_signature, action_json, timestamp, url, success, session_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_UPSERT_FIRST_ORDER = """
+    INSERT INTO transitions_first_order (from_id, to_id, count, weight, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(from_id, to_id)
+    DO UPDATE SET
+        count = count + excluded.count,
+        weight = weight + excluded.weight,
+        updated_at = MAX(updated_at, excluded.updated_at)
+"""
+
+_UPSERT_SECOND_ORDER = """
+    INSERT INTO transitions_second_order (from_id_1, from_id_2, to_id, count, weight, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(from_id_1, from_id_2, to_id)
+    DO UPDATE SET
+        count = count + excluded.count,
+        weight = weight + excluded.weight,
+        updated_at = MAX(updated_at, excluded.updated_at)
+"""
+
+_UPSERT_PAGE = """
+    INSERT INTO transitions_page (page_id, from_id, to_id, count, weight, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(page_id, from_id, to_id)
+    DO UPDATE SET
+        count = count + excluded.count,
+        weight = weight + excluded.weight,
+        updated_at = MAX(updated_at, excluded.updated_at)
+"""
+
+_UPSERT_CONTEXT = """
+    INSERT INTO transitions_context (context, to_id, count, weight, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(context, to_id)
+    DO UPDATE SET
+        count = count + excluded.count,
+        weight = weight + excluded.weight,
+        updated_at = MAX(updated_at, excluded.updated_at)
+"""
 
 
 class Storage:
-    """SQLite storage manager for action transitions."""
+    """SQLite storage manager for action transitions.
+    
+    Transitions reference actions through integer ids from the action_vocab
+    table; the signature<->id mapping is kept in process.
+    
+    With cache_transitions enabled, both transition tables are mirrored in a
+    TransitionCache that is warmed at connect() and updated write-through, so
+    transition lookups never touch disk; the whole vocab is loaded with it,
+    so unknown actions are recognized without a query. The cache only sees
+    this process's writes: a long-lived writer must call reload_cache() after
+    another process compacts the tables (see db/compaction.py).
+    
+    With context_order set, contexts of up to that many preceding actions are
+    also kept in a ContextTree (persisted in transitions_context) for
+    variable-order prediction. Context weights decay like the other
+    transitions.
+    
+    With wal enabled, the database runs in WAL journal mode and reads go
+    through a pool of reader_pool_size query-only connections, so they never
+    wait on a recording transaction held by the writer connection (conn).
+    SQLite checkpoints the WAL automatically every checkpoint_pages pages;
+    checkpoint() forces one.
+    
+    Transitions also carry a time-decayed weight: each observation counts
+    half as much per half_life seconds of age. Decay is lazy. A write adds
+    2 ** ((t - epoch) / half_life) to the stored weight and a read scales it
+    by 2 ** (-(now - epoch) / half_life), so no row is ever rewritten to age
+    it. The epoch moves forward (one pass over the tables) only when the
+    half-life changes or the epoch is _REBASE_AFTER_HALF_LIVES half-lives
+    old. half_life=None keeps the half-life stored in the database (no decay
+    for a new one); 0 turns decay off, making weights equal counts.
+    
+    Every logged action carries a session_id. record_session() starts a new
+    session per call; record_action() uses session_id, which new_session()
+    replaces.
     
-    def __init__(self, db_path: str = "thirdlayer.db"):
+    With a templater, transitions are recorded and looked up over action
+    templates (see models/template.py) while the actions log keeps the
+    concrete actions. The first connect() to a database without transitions
+    stores the template rules (or their absence). Later, a database opened
+    without a templater adopts the stored rules, and one opened with other
+    rules raises ValueError; rebuild_transitions() converts a database to
+    new rules.
+    
+    With page_context enabled, first-order transitions are also counted per
+    page pattern (see models/state.py page_pattern) of the page the next
+    action was taken on, for get_page_top_k().
+    """
+    
+    def __init__(
+        self,
+        db_path: str = "thirdlayer.db",
+        cache_transitions: bool = False,
+        context_order: int = 0,
+        wal: bool = False,
+        reader_pool_size: int = 4,
+        checkpoint_pages: int = 1000,
+        half_life: float | None = None,
+        templater: Templater | None = None,
+        page_context: bool = False,
+    ):
+        if wal and db_path == ":memory:":
+            raise ValueError("wal mode needs an on-disk database")
         self.db_path = db_path
         self.conn: sqlite3.Connection | None = None
+        self.wal = wal
+        self.reader_pool_size = reader_pool_size
+        self.checkpoint_pages = checkpoint_pages
+        self._readers: queue.Queue[sqlite3.Connection] | None = None
+        self._reader_conns: list[sqlite3.Connection] = []
+        self._writer_thread: int | None = None
+        self.cache: TransitionCache | None = TransitionCache() if cache_transitions else None
+        self.context_tree: ContextTree | None = (
+            ContextTree(context_order) if context_order > 0 else None
+        )
+        self._batch_depth = 0
+        self._sig_to_id: dict[str, int] = {}
+        self._id_to_sig: dict[int, str] = {}
+        self.requested_half_life = half_life
+        self.half_life = 0.0
+        self.decay_epoch = 0.0
+        self.session_id = new_session_id()
+        self.templater = templater
+        self.page_context = page_context
+        self._page_ids: dict[str, int] = {}
+    
+    def new_session(self) -> str:
+        """Start a new session for later record_action() calls.
+        
+        Returns the new session id.
+        """
+        self.session_id = new_session_id()
+        return self.session_id
+    
+    def connect(self, read_only: bool = False) -> None:
+        """Connect to database and initialize schema.
         
-    def connect(self) -> None:
-        """Connect to database and initialize schema."""
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row
-        self._initialize_schema()
+        With read_only, the database must already exist; the connection is
+        opened in SQLite read-only mode, skips schema initialization, and may
+        be closed from another thread.
+        """
+        if read_only:
+            if self.db_path == ":memory:":
+                raise ValueError("read-only connections need an on-disk database")
+            uri = Path(self.db_path).absolute().as_uri() + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            self._load_decay_clock()
+        else:
+            self.conn = sqlite3.connect(self.db_path)
+            self.conn.row_factory = sqlite3.Row
+            self._writer_thread = threading.get_ident()
+            if not self._table_exists("actions"):
+                # Only takes effect before WAL and the first table; lets
+                # compaction hand freed pages back to the filesystem.
+                self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            if self.wal:
+                self._configure_writer()
+            self._initialize_schema()
+            self._load_decay_clock()
+            if (
+                self.requested_half_life is not None
+                and self.requested_half_life != self.half_life
+            ):
+                self._rebase_decay(time.time(), self.requested_half_life)
+            if self.wal:
+                self._open_readers()
+        try:
+            self._load_templater()
+        except ValueError:
+            self.close()
+            raise
+        if self.cache is not None:
+            self._load_vocab()
+            self.cache.load(self.conn)
+        if self.context_tree is not None:
+            self.context_tree.load(self.conn)
+    
+    def _configure_writer(self) -> None:
+        """Switch the writer connection to WAL and apply tuning pragmas."""
+        mode = self.conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            raise RuntimeError(f"could not enable WAL journaling (got {mode!r})")
+        for pragma in _WAL_PRAGMAS:
+            self.conn.execute(pragma)
+        # NORMAL is durable across application crashes in WAL mode; only an
+        # OS crash can lose the last commits.
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute(f"PRAGMA wal_autocheckpoint = {int(self.checkpoint_pages)}")
+        self.conn.execute(f"PRAGMA journal_size_limit = {_JOURNAL_SIZE_LIMIT}")
+    
+    def _open_readers(self) -> None:
+        """Open the pool of query-only reader connections."""
+        self._readers = queue.Queue()
+        for _ in range(max(1, self.reader_pool_size)):
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            for pragma in _WAL_PRAGMAS:
+                conn.execute(pragma)
+            conn.execute("PRAGMA query_only = ON")
+            self._reader_conns.append(conn)
+            self._readers.put(conn)
+    
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for a read query.
+        
+        Without a reader pool, or inside a batch() opened on this thread
+        (which must see its own uncommitted writes), this is the writer
+        connection; otherwise a pooled reader, waiting for one to free up.
+        """
+        if self._readers is None or (
+            self._batch_depth and threading.get_ident() == self._writer_thread
+        ):
+            yield self.conn
+            return
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+    
+    def checkpoint(self, mode: str = "PASSIVE") -> tuple[int, int, int]:
+        """Checkpoint the WAL into the main database file.
+        
+        PASSIVE copies what it can without waiting; TRUNCATE waits for readers
+        and then empties the WAL file.
+        
+        Returns (busy, wal_frames, checkpointed_frames) as reported by SQLite.
+        """
+        mode = mode.upper()
+        if mode not in _CHECKPOINT_MODES:
+            raise ValueError(f"unknown checkpoint mode {mode!r}")
+        if self._batch_depth:
+            raise RuntimeError("cannot checkpoint inside batch()")
+        row = self.conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return row[0], row[1], row[2]
     
     def _initialize_schema(self) -> None:
-        """Load and execute schema.sql."""
+        """Load and execute schema.sql, migrating older databases first.
+        
+        The whole upgrade runs in one transaction and is tracked with
+        PRAGMA user_version.
+        """
         schema_path = Path(__file__).parent / "schema.sql"
         with open(schema_path, "r") as f:
             schema_sql = f.read()
-        self.conn.executescript(schema_sql)
-        self.conn.commit()
+        
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0 and not self._table_exists("actions"):
+            version = SCHEMA_VERSION
+        
+        self.conn.execute("BEGIN")
+        try:
+            self._migrate_before_schema(version)
+            for statement in _split_statements(schema_sql):
+                self.conn.execute(statement)
+            self._migrate_after_schema(version)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+    
+    def _table_exists(self, name: str) -> bool:
+        """Check whether a table exists in the database."""
+        row = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone()
+        return row is not None
+    
+    def _column_exists(self, table: str, column: str) -> bool:
+        """Check whether a table has a column."""
+        return any(row[1] == column for row in self.conn.execute(f"PRAGMA table_info({table})"))
+    
+    def _migrate_before_schema(self, version: int) -> None:
+        """Move pre-version tables out of the way of schema.sql."""
+        if version < 1:
+            # v0 keyed transitions on signature text; keep the rows for copying.
+            for table in _TRANSITION_TABLES:
+                if self._table_exists(table):
+                    self.conn.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+        if version < 3:
+            # v3 adds decay weights; the new indexes and triggers reference them.
+            columns = [(table, "weight", "REAL NOT NULL DEFAULT 0") for table in _TOTALS_TABLES]
+            for table in _TRANSITION_TABLES:
+                columns.append((table, "weight", "REAL NOT NULL DEFAULT 0"))
+                columns.append((table, "updated_at", "REAL NOT NULL DEFAULT 0"))
+            for table, column, definition in columns:
+                if self._table_exists(table) and not self._column_exists(table, column):
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            for trigger in _TRIGGERS:
+                self.conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            for index in ("idx_transitions_first_top", "idx_transitions_second_top"):
+                self.conn.execute(f"DROP INDEX IF EXISTS {index}")
+        if version < 4 and not self._column_exists("actions", "session_id"):
+            self.conn.execute("ALTER TABLE actions ADD COLUMN session_id TEXT")
+        if (
+            version < 5
+            and self._table_exists("template_rules")
+            and not self._column_exists("template_rules", "aliases")
+        ):
+            self.conn.execute(
+                "ALTER TABLE template_rules ADD COLUMN aliases TEXT NOT NULL DEFAULT '[]'"
+            )
+        if version < 6 and self._table_exists("transitions_context"):
+            # v6 decays context counts like the other transitions.
+            for column in ("weight", "updated_at"):
+                if not self._column_exists("transitions_context", column):
+                    self.conn.execute(
+                        f"ALTER TABLE transitions_context "
+                        f"ADD COLUMN {column} REAL NOT NULL DEFAULT 0"
+                    )
+    
+    def _migrate_after_schema(self, version: int) -> None:
+        """Copy data from pre-version tables into the current schema."""
+        if version < 1:
+            self._migrate_signature_transitions()
+        if version < 3:
+            # Existing counts carry no timestamps; treat them as observed now.
+            now = time.time()
+            for table in _TRANSITION_TABLES:
+                self.conn.execute(f"UPDATE {table} SET weight = count, updated_at = ?", (now,))
+            self._rebuild_transition_totals()
+        if version < 4:
+            self._backfill_session_ids()
+        if version < 6:
+            # Existing context counts carry no timestamps; treat them as
+            # observed now, under the stored decay clock.
+            self._load_decay_clock()
+            now = time.time()
+            self.conn.execute(
+                "UPDATE transitions_context SET weight = count * ?, updated_at = ?",
+                (1.0 / self.decay_scale(now), now),
+            )
+        if version < 7:
+            # v7 keeps per-context totals, so compaction can prune contexts.
+            self.conn.execute("DELETE FROM transition_totals_context")
+            self.conn.execute(
+                """
+                INSERT INTO transition_totals_context (context, total, weight)
+                SELECT context, SUM(count), SUM(weight)
+                FROM transitions_context
+                GROUP BY context
+                """
+            )
+    
+    def _migrate_signature_transitions(self) -> None:
+        """Intern v0 signature-keyed transitions into action_vocab ids."""
+        legacy_first = self._table_exists("legacy_transitions_first_order")
+        legacy_second = self._table_exists("legacy_transitions_second_order")
+        
+        if legacy_first:
+            self.conn.execute(
+                """
+                INSERT OR IGNORE INTO action_vocab (signature)
+                SELECT from_action FROM legacy_transitions_first_order
+                UNION SELECT to_action FROM legacy_transitions_first_order
+                """
+            )
+            self.conn.execute(
+                """
+                INSERT INTO transitions_first_order (from_id, to_id, count)
+                SELECT f.id, t.id, l.count
+                FROM legacy_transitions_first_order l
+                JOIN action_vocab f ON f.signature = l.from_action
+                JOIN action_vocab t ON t.signature = l.to_action
+                """
+            )
+            self.conn.execute("DROP TABLE legacy_transitions_first_order")
+        
+        if legacy_second:
+            self.conn.execute(
+                """
+                INSERT OR IGNORE INTO action_vocab (signature)
+                SELECT from_action_1 FROM legacy_transitions_second_order
+                UNION SELECT from_action_2 FROM legacy_transitions_second_order
+                UNION SELECT to_action FROM legacy_transitions_second_order
+                """
+            )
+            self.conn.execute(
+                """
+                INSERT INTO transitions_second_order (from_id_1, from_id_2, to_id, count)
+                SELECT f1.id, f2.id, t.id, l.count
+                FROM legacy_transitions_second_order l
+                JOIN action_vocab f1 ON f1.signature = l.from_action_1
+                JOIN action_vocab f2 ON f2.signature = l.from_action_2
+                JOIN action_vocab t ON t.signature = l.to_action
+                """
+            )
+            self.conn.execute("DROP TABLE legacy_transitions_second_order")
+        
+        for index in ("idx_transitions_first_from", "idx_transitions_second_from"):
+            self.conn.execute(f"DROP INDEX IF EXISTS {index}")
+    
+    def _backfill_session_ids(self) -> None:
+        """Split the pre-v4 actions log into sessions on inactivity gaps."""
+        updates = []
+        session_id = None
+        last_timestamp = None
+        for action_id, timestamp in self.conn.execute(
+            "SELECT id, timestamp FROM actions WHERE session_id IS NULL ORDER BY timestamp, id"
+        ):
+            if (
+                last_timestamp is None
+                or timestamp - last_timestamp > _LEGACY_SESSION_GAP_SECONDS
+            ):
+                session_id = f"legacy-{action_id}"
+            last_timestamp = timestamp
+            updates.append((session_id, action_id))
+        self.conn.executemany("UPDATE actions SET session_id = ? WHERE id = ?", updates)
+    
+    def _rebuild_transition_totals(self) -> None:
+        """Recompute per-source totals from the transition rows."""
+        self.conn.execute("DELETE FROM transition_totals_first_order")
+        self.conn.execute(
+            """
+            INSERT INTO transition_totals_first_order (from_id, total, weight)
+            SELECT from_id, SUM(count), SUM(weight)
+            FROM transitions_first_order
+            GROUP BY from_id
+            """
+        )
+        self.conn.execute("DELETE FROM transition_totals_second_order")
+        self.conn.execute(
+            """
+            INSERT INTO transition_totals_second_order (from_id_1, from_id_2, total, weight)
+            SELECT from_id_1, from_id_2, SUM(count), SUM(weight)
+            FROM transitions_second_order
+            GROUP BY from_id_1, from_id_2
+            """
+        )
+    
+    def _load_decay_clock(self) -> None:
+        """Read the decay half-life and epoch, starting a new clock if unset."""
+        meta = dict(self.conn.execute("SELECT key, value FROM storage_meta").fetchall())
+        if "decay_epoch" in meta:
+            self.half_life = meta.get("decay_half_life", 0.0)
+            self.decay_epoch = meta["decay_epoch"]
+            return
+        self.half_life = 0.0
+        self.decay_epoch = time.time()
+        if self._writer_thread is not None:
+            self._save_decay_clock()
+            self._commit()
+    
+    def _save_decay_clock(self) -> None:
+        """Write the decay half-life and epoch to storage_meta."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO storage_meta (key, value) VALUES (?, ?)",
+            [("decay_half_life", self.half_life), ("decay_epoch", self.decay_epoch)],
+        )
+    
+    def _load_templater(self) -> None:
+        """Adopt or check the template rules stored with the database.
+        
+        Databases that store none yet and have no transitions store the
+        current ones; older databases with transitions are left unchecked.
+        """
+        row = self.conn.execute(
+            "SELECT value FROM storage_meta WHERE key = 'templates'"
+        ).fetchone()
+        if row is None:
+            if self._writer_thread is not None and not self._has_transitions():
+                self._save_templater(self.templater)
+                self._commit()
+            return
+        
+        stored = None
+        if row[0]:
+            rules = self.conn.execute(
+                """
+                SELECT action_type, attribute, pattern, selector, aliases
+                FROM template_rules ORDER BY position
+                """
+            ).fetchall()
+            stored = Templater(
+                [TemplateRule(*rule[:4], aliases=json.loads(rule[4])) for rule in rules]
+            )
+        if self.templater is None:
+            self.templater = stored
+        elif stored is None:
+            raise ValueError(
+                f"{self.db_path} was recorded without templates; "
+                "rebuild_transitions() converts it"
+            )
+        elif stored.rules != self.templater.rules:
+            raise ValueError(
+                f"{self.db_path} was recorded with other template rules; "
+                "open it without a templater or convert it with rebuild_transitions()"
+            )
+    
+    def _save_templater(self, templater: Templater | None) -> None:
+        """Write the template rules, or their absence, to the database."""
+        self.conn.execute("DELETE FROM template_rules")
+        rules = templater.rules if templater is not None else ()
+        self.conn.executemany(
+            """
+            INSERT INTO template_rules
+                (position, action_type, attribute, pattern, selector, aliases)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    position,
+                    rule.action_type,
+                    rule.attribute,
+                    rule.pattern,
+                    rule.selector,
+                    json.dumps(rule.aliases),
+                )
+                for position, rule in enumerate(rules)
+            ],
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO storage_meta (key, value) VALUES ('templates', ?)",
+            (1.0 if templater is not None else 0.0,),
+        )
+    
+    def _has_transitions(self) -> bool:
+        """Check whether any first-order transition is stored."""
+        return self.conn.execute(
+            "SELECT 1 FROM transitions_first_order LIMIT 1"
+        ).fetchone() is not None
+    
+    def _rebase_decay(self, now: float, half_life: float) -> None:
+        """Move the decay epoch to now and switch to half_life.
+        
+        Rewrites every stored weight to its current decayed value, the only
+        full pass decay ever needs.
+        """
+        scale = self.decay_scale(now)
+        with self.batch():
+            for table in (*_TRANSITION_TABLES, "transitions_context"):
+                self.conn.execute(f"UPDATE {table} SET weight = weight * ?", (scale,))
+            # Triggers scaled the row part of each total; scale the rest, the
+            # weight of rows removed by compaction, to match.
+            self.conn.execute(
+                """
+                UPDATE transition_totals_first_order AS s
+                SET weight = weight + (weight - COALESCE(
+                    (SELECT SUM(t.weight) FROM transitions_first_order t
+                     WHERE t.from_id = s.from_id), 0
+                )) * (? - 1)
+                """,
+                (scale,),
+            )
+            self.conn.execute(
+                """
+                UPDATE transition_totals_second_order AS s
+                SET weight = weight + (weight - COALESCE(
+                    (SELECT SUM(t.weight) FROM transitions_second_order t
+                     WHERE t.from_id_1 = s.from_id_1 AND t.from_id_2 = s.from_id_2), 0
+                )) * (? - 1)
+                """,
+                (scale,),
+            )
+            self.conn.execute(
+                """
+                UPDATE transition_totals_page AS s
+                SET weight = weight + (weight - COALESCE(
+                    (SELECT SUM(t.weight) FROM transitions_page t
+                     WHERE t.page_id = s.page_id AND t.from_id = s.from_id), 0
+                )) * (? - 1)
+                """,
+                (scale,),
+            )
+            self.conn.execute(
+                """
+                UPDATE transition_totals_context AS s
+                SET weight = weight + (weight - COALESCE(
+                    (SELECT SUM(t.weight) FROM transitions_context t
+                     WHERE t.context = s.context), 0
+                )) * (? - 1)
+                """,
+                (scale,),
+            )
+            self.half_life = half_life
+            self.decay_epoch = now
+            self._save_decay_clock()
+        if self.cache is not None:
+            self.cache.load(self.conn)
+        if self.context_tree is not None:
+            self.context_tree.load(self.conn)
+    
+    def reload_cache(self) -> None:
+        """Reload the transition cache and the context tree from the tables.
+        
+        The cache is reloaded with the action vocab. Both only see this
+        process's writes; call this after another process rewrote the
+        tables, e.g. ran a compaction.
+        """
+        if self.cache is not None:
+            self._load_vocab()
+            self.cache.load(self.conn)
+        if self.context_tree is not None:
+            self.context_tree.load(self.conn)
+    
+    def decay_scale(self, now: float | None = None) -> float:
+        """Factor converting stored weights to decayed weights at time now."""
+        if not self.half_life:
+            return 1.0
+        now = time.time() if now is None else now
+        return 2.0 ** (-(now - self.decay_epoch) / self.half_life)
+    
+    def _observation_weight(self, timestamp: float) -> float:
+        """Stored weight of one observation made at timestamp.
+        
+        Moves the epoch forward first when it has grown too old, so stored
+        weights stay far from float overflow.
+        """
+        if not self.half_life:
+            return 1.0
+        if timestamp - self.decay_epoch > _REBASE_AFTER_HALF_LIVES * self.half_life:
+            self._rebase_decay(timestamp, self.half_life)
+        return 2.0 ** ((timestamp - self.decay_epoch) / self.half_life)
     
     def close(self) -> None:
         """Close database connection."""
+        for conn in self._reader_conns:
+            conn.close()
+        self._reader_conns.clear()
+        self._readers = None
         if self.conn:
             self.conn.close()
             self.conn = None
     
-    def record_action(self, action: Action, url: str = "", success: bool = True) -> int:
-        """Record an action execution.
+    @contextmanager
+    def batch(self) -> Iterator["Storage"]:
+        """Group writes into a single transaction.
+        
+        Record calls made inside the block skip their per-call commit; the
+        outermost block commits once on exit or rolls back on error. Blocks
+        may be nested.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._rollback()
+            raise
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self.conn.commit()
+    
+    def _commit(self) -> None:
+        """Commit unless a batch() block is open."""
+        if self._batch_depth == 0:
+            self.conn.commit()
+    
+    def _rollback(self) -> None:
+        """Roll back and drop in-process state that may reference lost rows."""
+        self.conn.rollback()
+        self._sig_to_id.clear()
+        self._id_to_sig.clear()
+        self._page_ids.clear()
+        self._load_decay_clock()
+        if self.cache is not None:
+            self._load_vocab()
+            self.cache.load(self.conn)
+        if self.context_tree is not None:
+            self.context_tree.load(self.conn)
+    
+    def _action_id(self, signature: str) -> int:
+        """Get the vocab id for a signature, interning it if new."""
+        action_id = self._sig_to_id.get(signature)
+        if action_id is not None:
+            return action_id
+        
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO action_vocab (signature) VALUES (?)", (signature,)
+        )
+        if cursor.rowcount == 1:
+            action_id = cursor.lastrowid
+        else:
+            action_id = self.conn.execute(
+                "SELECT id FROM action_vocab WHERE signature = ?", (signature,)
+            ).fetchone()[0]
+        self._remember(action_id, signature)
+        return action_id
+    
+    def _lookup_action_id(
+        self, signature: str, conn: sqlite3.Connection | None = None
+    ) -> int | None:
+        """Get the vocab id for a signature without interning it.
+        
+        With the cache on, the whole vocab is in process, so a miss is an
+        unknown action and costs no query.
+        """
+        action_id = self._sig_to_id.get(signature)
+        if action_id is not None or self.cache is not None:
+            return action_id
+        
+        row = (conn or self.conn).execute(
+            "SELECT id FROM action_vocab WHERE signature = ?", (signature,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._remember(row[0], signature)
+        return row[0]
+    
+    def _lookup_action_ids(
+        self, signatures: Iterable[str], conn: sqlite3.Connection | None = None
+    ) -> dict[str, int]:
+        """Get vocab ids for many signatures, fetching unknown ones in chunks.
+        
+        Signatures missing from the vocab are left out of the result. With
+        the cache on, the in-process vocab is complete and nothing is fetched.
+        """
+        signatures = set(signatures)
+        if self.cache is None:
+            missing = [sig for sig in signatures if sig not in self._sig_to_id]
+            for chunk in _chunks(missing, _QUERY_CHUNK_SIZE):
+                placeholders = ", ".join("?" * len(chunk))
+                for row in (conn or self.conn).execute(
+                    f"SELECT id, signature FROM action_vocab WHERE signature IN ({placeholders})",
+                    chunk,
+                ):
+                    self._remember(row[0], row[1])
+        return {sig: self._sig_to_id[sig] for sig in signatures if sig in self._sig_to_id}
+    
+    def _signatures(
+        self, action_ids: Iterable[int], conn: sqlite3.Connection | None = None
+    ) -> dict[int, str]:
+        """Resolve vocab ids to signatures, fetching unknown ids in one query."""
+        action_ids = set(action_ids)
+        missing = [i for i in action_ids if i not in self._id_to_sig]
+        for chunk in _chunks(missing, _QUERY_CHUNK_SIZE):
+            placeholders = ", ".join("?" * len(chunk))
+            for row in (conn or self.conn).execute(
+                f"SELECT id, signature FROM action_vocab WHERE id IN ({placeholders})",
+                chunk,
+            ):
+                self._remember(row[0], row[1])
+        return {i: self._id_to_sig[i] for i in action_ids}
+    
+    def _page_id(self, pattern: str) -> int:
+        """Get the page_vocab id for a page pattern, interning it if new."""
+        page_id = self._page_ids.get(pattern)
+        if page_id is not None:
+            return page_id
+        
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO page_vocab (pattern) VALUES (?)", (pattern,)
+        )
+        if cursor.rowcount == 1:
+            page_id = cursor.lastrowid
+        else:
+            page_id = self.conn.execute(
+                "SELECT id FROM page_vocab WHERE pattern = ?", (pattern,)
+            ).fetchone()[0]
+        self._page_ids[pattern] = page_id
+        return page_id
+    
+    def _lookup_page_id(
+        self, pattern: str, conn: sqlite3.Connection | None = None
+    ) -> int | None:
+        """Get the page_vocab id for a page pattern without interning it."""
+        page_id = self._page_ids.get(pattern)
+        if page_id is not None:
+            return page_id
+        
+        row = (conn or self.conn).execute(
+            "SELECT id FROM page_vocab WHERE pattern = ?", (pattern,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._page_ids[pattern] = row[0]
+        return row[0]
+    
+    def _load_vocab(self) -> None:
+        """Load the whole action vocab into the in-process map."""
+        self._sig_to_id.clear()
+        self._id_to_sig.clear()
+        for action_id, signature in self.conn.execute(
+            "SELECT id, signature FROM action_vocab"
+        ):
+            self._remember(action_id, signature)
+    
+    def _remember(self, action_id: int, signature: str) -> None:
+        """Add a vocab entry to the in-process map."""
+        self._sig_to_id[signature] = action_id
+        self._id_to_sig[action_id] = signature
+    
+    def _state_signature(self, action: Action) -> str:
+        """Signature of the Markov state of action: its template's, when templating."""
+        if self.templater is None:
+            return action.signature()
+        return self.templater.template(action).signature()
+    
+    def _to_transition_rows(
+        self,
+        rows: Sequence[tuple[int, int, float]],
+        conn: sqlite3.Connection | None = None,
+        scale: float = 1.0,
+    ) -> list[dict[str, Any]]:
+        """Convert (to_id, count, stored weight) rows into to_action/count/weight dicts.
+        
+        Stored weights are multiplied by scale (see decay_scale).
+        """
+        signatures = self._signatures((row[0] for row in rows), conn)
+        return [
+            {"to_action": signatures[to_id], "count": count, "weight": weight * scale}
+            for to_id, count, weight in rows
+        ]
+    
+    def record_action(
+        self,
+        action: Action,
+        url: str = "",
+        success: bool = True,
+        session_id: str | None = None,
+    ) -> int:
+        """Record an action execution in session_id (default: self.session_id).
         
         Returns the action ID.
         """
         cursor = self.conn.cursor()
         cursor.execute(
-            """
-            INSERT INTO actions (action_signature, action_json, timestamp, url, success)
-            VALUES (?, ?, ?, ?, ?)
-            """,
+            _INSERT_ACTION,
             (
                 action.signature(),
                 action.to_json(),
                 time.time(),
                 url,
                 1 if success else 0,
+                session_id or self.session_id,
             ),
         )
-        self.conn.commit()
+        self._commit()
         return cursor.lastrowid
     
     def record_transition_first_order(self, from_action: Action, to_action: Action) -> None:
         """Record or increment first-order transition count."""
-        from_sig = from_action.signature()
-        to_sig = to_action.signature()
+        from_id = self._action_id(self._state_signature(from_action))
+        to_id = self._action_id(self._state_signature(to_action))
+        now = time.time()
+        weight = self._observation_weight(now)
         
         cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO transitions_first_order (from_action, to_action, count)
-            VALUES (?, ?, 1)
-            ON CONFLICT(from_action, to_action)
-            DO UPDATE SET count = count + 1
-            """,
-            (from_sig, to_sig),
-        )
-        self.conn.commit()
+        cursor.execute(_UPSERT_FIRST_ORDER, (from_id, to_id, 1, weight, now))
+        self._commit()
+        if self.cache is not None:
+            self.cache.add_first_order(from_id, to_id, 1, weight)
     
     def record_transition_second_order(
         self, from_action_1: Action, from_action_2: Action, to_action: Action
     ) -> None:
         """Record or increment second-order transition count."""
-        sig_1 = from_action_1.signature()
-        sig_2 = from_action_2.signature()
-        to_sig = to_action.signature()
+        id_1 = self._action_id(self._state_signature(from_action_1))
+        id_2 = self._action_id(self._state_signature(from_action_2))
+        to_id = self._action_id(self._state_signature(to_action))
+        now = time.time()
+        weight = self._observation_weight(now)
         
         cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO transitions_second_order (from_action_1, from_action_2, to_action, count)
-            VALUES (?, ?, ?, 1)
-            ON CONFLICT(from_action_1, from_action_2, to_action)
-            DO UPDATE SET count = count + 1
-            """,
-            (sig_1, sig_2, to_sig),
-        )
-        self.conn.commit()
+        cursor.execute(_UPSERT_SECOND_ORDER, (id_1, id_2, to_id, 1, weight, now))
+        self._commit()
+        if self.cache is not None:
+            self.cache.add_second_order(id_1, id_2, to_id, 1, weight)
+    
+    def record_transition_page(self, url: str, from_action: Action, to_action: Action) -> None:
+        """Record or increment the transition count on the page of url.
+        
+        URLs without a page pattern (see page_pattern) are ignored.
+        """
+        pattern = page_pattern(url)
+        if not pattern:
+            return
+        page_id = self._page_id(pattern)
+        from_id = self._action_id(self._state_signature(from_action))
+        to_id = self._action_id(self._state_signature(to_action))
+        now = time.time()
+        weight = self._observation_weight(now)
+        
+        cursor = self.conn.cursor()
+        cursor.execute(_UPSERT_PAGE, (page_id, from_id, to_id, 1, weight, now))
+        self._commit()
+        if self.cache is not None:
+            self.cache.add_page(page_id, from_id, to_id, 1, weight)
+    
+    def record_transitions(
+        self, history: Sequence[Action], action: Action, url: str = ""
+    ) -> None:
+        """Record every transition ending in action, given the preceding history.
+        
+        Updates first- and second-order counts and, when enabled, all context
+        orders and the counts on url's page, where action was taken, in one
+        pass, committed as a single transaction.
+        """
+        with self.batch():
+            if len(history) > 0:
+                self.record_transition_first_order(history[-1], action)
+                if self.page_context and url:
+                    self.record_transition_page(url, history[-1], action)
+            if len(history) > 1:
+                self.record_transition_second_order(history[-2], history[-1], action)
+            if self.context_tree is not None and history:
+                context = [
+                    self._action_id(self._state_signature(a))
+                    for a in history[-self.context_tree.max_order:]
+                ]
+                to_id = self._action_id(self._state_signature(action))
+                now = time.time()
+                weight = self._observation_weight(now)
+                touched = self.context_tree.update(context, to_id, 1, weight)
+                self.conn.executemany(
+                    _UPSERT_CONTEXT,
+                    [(encode_context(key), to_id, 1, weight, now) for key in touched],
+                )
+    
+    def record_session(
+        self,
+        actions: Sequence[Action],
+        urls: Sequence[str] | None = None,
+        successes: Sequence[bool] | None = None,
+        timestamps: Sequence[float] | None = None,
+        session_id: str | None = None,
+    ) -> int:
+        """Record a whole action sequence in one transaction.
+        
+        The actions are logged as one session, session_id or a new one.
+        
+        Transitions follow the recording-mode rule: a transition into action i
+        is counted only when action i succeeded, with a decay weight for
+        timestamps[i]. urls[i] is the page action i was taken on. Duplicate
+        transitions are aggregated before the upsert, so each distinct edge
+        is written once.
+        
+        Returns the number of actions recorded.
+        """
+        n = len(actions)
+        urls = [""] * n if urls is None else urls
+        successes = [True] * n if successes is None else successes
+        if timestamps is None:
+            now = time.time()
+            timestamps = [now] * n
+        if not (len(urls) == len(successes) == len(timestamps) == n):
+            raise ValueError("actions, urls, successes and timestamps must have equal length")
+        
+        sigs = [action.signature() for action in actions]
+        session_id = session_id or new_session_id()
+        
+        with self.batch():
+            ids = [self._action_id(self._state_signature(action)) for action in actions]
+            if n:
+                # Rebase up front so every weight below shares one epoch.
+                self._observation_weight(max(timestamps))
+            first_order: dict[tuple[int, int], list[float]] = {}
+            second_order: dict[tuple[int, int, int], list[float]] = {}
+            pages: dict[tuple[int, int, int], list[float]] = {}
+            contexts: dict[tuple[str, int], list[float]] = {}
+            for i, action_id in enumerate(ids):
+                if not successes[i]:
+                    continue
+                if i > 0:
+                    weight = self._observation_weight(timestamps[i])
+                    _accumulate(first_order, (ids[i - 1], action_id), weight, timestamps[i])
+                if i > 1:
+                    _accumulate(
+                        second_order, (ids[i - 2], ids[i - 1], action_id), weight, timestamps[i]
+                    )
+                pattern = page_pattern(urls[i]) if i > 0 and self.page_context else ""
+                if pattern:
+                    page_id = self._page_id(pattern)
+                    _accumulate(pages, (page_id, ids[i - 1], action_id), weight, timestamps[i])
+                if i > 0 and self.context_tree is not None:
+                    context = ids[max(0, i - self.context_tree.max_order):i]
+                    for key in self.context_tree.update(context, action_id, 1, weight):
+                        _accumulate(
+                            contexts, (encode_context(key), action_id), weight, timestamps[i]
+                        )
+            
+            cursor = self.conn.cursor()
+            cursor.executemany(
+                _INSERT_ACTION,
+                [
+                    (
+                        sigs[i],
+                        actions[i].to_json(),
+                        timestamps[i],
+                        urls[i],
+                        1 if successes[i] else 0,
+                        session_id,
+                    )
+                    for i in range(n)
+                ],
+            )
+            cursor.executemany(
+                _UPSERT_FIRST_ORDER,
+                [(*key, *entry) for key, entry in first_order.items()],
+            )
+            cursor.executemany(
+                _UPSERT_SECOND_ORDER,
+                [(*key, *entry) for key, entry in second_order.items()],
+            )
+            cursor.executemany(
+                _UPSERT_PAGE,
+                [(*key, *entry) for key, entry in pages.items()],
+            )
+            cursor.executemany(
+                _UPSERT_CONTEXT,
+                [(*key, *entry) for key, entry in contexts.items()],
+            )
+            if self.cache is not None:
+                for key, (count, weight, _) in first_order.items():
+                    self.cache.add_first_order(*key, count, weight)
+                for key, (count, weight, _) in second_order.items():
+                    self.cache.add_second_order(*key, count, weight)
+                for key, (count, weight, _) in pages.items():
+                    self.cache.add_page(*key, count, weight)
+        return n
     
     def get_first_order_transitions(self, from_action: Action) -> list[dict[str, Any]]:
         """Get all first-order transitions from given action.
         
-        Returns list of dicts with keys: to_action, count.
+        Returns list of dicts with keys: to_action, count, weight, sorted by
+        decayed weight.
         """
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            SELECT to_action, count
-            FROM transitions_first_order
-            WHERE from_action = ?
-            ORDER BY count DESC
-            """,
-            (from_action.signature(),),
-        )
-        return [{"to_action": row["to_action"], "count": row["count"]} for row in cursor.fetchall()]
+        scale = self.decay_scale()
+        with self._reader() as conn:
+            from_id = self._lookup_action_id(self._state_signature(from_action), conn)
+            if from_id is None:
+                return []
+            
+            if self.cache is not None:
+                return self._to_transition_rows(self.cache.get_first_order(from_id), conn, scale)
+            
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT to_id, count, weight
+                FROM transitions_first_order
+                WHERE from_id = ?
+                ORDER BY weight DESC
+                """,
+                (from_id,),
+            )
+            return self._to_transition_rows(cursor.fetchall(), conn, scale)
     
     def get_second_order_transitions(
         self, from_action_1: Action, from_action_2: Action
     ) -> list[dict[str, Any]]:
         """Get all second-order transitions from given action pair.
         
-        Returns list of dicts with keys: to_action, count.
+        Returns list of dicts with keys: to_action, count, weight, sorted by
+        decayed weight.
         """
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            SELECT to_action, count
-            FROM transitions_second_order
-            WHERE from_action_1 = ? AND from_action_2 = ?
-            ORDER BY count DESC
-            """,
-            (from_action_1.signature(), from_action_2.signature()),
-        )
-        return [{"to_action": row["to_action"], "count": row["count"]} for row in cursor.fetchall()]
+        scale = self.decay_scale()
+        with self._reader() as conn:
+            id_1 = self._lookup_action_id(self._state_signature(from_action_1), conn)
+            id_2 = self._lookup_action_id(self._state_signature(from_action_2), conn)
+            if id_1 is None or id_2 is None:
+                return []
+            
+            if self.cache is not None:
+                return self._to_transition_rows(
+                    self.cache.get_second_order(id_1, id_2), conn, scale
+                )
+            
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT to_id, count, weight
+                FROM transitions_second_order
+                WHERE from_id_1 = ? AND from_id_2 = ?
+                ORDER BY weight DESC
+                """,
+                (id_1, id_2),
+            )
+            return self._to_transition_rows(cursor.fetchall(), conn, scale)
+    
+    def get_first_order_top_k(
+        self, from_action: Action, k: int = 5
+    ) -> tuple[list[dict[str, Any]], float]:
+        """Get the K highest-weighted first-order successors of an action.
+        
+        Returns (transitions, total) where transitions is a list of dicts with
+        keys to_action, count, weight and total is the precomputed sum of all
+        outgoing decayed weights. Cost is O(k) regardless of the action's
+        out-degree.
+        """
+        scale = self.decay_scale()
+        with self._reader() as conn:
+            from_id = self._lookup_action_id(self._state_signature(from_action), conn)
+            if from_id is None:
+                return [], 0
+            
+            if self.cache is not None:
+                rows, total = self.cache.get_first_order_top_k(from_id, k)
+                return self._to_transition_rows(rows, conn, scale), total * scale
+            
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT to_id, count, weight,
+                    (SELECT weight FROM transition_totals_first_order WHERE from_id = ?1) AS total
+                FROM transitions_first_order
+                WHERE from_id = ?1
+                ORDER BY weight DESC
+                LIMIT ?2
+                """,
+                (from_id, k),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return [], 0
+            transitions = self._to_transition_rows([tuple(row[:3]) for row in rows], conn, scale)
+            return transitions, rows[0]["total"] * scale
+    
+    def get_second_order_top_k(
+        self, from_action_1: Action, from_action_2: Action, k: int = 5
+    ) -> tuple[list[dict[str, Any]], float]:
+        """Get the K highest-weighted second-order successors of an action pair.
+        
+        Returns (transitions, total) like get_first_order_top_k.
+        """
+        scale = self.decay_scale()
+        with self._reader() as conn:
+            id_1 = self._lookup_action_id(self._state_signature(from_action_1), conn)
+            id_2 = self._lookup_action_id(self._state_signature(from_action_2), conn)
+            if id_1 is None or id_2 is None:
+                return [], 0
+            
+            if self.cache is not None:
+                rows, total = self.cache.get_second_order_top_k(id_1, id_2, k)
+                return self._to_transition_rows(rows, conn, scale), total * scale
+            
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT to_id, count, weight,
+                    (SELECT weight FROM transition_totals_second_order
+                     WHERE from_id_1 = ?1 AND from_id_2 = ?2) AS total
+                FROM transitions_second_order
+                WHERE from_id_1 = ?1 AND from_id_2 = ?2
+                ORDER BY weight DESC
+                LIMIT ?3
+                """,
+                (id_1, id_2, k),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return [], 0
+            transitions = self._to_transition_rows([tuple(row[:3]) for row in rows], conn, scale)
+            return transitions, rows[0]["total"] * scale
+    
+    def get_page_top_k(
+        self, url: str, from_action: Action, k: int = 5, min_support: int = 1
+    ) -> tuple[list[dict[str, Any]], float]:
+        """Get the K highest-weighted successors of an action on the page of url.
+        
+        Returns (transitions, total) like get_first_order_top_k, or no
+        transitions when the page has no pattern or the action was seen on it
+        fewer than min_support times, so callers can back off to the
+        context-free counts.
+        """
+        pattern = page_pattern(url)
+        if not pattern:
+            return [], 0
+        scale = self.decay_scale()
+        with self._reader() as conn:
+            page_id = self._lookup_page_id(pattern, conn)
+            from_id = self._lookup_action_id(self._state_signature(from_action), conn)
+            if page_id is None or from_id is None:
+                return [], 0
+            
+            if self.cache is not None:
+                rows, total, count = self.cache.get_page_top_k(page_id, from_id, k)
+                if count < min_support:
+                    return [], 0
+                return self._to_transition_rows(rows, conn, scale), total * scale
+            
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT t.to_id, t.count, t.weight, s.total AS support, s.weight AS total
+                FROM transitions_page t
+                JOIN transition_totals_page s
+                    ON s.page_id = t.page_id AND s.from_id = t.from_id
+                WHERE t.page_id = ?1 AND t.from_id = ?2 AND s.total >= ?3
+                ORDER BY t.weight DESC
+                LIMIT ?4
+                """,
+                (page_id, from_id, min_support, k),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return [], 0
+            transitions = self._to_transition_rows([tuple(row[:3]) for row in rows], conn, scale)
+            return transitions, rows[0]["total"] * scale
+    
+    def get_first_order_top_k_many(
+        self, from_actions: Iterable[Action], k: int = 5
+    ) -> dict[Action, tuple[list[dict[str, Any]], float]]:
+        """Get first-order top-K successors for many actions at once.
+        
+        Distinct actions are resolved in chunked set-based queries rather than
+        one query each. Returns {action: (transitions, total)} for every
+        action that has outgoing transitions.
+        """
+        scale = self.decay_scale()
+        with self._reader() as conn:
+            keys = {action: self._state_signature(action) for action in from_actions}
+            ids = self._lookup_action_ids(keys.values(), conn)
+            by_id: dict[int, list[Action]] = {}
+            for action, key in keys.items():
+                if key in ids:
+                    by_id.setdefault(ids[key], []).append(action)
+            
+            grouped: dict[int, tuple[list[tuple[int, int, float]], float]] = {}
+            if self.cache is not None:
+                for from_id in by_id:
+                    rows, total = self.cache.get_first_order_top_k(from_id, k)
+                    if rows:
+                        grouped[from_id] = (rows, total)
+            else:
+                for chunk in _chunks(list(by_id), _QUERY_CHUNK_SIZE):
+                    placeholders = ", ".join("?" * len(chunk))
+                    for from_id, to_id, count, weight, total in conn.execute(
+                        f"""
+                        SELECT from_id, to_id, count, weight, total FROM (
+                            SELECT t.from_id, t.to_id, t.count, t.weight, s.weight AS total,
+                                ROW_NUMBER() OVER (
+                                    PARTITION BY t.from_id ORDER BY t.weight DESC, t.to_id
+                                ) AS rank
+                            FROM transitions_first_order t
+                            JOIN transition_totals_first_order s ON s.from_id = t.from_id
+                            WHERE t.from_id IN ({placeholders})
+                        )
+                        WHERE rank <= ?
+                        ORDER BY from_id, rank
+                        """,
+                        (*chunk, k),
+                    ):
+                        grouped.setdefault(from_id, ([], total))[0].append(
+                            (to_id, count, weight)
+                        )
+            
+            # Actions sharing a template share one result.
+            return {
+                action: (self._to_transition_rows(rows, conn, scale), total * scale)
+                for from_id, (rows, total) in grouped.items()
+                for action in by_id[from_id]
+            }
+    
+    def get_second_order_top_k_many(
+        self, pairs: Iterable[tuple[Action, Action]], k: int = 5
+    ) -> dict[tuple[Action, Action], tuple[list[dict[str, Any]], float]]:
+        """Get second-order top-K successors for many action pairs at once.
+        
+        Returns {(prev, current): (transitions, total)} for every pair that
+        has outgoing transitions.
+        """
+        scale = self.decay_scale()
+        with self._reader() as conn:
+            pairs = set(pairs)
+            keys = {
+                pair: (self._state_signature(pair[0]), self._state_signature(pair[1]))
+                for pair in pairs
+            }
+            ids = self._lookup_action_ids((sig for key in keys.values() for sig in key), conn)
+            by_key: dict[tuple[int, int], list[tuple[Action, Action]]] = {}
+            for pair, (sig_1, sig_2) in keys.items():
+                if sig_1 in ids and sig_2 in ids:
+                    by_key.setdefault((ids[sig_1], ids[sig_2]), []).append(pair)
+            
+            grouped: dict[tuple[int, int], tuple[list[tuple[int, int, float]], float]] = {}
+            if self.cache is not None:
+                for id_1, id_2 in by_key:
+                    rows, total = self.cache.get_second_order_top_k(id_1, id_2, k)
+                    if rows:
+                        grouped[(id_1, id_2)] = (rows, total)
+            else:
+                for chunk in _chunks(list(by_key), _QUERY_CHUNK_SIZE // 2):
+                    values = ", ".join("(?, ?)" for _ in chunk)
+                    for id_1, id_2, to_id, count, weight, total in conn.execute(
+                        f"""
+                        SELECT from_id_1, from_id_2, to_id, count, weight, total FROM (
+                            SELECT t.from_id_1, t.from_id_2, t.to_id, t.count, t.weight,
+                                s.weight AS total,
+                                ROW_NUMBER() OVER (
+                                    PARTITION BY t.from_id_1, t.from_id_2
+                                    ORDER BY t.weight DESC, t.to_id
+                                ) AS rank
+                            FROM transitions_second_order t
+                            JOIN transition_totals_second_order s
+                                ON s.from_id_1 = t.from_id_1 AND s.from_id_2 = t.from_id_2
+                            WHERE (t.from_id_1, t.from_id_2) IN (VALUES {values})
+                        )
+                        WHERE rank <= ?
+                        ORDER BY from_id_1, from_id_2, rank
+                        """,
+                        (*(i for key in chunk for i in key), k),
+                    ):
+                        grouped.setdefault((id_1, id_2), ([], total))[0].append(
+                            (to_id, count, weight)
+                        )
+            
+            return {
+                pair: (self._to_transition_rows(rows, conn, scale), total * scale)
+                for key, (rows, total) in grouped.items()
+                for pair in by_key[key]
+            }
+    
+    def get_context_top_k(
+        self, history: Sequence[Action], k: int = 5, min_support: int = 1
+    ) -> tuple[list[dict[str, Any]], int, int]:
+        """Get the K most frequent successors of the longest known context.
+        
+        Walks the context tree once, backing off to shorter contexts when the
+        longer ones are unseen or have fewer than min_support observations.
+        
+        Returns (transitions, total, order) where total is the context's
+        decayed weight, as in get_first_order_top_k, and order is the length
+        of the matched context, or 0 when nothing matched.
+        """
+        if self.context_tree is None:
+            raise RuntimeError("context tree disabled; open Storage with context_order > 0")
+        
+        with self._reader() as conn:
+            context = [
+                self._lookup_action_id(self._state_signature(a), conn)
+                for a in history[-self.context_tree.max_order:]
+            ]
+            rows, total, order = self.context_tree.top_k(context, k, min_support)
+            scale = self.decay_scale()
+            return self._to_transition_rows(rows, conn, scale), total * scale, order
+    
+    def export_matrix(self, path: str) -> None:
+        """Export both transition tables as a CSR .npz snapshot.
+        
+        Requires numpy; see thirdlayer_prototype.db.matrix.
+        """
+        from thirdlayer_prototype.db.matrix import TransitionMatrix
+        
+        TransitionMatrix.from_storage(self).save(path)
+    
+    def export_snapshot(self, path: str) -> "SnapshotInfo":
+        """Export both transition tables as a memory-mappable snapshot.
+        
+        See thirdlayer_prototype.db.snapshot; path is replaced atomically.
+        """
+        from thirdlayer_prototype.db.snapshot import write_snapshot
+        
+        return write_snapshot(self, path)
+    
+    def iter_sessions(self, gap_seconds: float = 1800.0) -> Iterator[list[Action]]:
+        """Stream recorded sessions from the actions log, oldest first.
+        
+        Actions are grouped by session_id, and a session is also split where
+        consecutive actions are more than gap_seconds apart. Failed actions
+        are dropped, matching the history the agent loop keeps.
+        """
+        with self._reader() as conn:
+            cursor = conn.execute(
+                """
+                SELECT a.session_id, a.action_json, a.timestamp, a.success
+                FROM actions a
+                JOIN (
+                    SELECT session_id, MIN(timestamp) AS started
+                    FROM actions GROUP BY session_id
+                ) s ON s.session_id = a.session_id
+                ORDER BY s.started, a.session_id, a.timestamp, a.id
+                """
+            )
+            session: list[Action] = []
+            last_session: str | None = None
+            last_timestamp: float | None = None
+            for session_id, action_json, timestamp, success in cursor:
+                if last_timestamp is not None and (
+                    session_id != last_session or timestamp - last_timestamp > gap_seconds
+                ):
+                    if session:
+                        yield session
+                    session = []
+                last_session = session_id
+                last_timestamp = timestamp
+                if success:
+                    session.append(Action.from_json(action_json))
+            if session:
+                yield session
     
     def get_recent_actions(self, limit: int = 10) -> list[Action]:
         """Get most recent actions.
         
         Returns list of Action objects.
         """
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            SELECT action_json
-            FROM actions
-            ORDER BY timestamp DESC
-            LIMIT ?
-            """,
-            (limit,),
-        )
-        return [Action.from_json(row["action_json"]) for row in cursor.fetchall()]
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT action_json
+                FROM actions
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+                """,
+                (limit,),
+            )
+            return [Action.from_json(row["action_json"]) for row in cursor.fetchall()]
     
     def get_top_transitions(self, k: int = 10) -> list[dict[str, Any]]:
         """Get top K most common transitions (first-order).
         
         Returns list of dicts with keys: from_action, to_action, count.
         """
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            SELECT from_action, to_action, count
-            FROM transitions_first_order
-            ORDER BY count DESC
-            LIMIT ?
-            """,
-            (k,),
-        )
-        return [
-            {
-                "from_action": row["from_action"],
-                "to_action": row["to_action"],
-                "count": row["count"],
-            }
-            for row in cursor.fetchall()
-        ]
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT f.signature AS from_action, t.signature AS to_action, tr.count
+                FROM transitions_first_order tr
+                JOIN action_vocab f ON f.id = tr.from_id
+                JOIN action_vocab t ON t.id = tr.to_id
+                ORDER BY tr.count DESC
+                LIMIT ?
+                """,
+                (k,),
+            )
+            return [
+                {
+                    "from_action": row["from_action"],
+                    "to_action": row["to_action"],
+                    "count": row["count"],
+                }
+                for row in cursor.fetchall()
+            ]
     
     def get_total_transition_count(self) -> int:
         """Get total number of recorded transitions."""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT SUM(count) as total FROM transitions_first_order")
-        result = cursor.fetchone()
-        return result["total"] if result["total"] else 0
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT SUM(total) as total FROM transition_totals_first_order")
+            result = cursor.fetchone()
+            return result["total"] if result["total"] else 0
     
     def clear_all(self) -> None:
         """Clear all data (for testing)."""
@@ -187,4 +1516,61 @@ class Storage:
         cursor.execute("DELETE FROM actions")
         cursor.execute("DELETE FROM transitions_first_order")
         cursor.execute("DELETE FROM transitions_second_order")
-        self.conn.commit()
+        cursor.execute("DELETE FROM transition_totals_first_order")
+        cursor.execute("DELETE FROM transition_totals_second_order")
+        cursor.execute("DELETE FROM transitions_context")
+        cursor.execute("DELETE FROM transition_totals_context")
+        cursor.execute("DELETE FROM transitions_page")
+        cursor.execute("DELETE FROM transition_totals_page")
+        cursor.execute("DELETE FROM page_vocab")
+        cursor.execute("DELETE FROM action_vocab")
+        self._commit()
+        self._sig_to_id.clear()
+        self._id_to_sig.clear()
+        self._page_ids.clear()
+        if self.cache is not None:
+            self.cache.clear()
+        if self.context_tree is not None:
+            self.context_tree.clear()
+
+
+def new_session_id() -> str:
+    """Random 64-bit hex id for a recorded session."""
+    return os.urandom(8).hex()
+
+
+def _split_statements(script: str) -> list[str]:
+    """Split a SQL script into complete statements.
+    
+    Unlike executescript(), executing statements one by one keeps them inside
+    the caller's transaction.
+    """
+    statements = []
+    buffer = ""
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statement = buffer.strip()
+            if statement:
+                statements.append(statement)
+            buffer = ""
+    return statements
+
+
+def _accumulate(
+    edges: dict[Any, list[Any]], key: Any, weight: float, timestamp: float
+) -> None:
+    """Add one observation to an edge's [count, weight, updated_at] entry."""
+    entry = edges.get(key)
+    if entry is None:
+        edges[key] = [1, weight, timestamp]
+    else:
+        entry[0] += 1
+        entry[1] += weight
+        entry[2] = max(entry[2], timestamp)
+
+
+def _chunks(items: Sequence[Any], size: int) -> Iterator[Sequence[Any]]:
+    """Yield consecutive slices of at most size items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
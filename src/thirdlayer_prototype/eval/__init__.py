@@ -0,0 +1,16 @@
+"""Offline evaluation package initialization."""
+from thirdlayer_prototype.eval.replay import (
+    ReplayEvaluator,
+    ReplayReport,
+    load_sessions_from_jsonl,
+    split_sessions,
+    train_storage,
+)
+
+__all__ = [
+    "ReplayEvaluator",
+    "ReplayReport",
+    "load_sessions_from_jsonl",
+    "split_sessions",
+    "train_storage",
+]
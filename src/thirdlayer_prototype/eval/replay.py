@@ -0,0 +1,219 @@
+"""Offline replay of recorded sessions through Predictor and Planner.
+
+Streams sessions from the actions log or a JSONL file and scores what the
+model would have predicted at every recorded step, without a browser.
+"""
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator
+
+from thirdlayer_prototype.agent.metrics import Metrics
+from thirdlayer_prototype.agent.planner import Plan, Planner
+from thirdlayer_prototype.agent.predictor import Prediction, Predictor
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import Action
+from thirdlayer_prototype.models.template import Templater
+
+
+CALIBRATION_BINS = 10
+
+
+@dataclass
+class ReplayReport:
+    """Accuracy, coverage, calibration and latency over replayed steps."""
+    
+    k: int
+    steps: int = 0
+    covered_steps: int = 0
+    top1_correct: int = 0
+    topk_correct: int = 0
+    planned_steps: int = 0
+    planned_correct: int = 0
+    bin_counts: list[int] = field(default_factory=lambda: [0] * CALIBRATION_BINS)
+    bin_confidence: list[float] = field(default_factory=lambda: [0.0] * CALIBRATION_BINS)
+    bin_correct: list[int] = field(default_factory=lambda: [0] * CALIBRATION_BINS)
+    metrics: Metrics = field(default_factory=Metrics)
+    
+    def record(
+        self,
+        actual: Action,
+        predictions: list[Prediction],
+        plan: Plan,
+        latency: float,
+    ) -> None:
+        """Score one replayed step against the recorded next action."""
+        self.steps += 1
+        self.metrics.record_decision_time(latency)
+        if not predictions:
+            return
+        
+        self.covered_steps += 1
+        top = predictions[0]
+        correct = top.action == actual
+        self.top1_correct += correct
+        self.topk_correct += any(p.action == actual for p in predictions[:self.k])
+        
+        self.metrics.record_prediction(correct=correct)
+        self.metrics.record_confidence(top.confidence)
+        
+        if plan.should_execute:
+            self.planned_steps += 1
+            self.planned_correct += correct
+        
+        bin_index = min(int(top.confidence * CALIBRATION_BINS), CALIBRATION_BINS - 1)
+        self.bin_counts[bin_index] += 1
+        self.bin_confidence[bin_index] += top.confidence
+        self.bin_correct[bin_index] += correct
+    
+    def get_top1_accuracy(self) -> float:
+        """Fraction of all steps whose top prediction was the recorded action."""
+        return self.top1_correct / self.steps if self.steps else 0.0
+    
+    def get_topk_accuracy(self) -> float:
+        """Fraction of all steps with the recorded action among the top K."""
+        return self.topk_correct / self.steps if self.steps else 0.0
+    
+    def get_coverage(self) -> float:
+        """Fraction of steps with at least one prediction."""
+        return self.covered_steps / self.steps if self.steps else 0.0
+    
+    def get_planned_precision(self) -> float:
+        """Accuracy of the steps the planner would have executed."""
+        return self.planned_correct / self.planned_steps if self.planned_steps else 0.0
+    
+    def get_expected_calibration_error(self) -> float:
+        """Weighted gap between top-1 confidence and accuracy across bins."""
+        if not self.covered_steps:
+            return 0.0
+        error = 0.0
+        for count, confidence, correct in zip(
+            self.bin_counts, self.bin_confidence, self.bin_correct
+        ):
+            if count:
+                error += abs(confidence - correct) / self.covered_steps
+        return error
+    
+    def get_latency_percentiles(self) -> dict[str, float]:
+        """Per-step predict+plan latency percentiles in milliseconds."""
+        summary = self.metrics.decision_latency.summary_ms()
+        return {name: summary[name] for name in ("p50", "p95", "p99", "max")}
+    
+    def to_dict(self) -> dict[str, Any]:
+        """Convert report to dictionary."""
+        return {
+            "steps": self.steps,
+            "k": self.k,
+            "top1_accuracy": self.get_top1_accuracy(),
+            "topk_accuracy": self.get_topk_accuracy(),
+            "coverage": self.get_coverage(),
+            "planned_steps": self.planned_steps,
+            "planned_precision": self.get_planned_precision(),
+            "expected_calibration_error": self.get_expected_calibration_error(),
+            "calibration": [
+                {
+                    "bin": f"{i / CALIBRATION_BINS:.1f}-{(i + 1) / CALIBRATION_BINS:.1f}",
+                    "count": count,
+                    "mean_confidence": confidence / count,
+                    "accuracy": correct / count,
+                }
+                for i, (count, confidence, correct) in enumerate(
+                    zip(self.bin_counts, self.bin_confidence, self.bin_correct)
+                )
+                if count
+            ],
+            "latency_ms": self.get_latency_percentiles(),
+            "metrics": self.metrics.to_dict(),
+        }
+
+
+class ReplayEvaluator:
+    """Replays sessions step by step through a predictor and planner."""
+    
+    def __init__(
+        self,
+        predictor: Predictor,
+        planner: Planner | None = None,
+        k: int = 5,
+        use_second_order: bool = True,
+        history_window: int = 8,
+    ):
+        self.predictor = predictor
+        self.planner = planner or Planner()
+        self.k = k
+        self.use_second_order = use_second_order
+        self.history_window = history_window
+    
+    def evaluate(self, sessions: Iterable[list[Action]]) -> ReplayReport:
+        """Predict every step after the first of each session and score it.
+        
+        Only the last history_window actions are passed as history.
+        """
+        report = ReplayReport(k=self.k)
+        for session in sessions:
+            for i in range(1, len(session)):
+                history = session[max(0, i - self.history_window):i]
+                start = time.perf_counter()
+                predictions = self.predictor.predict(
+                    history, k=self.k, use_second_order=self.use_second_order
+                )
+                predicted = time.perf_counter()
+                plan = self.planner.plan(predictions)
+                end = time.perf_counter()
+                report.metrics.record_stage_time("predict", predicted - start)
+                report.metrics.record_stage_time("plan", end - predicted)
+                latency = end - start
+                report.record(session[i], predictions, plan, latency)
+        return report
+
+
+def load_sessions_from_jsonl(path: str) -> Iterator[list[Action]]:
+    """Stream sessions from a JSONL file.
+    
+    Each line is either a list of action dicts or an object with an
+    "actions" list.
+    """
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict):
+                record = record["actions"]
+            yield [Action.from_dict(d) for d in record]
+
+
+def split_sessions(
+    sessions: Iterable[list[Action]],
+    test_fraction: float = 0.2,
+    shuffle: bool = False,
+    seed: int = 0,
+) -> tuple[list[list[Action]], list[list[Action]]]:
+    """Split sessions into (train, test).
+    
+    By default the split is chronological: the last test_fraction of
+    sessions is held out. With shuffle, sessions are shuffled with seed first.
+    """
+    sessions = list(sessions)
+    if shuffle:
+        random.Random(seed).shuffle(sessions)
+    cut = len(sessions) - int(round(len(sessions) * test_fraction))
+    return sessions[:cut], sessions[cut:]
+
+
+def train_storage(
+    sessions: Iterable[list[Action]],
+    context_order: int = 0,
+    templater: Templater | None = None,
+) -> Storage:
+    """Build an in-memory, cached Storage from training sessions."""
+    storage = Storage(
+        ":memory:", cache_transitions=True, context_order=context_order, templater=templater
+    )
+    storage.connect()
+    with storage.batch():
+        for session in sessions:
+            storage.record_session(session)
+    return storage
@@ -1,21 +1,50 @@
 """FastAPI server for metrics and transitions endpoints."""
+import asyncio
+import os
+
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
+from thirdlayer_prototype.agent.tracing import read_recent_spans
+from thirdlayer_prototype.db.async_storage import AsyncStorage
+from thirdlayer_prototype.db.compaction import CompactionTask
 from thirdlayer_prototype.db.storage import Storage
 
 
-storage: Storage | None = None
+DB_PATH = "thirdlayer.db"
+
+# JSONL file the agents' JsonlSpanSink appends trace spans to.
+TRACES_PATH = "thirdlayer_traces.jsonl"
+
+# Seconds between background compactions of the transition tables, from
+# THIRDLAYER_COMPACTION_INTERVAL. Compaction deletes transition rows, so it
+# only runs when the variable is set to a positive interval.
+COMPACTION_INTERVAL_SECONDS = float(os.environ.get("THIRDLAYER_COMPACTION_INTERVAL") or 0)
+
+storage: AsyncStorage | None = None
+compaction: CompactionTask | None = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Manage storage lifecycle."""
-    global storage
-    storage = Storage("thirdlayer.db")
-    storage.connect()
+    """Manage storage and, when enabled, background compaction lifecycle."""
+    global storage, compaction
+    # Create or migrate the schema once and switch the file to WAL so the
+    # recorder can write while request handlers read.
+    writer = Storage(DB_PATH, wal=True)
+    writer.connect()
+    writer.close()
+    
+    storage = AsyncStorage(DB_PATH)
+    if COMPACTION_INTERVAL_SECONDS > 0:
+        compaction = CompactionTask(DB_PATH, COMPACTION_INTERVAL_SECONDS)
+        compaction.start()
     yield
+    if compaction:
+        await compaction.close()
+        compaction = None
     storage.close()
+    storage = None
 
 
 app = FastAPI(title="ThirdLayer Prototype", lifespan=lifespan)
@@ -30,6 +59,8 @@ async def root():
         "endpoints": [
             "/metrics",
             "/transitions/top?k=10",
+            "/traces/recent?limit=100",
+            "/compaction",
         ],
     }
 
@@ -43,8 +74,10 @@ async def get_metrics():
     if not storage:
         return {"error": "storage_not_initialized"}
     
-    total_transitions = storage.get_total_transition_count()
-    recent_actions = storage.get_recent_actions(limit=5)
+    total_transitions, recent_actions = await asyncio.gather(
+        storage.get_total_transition_count(),
+        storage.get_recent_actions(limit=5),
+    )
     
     return {
         "total_transitions_learned": total_transitions,
@@ -66,4 +99,48 @@ async def get_top_transitions(k: int = 10):
     if not storage:
         return {"error": "storage_not_initialized"}
     
-    return storage.get_top_transitions(k=k)
+    return await storage.get_top_transitions(k=k)
+
+
+@app.get("/traces/recent")
+async def get_recent_traces(
+    limit: int = 100,
+    name: str | None = None,
+    trace_id: str | None = None,
+    min_duration_ms: float = 0.0,
+):
+    """Get recent trace spans written by the agents' JsonlSpanSink.
+    
+    Spans are read from the tail of TRACES_PATH, so agents running in
+    other processes show up as soon as their sink flushes.
+    
+    Args:
+        limit: Maximum number of spans to return (default 100).
+        name: Only spans with this name, e.g. "step" or "execute".
+        trace_id: Only spans of one agent session.
+        min_duration_ms: Only spans at least this slow.
+    
+    Returns:
+        List of spans, newest first.
+    """
+    return await asyncio.to_thread(
+        read_recent_spans,
+        TRACES_PATH,
+        limit=limit,
+        name=name,
+        trace_id=trace_id,
+        min_duration_ms=min_duration_ms,
+    )
+
+
+@app.get("/compaction")
+async def get_compaction():
+    """Get the outcome of the latest background compaction.
+    
+    Returns the before/after report (rows, bytes, lookup latency) or the
+    error of the latest run.
+    """
+    if not compaction:
+        return {"error": "compaction_disabled"}
+    
+    return compaction.to_dict()
@@ -9,16 +9,20 @@ from thirdlayer_prototype.models.action import (
     wait_for,
     extract,
 )
-from thirdlayer_prototype.models.state import BrowserState
+from thirdlayer_prototype.models.state import BrowserState, page_pattern
+from thirdlayer_prototype.models.template import TemplateRule, Templater
 
 __all__ = [
     "Action",
     "ActionType",
     "BrowserState",
+    "TemplateRule",
+    "Templater",
     "navigate",
     "click",
     "type_text",
     "press",
     "wait_for",
     "extract",
+    "page_pattern",
 ]
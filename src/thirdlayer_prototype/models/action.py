@@ -2,23 +2,33 @@
 
 Defines composable action grammar with stable serialization.
 """
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Literal
 import json
 
 
 ActionType = Literal["navigate", "click", "type", "press", "wait_for", "extract"]
 
+# Flyweight pool of shared Action instances keyed by signature.
+_INTERN_POOL: dict[str, "Action"] = {}
+_INTERN_POOL_MAX_SIZE = 100_000
 
-@dataclass
+
+@dataclass(frozen=True, slots=True, eq=False)
 class Action:
-    """Composable browser action with stable signature."""
+    """Composable browser action with stable signature.
+    
+    Actions are immutable. The signature is computed once and cached, and
+    equality and hashing go through it. from_dict/from_json return a shared
+    instance for signatures already in the intern pool.
+    """
     
     type: ActionType
     selector: str | None = None
     text: str | None = None
     url: str | None = None
     key: str | None = None
+    _signature: str | None = field(default=None, init=False, repr=False)
     
     def to_dict(self) -> dict[str, Any]:
         """Convert to dictionary with only non-None fields."""
@@ -35,29 +45,70 @@ class Action:
     
     def to_json(self) -> str:
         """Convert to JSON string."""
-        return json.dumps(self.to_dict(), sort_keys=True)
+        return self.signature()
     
     def signature(self) -> str:
         """Generate canonical signature for Markov transitions.
         
         Uses sorted JSON to ensure stable keys regardless of field order.
+        Computed on first use and cached on the instance.
+        """
+        signature = self._signature
+        if signature is None:
+            signature = json.dumps(self.to_dict(), sort_keys=True)
+            object.__setattr__(self, "_signature", signature)
+        return signature
+    
+    def __eq__(self, other: object) -> bool:
+        """Compare by signature; interned instances short-circuit on identity."""
+        if self is other:
+            return True
+        if not isinstance(other, Action):
+            return NotImplemented
+        return self.signature() == other.signature()
+    
+    def __hash__(self) -> int:
+        """Hash by cached signature."""
+        return hash(self.signature())
+    
+    @classmethod
+    def intern(cls, action: "Action") -> "Action":
+        """Return the shared instance for this action's signature.
+        
+        The pool is bounded; when full, the oldest entry is evicted.
         """
-        return self.to_json()
+        signature = action.signature()
+        shared = _INTERN_POOL.get(signature)
+        if shared is not None:
+            return shared
+        if len(_INTERN_POOL) >= _INTERN_POOL_MAX_SIZE:
+            del _INTERN_POOL[next(iter(_INTERN_POOL))]
+        _INTERN_POOL[signature] = action
+        return action
     
     @classmethod
     def from_dict(cls, d: dict[str, Any]) -> "Action":
         """Create Action from dictionary."""
-        return cls(
-            type=d["type"],
-            selector=d.get("selector"),
-            text=d.get("text"),
-            url=d.get("url"),
-            key=d.get("key"),
+        return cls.intern(
+            cls(
+                type=d["type"],
+                selector=d.get("selector"),
+                text=d.get("text"),
+                url=d.get("url"),
+                key=d.get("key"),
+            )
         )
     
     @classmethod
     def from_json(cls, json_str: str) -> "Action":
-        """Create Action from JSON string."""
+        """Create Action from JSON string.
+        
+        Canonical JSON (as produced by signature()) is looked up in the
+        intern pool before parsing.
+        """
+        shared = _INTERN_POOL.get(json_str)
+        if shared is not None:
+            return shared
         return cls.from_dict(json.loads(json_str))
     
     def __str__(self) -> str:
@@ -76,29 +127,29 @@ class Action:
 
 def navigate(url: str) -> Action:
     """Navigate to URL."""
-    return Action(type="navigate", url=url)
+    return Action.intern(Action(type="navigate", url=url))
 
 
 def click(selector: str) -> Action:
     """Click element matching selector."""
-    return Action(type="click", selector=selector)
+    return Action.intern(Action(type="click", selector=selector))
 
 
 def type_text(selector: str, text: str) -> Action:
     """Type text into element matching selector."""
-    return Action(type="type", selector=selector, text=text)
+    return Action.intern(Action(type="type", selector=selector, text=text))
 
 
 def press(key: str) -> Action:
     """Press keyboard key."""
-    return Action(type="press", key=key)
+    return Action.intern(Action(type="press", key=key))
 
 
 def wait_for(selector: str) -> Action:
     """Wait for element matching selector."""
-    return Action(type="wait_for", selector=selector)
+    return Action.intern(Action(type="wait_for", selector=selector))
 
 
 def extract(selector: str) -> Action:
     """Extract text from element matching selector."""
-    return Action(type="extract", selector=selector)
+    return Action.intern(Action(type="extract", selector=selector))
@@ -1,6 +1,16 @@
 """State representation for browser context."""
+import re
 from dataclasses import dataclass
 from typing import Any
+from urllib.parse import urlsplit
+
+
+# Path segments that name one record rather than a kind of page: numbers,
+# hex digests and UUIDs.
+_ID_SEGMENT = re.compile(
+    r"\d+|[0-9a-f]{12,}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}",
+    re.IGNORECASE,
+)
 
 
 @dataclass
@@ -11,6 +21,8 @@ class BrowserState:
     title: str
     timestamp: float
     metadata: dict[str, Any] | None = None
+    navigation_count: int = 0
+    load_state: str | None = None
     
     def to_dict(self) -> dict[str, Any]:
         """Convert to dictionary."""
@@ -19,4 +31,29 @@ class BrowserState:
             "title": self.title,
             "timestamp": self.timestamp,
             "metadata": self.metadata or {},
+            "navigation_count": self.navigation_count,
+            "load_state": self.load_state,
         }
+
+
+def page_pattern(url: str, literal_depth: int = 1) -> str:
+    """Normalize url to a host+path pattern naming the kind of page it shows.
+    
+    The scheme, port, query, fragment and a leading "www." are dropped. The
+    first literal_depth path segments are kept unless they look like ids;
+    every other segment becomes "*". For example
+    https://en.wikipedia.org/wiki/Python?x=1 becomes en.wikipedia.org/wiki/*.
+    
+    Returns "" for URLs without a host, such as about:blank.
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if not host:
+        return ""
+    if host.startswith("www."):
+        host = host[4:]
+    segments = [
+        "*" if depth >= literal_depth or _ID_SEGMENT.fullmatch(segment) else segment
+        for depth, segment in enumerate(s for s in parts.path.split("/") if s)
+    ]
+    return "/".join([host, *segments])
@@ -0,0 +1,249 @@
+"""Parameterized action templates.
+
+A template is an Action whose fields may contain typed slots such as
+<query> or <title>. Canonicalizing concrete actions to templates collapses
+every distinct search query or article URL into one Markov state; filling a
+template's slots from the session's context turns a predicted template back
+into an executable action.
+
+Slot values are kept decoded: values bound from a URL are percent-decoded,
+and values filled into a URL are percent-encoded for the part of the URL
+(path or query string) the slot sits in.
+"""
+import json
+import re
+from dataclasses import dataclass, field, replace
+from typing import Iterable, Literal, Mapping, Sequence
+from urllib.parse import quote, quote_plus, unquote, unquote_plus
+
+from thirdlayer_prototype.models.action import Action, ActionType
+
+
+TemplateAttribute = Literal["selector", "text", "url", "key"]
+
+SLOT_PATTERN = re.compile(r"<([a-z_][a-z0-9_]*)>")
+
+_ATTRIBUTES: tuple[TemplateAttribute, ...] = ("selector", "text", "url", "key")
+
+# Bound on memoized canonicalizations per Templater.
+_CACHE_MAX_SIZE = 100_000
+
+# Characters left unescaped when filling a URL path: the RFC 3986 path
+# delimiters, so a filled path reads like the one it was bound from.
+_PATH_SAFE = "/:@!$'()*,;=+"
+
+
+@dataclass(frozen=True)
+class TemplateRule:
+    """Turns the named groups of pattern, in one attribute of an action, into slots.
+    
+    The rule applies to actions of action_type whose selector fully matches
+    selector (any selector when None). The first match of pattern in the
+    attribute is kept literally except for its named groups, each replaced
+    by a slot of the group's name. aliases holds (group, slot) pairs naming
+    further slots the group's value binds without being templated.
+    """
+    
+    action_type: ActionType
+    attribute: TemplateAttribute
+    pattern: str
+    selector: str | None = None
+    aliases: tuple[tuple[str, str], ...] = ()
+    _pattern: re.Pattern = field(init=False, repr=False, compare=False)
+    _selector: re.Pattern | None = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        compiled = re.compile(self.pattern)
+        if not compiled.groupindex:
+            raise ValueError(f"pattern {self.pattern!r} has no named groups")
+        aliases = tuple((group, slot) for group, slot in self.aliases)
+        for group, _ in aliases:
+            if group not in compiled.groupindex:
+                raise ValueError(f"alias of unknown group {group!r}")
+        object.__setattr__(self, "aliases", aliases)
+        object.__setattr__(self, "_pattern", compiled)
+        object.__setattr__(
+            self, "_selector", re.compile(self.selector) if self.selector else None
+        )
+    
+    def apply(self, action: Action) -> tuple[str, dict[str, str]] | None:
+        """Template the rule's attribute of action.
+        
+        Returns (templated attribute value, slot bindings), or None when the rule
+        does not apply.
+        """
+        if action.type != self.action_type:
+            return None
+        if self._selector is not None and not self._selector.fullmatch(action.selector or ""):
+            return None
+        value = getattr(action, self.attribute)
+        if value is None:
+            return None
+        match = self._pattern.search(value)
+        if match is None:
+            return None
+        
+        bindings = {}
+        spans = []
+        for name in self._pattern.groupindex:
+            if match.group(name) is not None:
+                start, end = match.span(name)
+                bindings[name] = (
+                    _decode_url_part(value, start, end)
+                    if self.attribute == "url"
+                    else match.group(name)
+                )
+                spans.append((start, end, name))
+        for group, slot in self.aliases:
+            if group in bindings:
+                bindings.setdefault(slot, bindings[group])
+        templated = value
+        for start, end, name in sorted(spans, reverse=True):
+            templated = f"{templated[:start]}<{name}>{templated[end:]}"
+        return templated, bindings
+
+
+# Text typed into search boxes and URL search parameters share the <query>
+# slot, so a typed query can fill a predicted search URL and vice versa. An
+# article title also binds <query>, so it can be typed into a search box.
+DEFAULT_RULES: tuple[TemplateRule, ...] = (
+    TemplateRule(
+        "type", "text", r"(?s)^(?P<query>.+)$", selector=r"(?i).*(search|query|\bq\b).*"
+    ),
+    TemplateRule("type", "text", r"(?s)^(?P<text>.+)$"),
+    TemplateRule(
+        "navigate", "url", r"/wiki/(?P<title>[^?#]+)", aliases=(("title", "query"),)
+    ),
+    TemplateRule("navigate", "url", r"[?&](?:q|query|search)=(?P<query>[^&#]*)"),
+)
+
+
+class Templater:
+    """Canonicalizes actions to templates and fills templates back in.
+    
+    Rules are tried in order and the first one that applies to an attribute
+    wins; attributes no rule applies to stay literal. Canonicalizations are memoized by
+    signature.
+    """
+    
+    def __init__(self, rules: Sequence[TemplateRule] = DEFAULT_RULES):
+        self.rules = tuple(rules)
+        self._cache: dict[str, tuple[Action, dict[str, str]]] = {}
+    
+    def __getstate__(self) -> dict:
+        """Pickle the rules only; the cache is rebuilt on use."""
+        return {"rules": self.rules}
+    
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["rules"])
+    
+    def to_json(self) -> str:
+        """Serialize the rules to a JSON string."""
+        return json.dumps(
+            [
+                [rule.action_type, rule.attribute, rule.pattern, rule.selector, rule.aliases]
+                for rule in self.rules
+            ]
+        )
+    
+    @classmethod
+    def from_json(cls, json_str: str) -> "Templater":
+        """Create a templater from rules serialized by to_json()."""
+        return cls([TemplateRule(*rule) for rule in json.loads(json_str)])
+    
+    def templatize(self, action: Action) -> tuple[Action, dict[str, str]]:
+        """Get the template of action and the slot values it binds."""
+        signature = action.signature()
+        cached = self._cache.get(signature)
+        if cached is not None:
+            return cached
+        
+        changes: dict[str, str] = {}
+        bindings: dict[str, str] = {}
+        for rule in self.rules:
+            if rule.attribute in changes:
+                continue
+            result = rule.apply(action)
+            if result is not None:
+                changes[rule.attribute], rule_bindings = result
+                bindings.update(rule_bindings)
+        template = Action.intern(replace(action, **changes)) if changes else action
+        
+        if len(self._cache) >= _CACHE_MAX_SIZE:
+            del self._cache[next(iter(self._cache))]
+        self._cache[signature] = (template, bindings)
+        return template, bindings
+    
+    def template(self, action: Action) -> Action:
+        """Get the template of action."""
+        return self.templatize(action)[0]
+    
+    def bindings(
+        self, actions: Iterable[Action], skip_type: ActionType | None = None
+    ) -> dict[str, str]:
+        """Collect the slot values bound by actions; later actions win.
+        
+        Actions of skip_type bind nothing. Filling a template from actions
+        of its own type would repeat them, e.g. navigate to the article the
+        session is already on.
+        """
+        bindings: dict[str, str] = {}
+        for action in actions:
+            if action.type != skip_type:
+                bindings.update(self.templatize(action)[1])
+        return bindings
+    
+    def fill(self, template: Action, bindings: Mapping[str, str]) -> Action | None:
+        """Substitute bindings for the slots of template.
+        
+        Returns the concrete action, or None when a slot has no value. Values
+        filled into the url are percent-encoded.
+        """
+        changes = {}
+        for attribute in _ATTRIBUTES:
+            value = getattr(template, attribute)
+            if value is None or "<" not in value:
+                continue
+            try:
+                changes[attribute] = _fill_slots(value, bindings, encode=attribute == "url")
+            except KeyError:
+                return None
+        return Action.intern(replace(template, **changes)) if changes else template
+
+
+def slots(template: Action) -> list[str]:
+    """Get the slot names of template, in attribute order."""
+    return [
+        name
+        for attribute in _ATTRIBUTES
+        for name in SLOT_PATTERN.findall(getattr(template, attribute) or "")
+    ]
+
+
+def _fill_slots(value: str, bindings: Mapping[str, str], encode: bool) -> str:
+    """Substitute bindings for the slots of value, percent-encoded when encode is set.
+    
+    Raises KeyError for a slot without a value.
+    """
+    if not encode:
+        return SLOT_PATTERN.sub(lambda m: bindings[m[1]], value)
+    return SLOT_PATTERN.sub(lambda m: _encode_url_part(bindings[m[1]], value, m.start()), value)
+
+
+def _in_query(url: str, position: int) -> bool:
+    """Check whether position of url lies in its query string or fragment."""
+    return "?" in url[:position] or "#" in url[:position]
+
+
+def _decode_url_part(url: str, start: int, end: int) -> str:
+    """Percent-decode url[start:end]; "+" is a space only in the query string."""
+    if _in_query(url, start):
+        return unquote_plus(url[start:end])
+    return unquote(url[start:end])
+
+
+def _encode_url_part(value: str, url: str, position: int) -> str:
+    """Percent-encode value for the part of url at position."""
+    if _in_query(url, position):
+        return quote_plus(value)
+    return quote(value, safe=_PATH_SAFE)
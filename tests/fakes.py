@@ -0,0 +1,60 @@
+"""Page stand-ins shared by the agent tests."""
+
+
+class FakeLocator:
+    """Locator stand-in that counts matches from the page's element set."""
+    
+    def __init__(self, page, selector):
+        self.page = page
+        self.selector = selector
+    
+    async def count(self):
+        self.page.calls.append(("count", self.selector))
+        elements = self.page.elements | self.page.shadow
+        return 1 if self.selector in elements else 0
+
+
+class FakePage:
+    """Minimal in-process page implementing what the loop stages call."""
+    
+    def __init__(self, elements, broken=(), shadow=()):
+        self.url = "https://example.com"
+        self.elements = set(elements)
+        self.broken = set(broken)
+        # Elements inside open shadow roots: document.querySelector misses them.
+        self.shadow = set(shadow)
+        self.calls = []
+        self.listeners = {}
+    
+    def on(self, event, handler):
+        self.listeners.setdefault(event, []).append(handler)
+    
+    def remove_listener(self, event, handler):
+        self.listeners[event].remove(handler)
+    
+    def emit(self, event, arg):
+        for handler in list(self.listeners.get(event, [])):
+            handler(arg)
+    
+    async def title(self):
+        self.calls.append(("title",))
+        return "Example"
+    
+    async def evaluate(self, script, selectors):
+        self.calls.append(("evaluate", tuple(selectors)))
+        # Mimic the validator's script: non-CSS selector engines do not
+        # parse, and open shadow roots are searched too.
+        return [None if "=" in s else s in self.elements | self.shadow for s in selectors]
+    
+    def locator(self, selector):
+        return FakeLocator(self, selector)
+    
+    async def click(self, selector, timeout=None):
+        self.calls.append(("click", selector))
+        if selector not in self.elements | self.shadow or selector in self.broken:
+            raise RuntimeError(f"no element {selector}")
+    
+    async def fill(self, selector, text, timeout=None):
+        self.calls.append(("fill", selector, text))
+        if selector not in self.elements | self.shadow or selector in self.broken:
+            raise RuntimeError(f"no element {selector}")
@@ -0,0 +1,45 @@
+"""Tests for action model."""
+import dataclasses
+import pytest
+
+from thirdlayer_prototype.models.action import Action, navigate, click, type_text
+
+
+def test_signature_is_stable_and_cached():
+    """Test that signature is sorted JSON and reused across calls."""
+    action = type_text("#input", "test")
+    
+    signature = action.signature()
+    
+    assert signature == '{"selector": "#input", "text": "test", "type": "type"}'
+    assert action.signature() is signature
+    assert action.to_json() == signature
+
+
+def test_action_is_immutable():
+    """Test that actions cannot be mutated after creation."""
+    action = click("#button")
+    
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        action.selector = "#other"
+
+
+def test_from_json_returns_interned_instance():
+    """Test that deserializing a known signature returns the shared instance."""
+    action = navigate("https://example.com")
+    
+    assert Action.from_json(action.signature()) is action
+    assert Action.from_dict({"url": "https://example.com", "type": "navigate"}) is action
+    assert Action.from_json('{"url": "https://example.com", "type": "navigate"}') is action
+
+
+def test_equality_and_hash_follow_signature():
+    """Test that equal actions compare and hash the same."""
+    action1 = Action(type="click", selector="#button")
+    action2 = Action(type="click", selector="#button")
+    
+    assert action1 is not action2
+    assert action1 == action2
+    assert hash(action1) == hash(action2)
+    assert action1 != click("#other")
+    assert len({action1, action2}) == 1
@@ -0,0 +1,183 @@
+"""Tests for session partitioning and archiving of the actions log."""
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import pytest
+
+from thirdlayer_prototype.cli import main
+from thirdlayer_prototype.db.archive import (
+    archive_sessions,
+    iter_archived_sessions,
+    iter_segment,
+    list_segments,
+)
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import navigate, click
+
+
+DAY = 24 * 3600.0
+
+
+@pytest.fixture
+def storage():
+    """Create an on-disk storage with three old sessions and one recent one."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = Storage(os.path.join(tmpdir, "test.db"))
+        storage.connect()
+        now = time.time()
+        for i in range(3):
+            started = now - (60 - i) * DAY
+            storage.record_session(
+                [navigate("https://example.com"), click(f"#old{i}"), click("#fail")],
+                urls=["https://example.com"] * 3,
+                successes=[True, True, False],
+                timestamps=[started, started + 1, started + 2],
+            )
+        storage.record_session(
+            [navigate("https://example.com"), click("#new")], timestamps=[now - 5, now - 4]
+        )
+        yield storage
+        storage.close()
+
+
+def test_record_session_assigns_session_ids(storage):
+    """Test that each recorded session gets its own id."""
+    rows = storage.conn.execute(
+        "SELECT session_id, COUNT(*) FROM actions GROUP BY session_id"
+    ).fetchall()
+    assert sorted(count for _, count in rows) == [2, 3, 3, 3]
+    assert all(session_id for session_id, _ in rows)
+
+
+def test_record_action_uses_current_session(storage):
+    """Test that record_action() logs into the storage's current session."""
+    storage.record_action(click("#a"))
+    first = storage.session_id
+    storage.new_session()
+    storage.record_action(click("#b"))
+    
+    rows = storage.conn.execute(
+        "SELECT session_id FROM actions ORDER BY id DESC LIMIT 2"
+    ).fetchall()
+    assert [row[0] for row in rows] == [storage.session_id, first]
+    assert storage.session_id != first
+
+
+def test_archive_moves_old_sessions(storage, tmp_path):
+    """Test that old sessions leave the database and recent ones stay."""
+    report = archive_sessions(storage, tmp_path, older_than_seconds=30 * DAY)
+    
+    assert report.sessions == 3
+    assert report.actions == 9
+    assert [path.name for path in list_segments(tmp_path)] == report.segments
+    assert storage.conn.execute("SELECT COUNT(*) FROM actions").fetchone()[0] == 2
+    assert [session[-1] for session in storage.iter_sessions()] == [click("#new")]
+    
+    # Transitions are learned state and stay in the hot database.
+    rows, _ = storage.get_first_order_top_k(navigate("https://example.com"), k=5)
+    assert click("#old0").signature() in {row["to_action"] for row in rows}
+    
+    manifest = storage.conn.execute(
+        "SELECT name, sessions, actions FROM archive_segments"
+    ).fetchall()
+    assert [tuple(row) for row in manifest] == [(report.segments[0], 3, 9)]
+    
+    # Nothing left to archive on a second run.
+    assert archive_sessions(storage, tmp_path, older_than_seconds=30 * DAY).sessions == 0
+
+
+def test_archived_segments_round_trip(storage, tmp_path):
+    """Test that the reader streams back every archived action, oldest first."""
+    archive_sessions(storage, tmp_path, older_than_seconds=30 * DAY, max_sessions_per_segment=2)
+    
+    segments = list_segments(tmp_path)
+    assert len(segments) == 2
+    records = [record for path in segments for record in iter_segment(path)]
+    assert [record["successes"] for record in records] == [[True, True, False]] * 3
+    assert records[0]["urls"] == ["https://example.com"] * 3
+    assert records[0]["timestamps"] < records[1]["timestamps"]
+    
+    sessions = list(iter_archived_sessions(tmp_path))
+    assert sessions == [
+        [navigate("https://example.com"), click(f"#old{i}")] for i in range(3)
+    ]
+
+
+def test_archive_recovers_interrupted_segments(storage, tmp_path):
+    """Test that committed .tmp segments are renamed and orphans removed."""
+    report = archive_sessions(storage, tmp_path, older_than_seconds=30 * DAY)
+    segment = tmp_path / report.segments[0]
+    committed = tmp_path / (segment.name + ".tmp")
+    os.replace(segment, committed)
+    orphan = tmp_path / "segment-999999-orphan.jsonl.gz.tmp"
+    orphan.write_bytes(b"")
+    
+    archive_sessions(storage, tmp_path, older_than_seconds=30 * DAY)
+    assert segment.exists()
+    assert not committed.exists()
+    assert not orphan.exists()
+
+
+def test_migration_backfills_session_ids():
+    """Test that a v3 actions log is split into sessions on inactivity gaps."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    storage = Storage(path)
+    storage.connect()
+    for timestamp in (0.0, 10.0, 5000.0, 5010.0):
+        storage.conn.execute(
+            "INSERT INTO actions (action_signature, action_json, timestamp) VALUES (?, ?, ?)",
+            (click("#a").signature(), json.dumps(click("#a").to_dict()), timestamp),
+        )
+    storage.conn.execute("UPDATE actions SET session_id = NULL")
+    storage.conn.execute("PRAGMA user_version = 3")
+    storage.conn.commit()
+    storage.close()
+    
+    storage = Storage(path)
+    storage.connect()
+    rows = storage.conn.execute("SELECT session_id FROM actions ORDER BY id").fetchall()
+    assert [row[0] for row in rows] == ["legacy-1", "legacy-1", "legacy-3", "legacy-3"]
+    storage.close()
+    os.unlink(path)
+    
+    # The column itself is added to databases that predate it.
+    legacy = sqlite3.connect(path)
+    legacy.execute(
+        """
+        CREATE TABLE actions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action_signature TEXT NOT NULL,
+            action_json TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            url TEXT,
+            success INTEGER DEFAULT 1
+        )
+        """
+    )
+    legacy.execute("PRAGMA user_version = 3")
+    legacy.commit()
+    legacy.close()
+    storage = Storage(path)
+    storage.connect()
+    columns = {row[1] for row in storage.conn.execute("PRAGMA table_info(actions)")}
+    assert "session_id" in columns
+    storage.close()
+    os.unlink(path)
+
+
+def test_cli_archive_and_replay(storage, tmp_path, capsys):
+    """Test the archive subcommand and replaying archived sessions."""
+    archive_dir = str(tmp_path / "archive")
+    storage.close()
+    assert main(["archive", "--db", storage.db_path, "--dir", archive_dir]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["sessions"] == 3
+    
+    assert main(["replay", "--db", storage.db_path, "--archive", archive_dir]) == 0
+    replay = json.loads(capsys.readouterr().out)
+    assert replay["steps"] == 4
+    storage.connect()
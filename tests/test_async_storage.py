@@ -0,0 +1,81 @@
+"""Tests for the async read-only storage facade."""
+import asyncio
+import os
+import tempfile
+import sqlite3
+
+import pytest
+
+from thirdlayer_prototype.db.async_storage import AsyncStorage
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import navigate, click
+
+
+@pytest.fixture
+def db_path():
+    """Create a temporary database with a few recorded transitions."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.db")
+        storage = Storage(path)
+        storage.connect()
+        storage.record_session([navigate("https://example.com"), click("#a"), click("#b")])
+        storage.close()
+        yield path
+
+
+def test_async_reads_match_sync_storage(db_path):
+    """Test awaited queries return the same results as Storage."""
+    async def run():
+        storage = AsyncStorage(db_path, max_workers=2)
+        try:
+            return await asyncio.gather(
+                storage.get_top_transitions(k=10),
+                storage.get_total_transition_count(),
+                storage.get_recent_actions(limit=5),
+                storage.get_first_order_top_k(click("#a"), k=1),
+            )
+        finally:
+            storage.close()
+    
+    top, total, recent, (successors, source_total) = asyncio.run(run())
+    
+    assert total == 2
+    assert len(top) == 2
+    assert recent[0] == click("#b")
+    assert successors[0]["to_action"] == click("#b").signature()
+    assert source_total == 1
+
+
+def test_worker_connections_are_read_only(db_path):
+    """Test pool threads open read-only connections that close() releases."""
+    storage = AsyncStorage(db_path, max_workers=1)
+    asyncio.run(storage.get_total_transition_count())
+    
+    reader = storage._readers[0]
+    with pytest.raises(sqlite3.OperationalError):
+        reader.conn.execute("DELETE FROM transitions_first_order")
+    storage.close()
+    
+    assert storage._readers == []
+
+
+def test_read_only_rejects_memory_database():
+    """Test read-only mode requires an on-disk database."""
+    with pytest.raises(ValueError):
+        Storage(":memory:").connect(read_only=True)
+
+
+def test_endpoints_await_async_storage(db_path, monkeypatch):
+    """Test the API endpoints serve data through AsyncStorage."""
+    from fastapi.testclient import TestClient
+    from thirdlayer_prototype import main
+    
+    monkeypatch.setattr(main, "DB_PATH", db_path)
+    with TestClient(main.app) as client:
+        metrics = client.get("/metrics").json()
+        top = client.get("/transitions/top", params={"k": 1}).json()
+    
+    assert metrics["total_transitions_learned"] == 2
+    assert metrics["recent_actions_count"] == 3
+    assert metrics["database_path"] == db_path
+    assert len(top) == 1
@@ -0,0 +1,207 @@
+"""Tests for transition table compaction."""
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import pytest
+
+from thirdlayer_prototype.agent.predictor import Predictor, VariableOrderPredictor
+from thirdlayer_prototype.cli import main
+from thirdlayer_prototype.db.compaction import CompactionTask, Compactor, compact_database
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import navigate, click, type_text
+
+
+@pytest.fixture
+def db_path():
+    """Create a database with one hub of long-tail successors."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.db")
+        storage = Storage(path)
+        storage.connect()
+        hub = navigate("https://example.com")
+        with storage.batch():
+            for i in range(10):
+                for _ in range(i + 1):
+                    storage.record_transition_first_order(hub, click(f"#link{i}"))
+            for i in range(2000):
+                storage.record_session([hub, type_text("#search", f"query {i}")])
+        storage.close()
+        yield path
+
+
+@pytest.mark.parametrize("cache_transitions", [False, True])
+def test_compaction_keeps_heavy_hitters_and_confidence(db_path, cache_transitions):
+    """Test pruning caps successors without changing kept confidences."""
+    storage = Storage(db_path, cache_transitions=cache_transitions)
+    storage.connect()
+    try:
+        hub = navigate("https://example.com")
+        predictor = Predictor(storage)
+        before = predictor.predict_first_order(hub, k=3)
+        total_before = storage.get_total_transition_count()
+        
+        report = Compactor(max_successors=3, min_age_seconds=0).run(storage)
+        
+        assert report.to_dict()["rows_pruned"]["transitions_first_order"] == 2007
+        assert len(storage.get_first_order_transitions(hub)) == 3
+        assert predictor.predict_first_order(hub, k=3) == before
+        assert storage.get_total_transition_count() == total_before
+    finally:
+        storage.close()
+
+
+def test_compaction_prunes_contexts_and_reloads_tree(tmp_path):
+    """Test context rows are capped like transitions and the tree follows."""
+    path = str(tmp_path / "context.db")
+    storage = Storage(path, context_order=2)
+    storage.connect()
+    home, search = navigate("https://example.com"), click("#search")
+    with storage.batch():
+        for i in range(5):
+            for _ in range(i + 1):
+                storage.record_session([home, search, click(f"#result{i}")])
+    try:
+        predictor = VariableOrderPredictor(storage)
+        before = predictor.predict([home, search], k=2)
+        
+        report = Compactor(max_successors=2, min_age_seconds=0).run(storage)
+        
+        # Three of five successors go from both the order-1 and the order-2 context.
+        assert report.to_dict()["rows_pruned"]["transitions_context"] == 6
+        assert predictor.predict([home, search], k=5) == before
+        assert before[0].confidence == pytest.approx(5 / 15)
+    finally:
+        storage.close()
+    
+    reopened = Storage(path, context_order=2)
+    reopened.connect()
+    try:
+        assert VariableOrderPredictor(reopened).predict([home, search], k=5) == before
+    finally:
+        reopened.close()
+
+
+def test_decay_rebase_keeps_pruned_mass(db_path):
+    """Test changing the half-life after compaction keeps confidences."""
+    hub = navigate("https://example.com")
+    compact_database(db_path, Compactor(max_successors=3, min_age_seconds=0))
+    storage = Storage(db_path)
+    storage.connect()
+    before = Predictor(storage).predict_first_order(hub, k=3)
+    # Pretend the data was recorded one half-life ago, so the rebase halves it.
+    storage.conn.executemany(
+        "UPDATE storage_meta SET value = ? WHERE key = ?",
+        [(3600.0, "decay_half_life"), (time.time() - 3600.0, "decay_epoch")],
+    )
+    storage.conn.commit()
+    storage.close()
+    
+    storage = Storage(db_path, half_life=7200.0)
+    storage.connect()
+    try:
+        after = Predictor(storage).predict_first_order(hub, k=3)
+        assert [p.action for p in after] == [p.action for p in before]
+        assert [p.confidence for p in after] == pytest.approx([p.confidence for p in before])
+    finally:
+        storage.close()
+
+
+def test_compaction_respects_min_age(db_path):
+    """Test recent low-support successors survive until they age out."""
+    storage = Storage(db_path)
+    storage.connect()
+    try:
+        Compactor(max_successors=100).run(storage)
+        hub = navigate("https://example.com")
+        assert len(storage.get_first_order_transitions(hub)) == 100
+    finally:
+        storage.close()
+
+
+def test_incremental_vacuum_shrinks_file(db_path):
+    """Test freed pages are returned instead of left on the freelist."""
+    report = compact_database(db_path, Compactor(max_successors=5, min_age_seconds=0))
+    
+    assert report.vacuum == "incremental"
+    assert report.bytes_after < report.bytes_before
+    assert report.free_bytes_after == 0
+    assert set(report.lookup_ms_after) == {"mean", "p50", "p95", "max"}
+
+
+def test_full_vacuum_converts_older_databases(tmp_path):
+    """Test databases without auto_vacuum are only converted on request."""
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE unrelated (x)")
+    conn.close()
+    storage = Storage(path)
+    storage.connect()
+    storage.record_session([navigate("https://example.com"), click("#a")])
+    storage.close()
+    
+    assert compact_database(path).vacuum == "skipped"
+    assert compact_database(path, Compactor(full_vacuum=True)).vacuum == "full"
+    assert compact_database(path).vacuum == "incremental"
+
+
+def test_cli_compact(db_path, capsys):
+    """Test the compact subcommand prints a before/after report."""
+    assert main(["compact", "--db", db_path, "--max-successors", "4", "--min-age", "0"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    
+    assert report["rows_after"]["transitions_first_order"] == 4
+    assert report["bytes_after"] < report["bytes_before"]
+
+
+def test_compaction_task_runs_periodically(db_path):
+    """Test the background task compacts off the event loop and stops cleanly."""
+    async def run():
+        task = CompactionTask(db_path, interval=0.01, compactor=Compactor(min_age_seconds=0))
+        task.start()
+        while task.last_report is None:
+            await asyncio.sleep(0.01)
+        await task.close()
+        return task.to_dict()
+    
+    outcome = asyncio.run(run())
+    assert outcome["last_error"] is None
+    assert outcome["last_report"]["rows_after"]["transitions_first_order"] == 9
+
+
+def test_compaction_task_records_any_error(db_path):
+    """Test a failed run is recorded and the task keeps running."""
+    class FailingCompactor(Compactor):
+        def run(self, storage):
+            raise OSError("disk full")
+    
+    async def run():
+        task = CompactionTask(db_path, interval=0.01, compactor=FailingCompactor())
+        task.start()
+        while task.last_error is None:
+            await asyncio.sleep(0.01)
+        await task.close()
+        return task.to_dict()
+    
+    outcome = asyncio.run(run())
+    assert outcome["last_error"] == "OSError_disk full"
+    assert outcome["last_report"] is None
+
+
+def test_api_compaction_is_opt_in(db_path, monkeypatch):
+    """Test the API server only compacts when an interval is configured."""
+    from fastapi.testclient import TestClient
+    
+    from thirdlayer_prototype import main
+    
+    monkeypatch.setattr(main, "DB_PATH", db_path)
+    monkeypatch.setattr(main, "COMPACTION_INTERVAL_SECONDS", 0.0)
+    with TestClient(main.app) as client:
+        assert client.get("/compaction").json() == {"error": "compaction_disabled"}
+    
+    monkeypatch.setattr(main, "COMPACTION_INTERVAL_SECONDS", 3600.0)
+    with TestClient(main.app) as client:
+        assert client.get("/compaction").json()["interval_seconds"] == 3600.0
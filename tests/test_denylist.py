@@ -0,0 +1,72 @@
+"""Tests for the compiled denylist."""
+import json
+import os
+import random
+import tempfile
+
+from thirdlayer_prototype.agent.denylist import DENYLIST_PATTERNS, Denylist, PatternMatcher
+from thirdlayer_prototype.models.action import navigate, click, type_text, press
+
+
+def test_matcher_agrees_with_substring_scan():
+    """Test the automaton finds exactly the texts a naive scan does."""
+    rng = random.Random(0)
+    alphabet = "abc-"
+    patterns = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5))) for _ in range(300)]
+    matcher = PatternMatcher(patterns)
+    
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet + "XYZ") for _ in range(rng.randint(0, 30)))
+        expected = any(p in text.lower() for p in patterns)
+        found = matcher.search(text)
+        assert (found is not None) == expected
+        if found is not None:
+            assert found in text.lower()
+
+
+def test_matcher_handles_overlapping_patterns():
+    """Test suffix matches are found through failure links."""
+    matcher = PatternMatcher(["sign-out", "gn-o", "xyz"])
+    assert matcher.search("#SIGN-IN") is None
+    assert matcher.search("a.sign-up") is None
+    assert matcher.search("#desiGN-Off") == "gn-o"
+    assert PatternMatcher([]).search("anything") is None
+
+
+def test_default_denylist_matches_selectors():
+    """Test the default patterns deny risky selectors case-insensitively."""
+    denylist = Denylist()
+    assert denylist.check(click("#Logout-Button")) == "selector_matches_denylist_pattern"
+    assert denylist.check(type_text("#search", "delete")) is None
+    assert denylist.check(click("#search")) is None
+    assert denylist.check(press("Enter")) is None
+    assert denylist.check(navigate("https://example.com/account")) is None
+
+
+def test_url_patterns_and_config_file():
+    """Test URL patterns loaded from a JSON config deny navigations."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "denylist.json")
+        with open(path, "w") as f:
+            json.dump({"url_patterns": ["/admin", "Billing.example.com"]}, f)
+        denylist = Denylist.from_file(path)
+    
+    assert denylist.selectors.patterns == DENYLIST_PATTERNS
+    matched = "url_matches_denylist_pattern"
+    assert denylist.check(navigate("https://billing.example.com/x")) == matched
+    assert denylist.check(navigate("https://example.com/ADMIN/users")) == matched
+    assert denylist.check(navigate("https://example.com/")) is None
+
+
+def test_verdicts_cached_per_signature():
+    """Test repeated actions reuse the cached verdict without matching."""
+    denylist = Denylist()
+    calls = []
+    search = denylist.selectors.search
+    denylist.selectors.search = lambda text: calls.append(text) or search(text)
+    
+    for _ in range(3):
+        assert denylist.check(click("#delete")) == "selector_matches_denylist_pattern"
+        assert denylist.check(click("#ok")) is None
+    
+    assert calls == ["#delete", "#ok"]
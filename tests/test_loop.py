@@ -0,0 +1,182 @@
+"""Tests for the agent decision loop."""
+import asyncio
+
+import pytest
+
+from thirdlayer_prototype.agent.loop import AgentLoop
+from thirdlayer_prototype.agent.predictor import Predictor
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import navigate, click, type_text
+from thirdlayer_prototype.models.template import Templater
+
+from fakes import FakePage
+
+
+@pytest.fixture
+def storage():
+    """In-memory storage that learned home -> #a -> #b -> #c."""
+    storage = Storage(":memory:", cache_transitions=True)
+    storage.connect()
+    storage.record_session([navigate("https://example.com"), click("#a"), click("#b"), click("#c")])
+    yield storage
+    storage.close()
+
+
+def run_steps(agent, n):
+    """Run n loop steps and return their results."""
+    async def run():
+        return [await agent.step() for _ in range(n)]
+    return asyncio.run(run())
+
+
+def test_speculative_steps_reuse_next_prediction(storage):
+    """Test the next step's plan is computed during execution and reused."""
+    page = FakePage(["#a", "#b", "#c"])
+    agent = AgentLoop(page, storage, speculative=True)
+    agent.add_action_to_history(navigate("https://example.com"))
+    
+    results = run_steps(agent, 3)
+    
+    assert [r["speculative"] for r in results] == [False, True, True]
+    assert [r["execution"]["success"] for r in results] == [True, True, True]
+    assert agent.action_history[1:] == [click("#a"), click("#b"), click("#c")]
+    assert agent.metrics.speculation_hits == 2
+    stages = agent.metrics.stage_latency
+    assert stages["execute"].count == 3
+    assert stages["storage_write"].count == 3
+    assert stages["observe"].count == 3
+    # One regular predict plus one speculated predict per execution.
+    assert stages["predict"].count == 4
+    assert [c for c in page.calls if c[0] == "click"] == [
+        ("click", "#a"), ("click", "#b"), ("click", "#c")
+    ]
+
+
+def test_no_speculation_within_one_template_state():
+    """Test an action of the same template as the last one is not speculated on.
+    
+    Recording type(#email, b) after type(#email, a) bumps the <text> row the
+    speculated predictions would be read from.
+    """
+    storage = Storage(":memory:", cache_transitions=True, templater=Templater())
+    storage.connect()
+    for _ in range(3):
+        storage.record_session([type_text("#email", "x"), type_text("#email", "y")])
+    
+    page = FakePage(["#email"])
+    predictor = Predictor(storage, slot_values={"text": "b"})
+    agent = AgentLoop(page, storage, predictor=predictor, speculative=True)
+    agent.add_action_to_history(type_text("#email", "a"))
+    results = run_steps(agent, 2)
+    storage.close()
+    
+    assert results[0]["execution"]["success"] is True
+    assert agent.action_history[1] == type_text("#email", "b")
+    assert [r["speculative"] for r in results] == [False, False]
+    assert agent.metrics.speculation_hits == 0
+
+
+def test_speculation_discarded_when_execution_fails(storage):
+    """Test a failed execution drops the speculated next step."""
+    page = FakePage(["#a", "#b", "#c"], broken=["#b"])
+    agent = AgentLoop(page, storage, speculative=True)
+    agent.add_action_to_history(click("#a"))
+    
+    results = run_steps(agent, 2)
+    
+    assert [r["execution"]["success"] for r in results] == [False, False]
+    assert results[1]["speculative"] is False
+    assert agent.metrics.speculation_misses == 2
+    assert agent.metrics.speculation_hits == 0
+
+
+def test_speculative_validation_still_checks_dom(storage):
+    """Test a speculated plan is rejected if its selector is not on the page."""
+    page = FakePage(["#a"])
+    agent = AgentLoop(page, storage, speculative=True)
+    agent.add_action_to_history(navigate("https://example.com"))
+    
+    results = run_steps(agent, 2)
+    
+    assert results[1]["speculative"] is True
+    assert results[1]["validation"] == {"valid": False, "reason": "selector_not_found_#b"}
+    assert results[1]["plan"]["reason"] == "no_valid_candidate_above_threshold"
+    assert results[1]["execution"] == {"attempted": False, "reason": "validation_failed"}
+
+
+def test_falls_back_to_next_valid_candidate():
+    """Test the best valid candidate runs when the top one is missing."""
+    storage = Storage(":memory:", cache_transitions=True)
+    storage.connect()
+    home = navigate("https://example.com")
+    for _ in range(3):
+        storage.record_session([home, click("#gone")])
+    for _ in range(2):
+        storage.record_session([home, click("#here")])
+    storage.record_session([home, click("text=Elsewhere")])
+    
+    page = FakePage(["#here", "text=Elsewhere"])
+    agent = AgentLoop(page, storage, confidence_threshold=0.1)
+    agent.add_action_to_history(home)
+    result = run_steps(agent, 1)[0]
+    storage.close()
+    
+    assert [v["valid"] for v in result["validations"]] == [False, True, True]
+    assert result["plan"]["reason"] == "fallback_to_rank_2_confidence_above_threshold_0.33"
+    assert result["execution"]["success"] is True
+    assert agent.action_history[-1] == click("#here")
+    assert agent.metrics.unsafe_filtered == 1
+    # One evaluate for all candidates plus a locator count for the non-CSS
+    # one; the missing one costs no extra round trip.
+    assert page.calls[1:3] == [
+        ("evaluate", ("#gone", "#here", "text=Elsewhere")),
+        ("count", "text=Elsewhere"),
+    ]
+    assert ("count", "#gone") not in page.calls
+
+
+def test_shadow_dom_candidate_found_by_batch_check():
+    """Test a selector inside an open shadow root is found without a locator."""
+    storage = Storage(":memory:", cache_transitions=True)
+    storage.connect()
+    home = navigate("https://example.com")
+    storage.record_session([home, click("#in-shadow")])
+    
+    page = FakePage([], shadow=["#in-shadow"])
+    agent = AgentLoop(page, storage)
+    agent.add_action_to_history(home)
+    result = run_steps(agent, 1)[0]
+    storage.close()
+    
+    assert result["validation"] == {"valid": True, "reason": "passed_all_checks"}
+    assert result["execution"]["success"] is True
+    assert ("evaluate", ("#in-shadow",)) in page.calls
+    assert not [c for c in page.calls if c[0] == "count"]
+
+
+def test_speculation_discarded_when_page_changes():
+    """Test a speculation made for one page is redone on another kind of page."""
+    storage = Storage(":memory:", cache_transitions=True, page_context=True)
+    storage.connect()
+    for site, target in (("https://example.com", "#b"), ("https://other.test", "#c")):
+        for _ in range(3):
+            storage.record_session(
+                [navigate(site), click("#a"), click(target)], urls=["", site, site]
+            )
+    
+    class NavigatingPage(FakePage):
+        async def click(self, selector, timeout=None):
+            await super().click(selector, timeout)
+            if selector == "#a":
+                self.url = "https://other.test/"
+    
+    page = NavigatingPage(["#a", "#b", "#c"])
+    agent = AgentLoop(page, storage, speculative=True)
+    agent.add_action_to_history(navigate("https://example.com"))
+    results = run_steps(agent, 2)
+    storage.close()
+    
+    assert [r["speculative"] for r in results] == [False, False]
+    assert results[1]["predictions"][0]["source"] == "page"
+    assert agent.action_history[1:] == [click("#a"), click("#c")]
+    assert agent.metrics.speculation_misses == 1
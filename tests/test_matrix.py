@@ -0,0 +1,126 @@
+"""Tests for transition matrix snapshots."""
+import pytest
+import tempfile
+import os
+
+from thirdlayer_prototype.db.compaction import Compactor
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.agent.predictor import Predictor
+from thirdlayer_prototype.models.action import navigate, click, type_text, press
+from thirdlayer_prototype.models.template import Templater
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def storage_with_sessions():
+    """Create storage with a few recorded sessions."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    
+    storage = Storage(path)
+    storage.connect()
+    
+    home = navigate("https://example.com")
+    search = type_text("#search", "query")
+    storage.record_session([home, click("#a"), search, click("#b")])
+    storage.record_session([home, click("#a"), search, click("#c")])
+    storage.record_session([home, click("#d"), search, click("#b")])
+    storage.record_session([click("#d"), home, click("#a")])
+    
+    yield storage
+    
+    storage.close()
+    os.unlink(path)
+
+
+def test_row_normalized_probabilities(storage_with_sessions, tmp_path):
+    """Test that exported rows sum to one and round-trip through .npz."""
+    from thirdlayer_prototype.agent.matrix_predictor import MatrixPredictor
+    
+    path = str(tmp_path / "model.npz")
+    storage_with_sessions.export_matrix(path)
+    
+    predictor = MatrixPredictor.from_file(path)
+    matrix = predictor.matrix
+    
+    for row in range(len(matrix.vocab)):
+        _, probs = matrix.first_order_row(row)
+        if len(probs):
+            assert probs.sum() == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("k", [1, 2, 5])
+def test_matrix_predictor_matches_sql_predictor(storage_with_sessions, tmp_path, k):
+    """Test that matrix predictions equal the SQL-backed predictor's."""
+    from thirdlayer_prototype.agent.matrix_predictor import MatrixPredictor
+    
+    path = str(tmp_path / "model.npz")
+    storage_with_sessions.export_matrix(path)
+    
+    matrix_predictor = MatrixPredictor.from_file(path)
+    sql_predictor = Predictor(storage_with_sessions)
+    
+    home = navigate("https://example.com")
+    search = type_text("#search", "query")
+    histories = [
+        [home],
+        [click("#a"), search],
+        [home, click("#a")],
+        [click("#unseen"), search],
+        [click("#unseen")],
+    ]
+    for history in histories:
+        expected = sql_predictor.predict(history, k=k)
+        actual = matrix_predictor.predict(history, k=k)
+        assert [p.action for p in actual] == [p.action for p in expected]
+        assert [p.source for p in actual] == [p.source for p in expected]
+        assert [p.confidence for p in actual] == pytest.approx([p.confidence for p in expected])
+
+
+def test_matrix_confidence_uses_totals_after_compaction(storage_with_sessions, tmp_path):
+    """Test pruned successors stay in the denominator, as in Predictor."""
+    from thirdlayer_prototype.agent.matrix_predictor import MatrixPredictor
+    
+    Compactor(max_successors=1, min_age_seconds=0).run(storage_with_sessions)
+    path = str(tmp_path / "model.npz")
+    storage_with_sessions.export_matrix(path)
+    
+    matrix_predictor = MatrixPredictor.from_file(path)
+    sql_predictor = Predictor(storage_with_sessions)
+    
+    home = navigate("https://example.com")
+    search = type_text("#search", "query")
+    for history in ([home], [click("#a"), search]):
+        expected = sql_predictor.predict(history, k=5)
+        actual = matrix_predictor.predict(history, k=5)
+        assert len(actual) == 1
+        assert [p.action for p in actual] == [p.action for p in expected]
+        assert [p.confidence for p in actual] == pytest.approx([p.confidence for p in expected])
+        assert actual[0].confidence < 1.0
+
+
+def test_matrix_predictor_fills_templates(tmp_path):
+    """Test a templated model exports its rules and predictions come back filled."""
+    from thirdlayer_prototype.agent.matrix_predictor import MatrixPredictor
+    
+    storage = Storage(":memory:", templater=Templater())
+    storage.connect()
+    for query in ("python", "rust"):
+        storage.record_session([
+            navigate(f"https://x.org/?q={query}"),
+            click("#searchInput"),
+            type_text("#searchInput", query),
+            press("Enter"),
+        ])
+    path = str(tmp_path / "model.npz")
+    storage.export_matrix(path)
+    
+    predictor = MatrixPredictor.from_file(path)
+    history = [navigate("https://x.org/?q=ocaml"), click("#searchInput")]
+    (prediction,) = predictor.predict(history, k=1)
+    assert prediction.action == type_text("#searchInput", "ocaml")
+    assert predictor.predict(history, k=1) == Predictor(storage).predict(history, k=1)
+    # Without a binding for <query> the template cannot be executed.
+    assert predictor.predict([click("#searchInput")], k=1) == []
+    storage.close()
@@ -0,0 +1,63 @@
+"""Tests for metrics and latency histograms."""
+import math
+import random
+
+import pytest
+
+from thirdlayer_prototype.agent.metrics import LatencyHistogram, Metrics, STAGES
+
+
+def test_histogram_percentiles_within_relative_error():
+    """Test percentiles match exact ones within the bucket precision."""
+    rng = random.Random(0)
+    values = [rng.lognormvariate(-4, 1.5) for _ in range(20_000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    
+    values.sort()
+    tolerance = 2 ** (1 / histogram.buckets_per_octave) - 1
+    for q in (0.5, 0.95, 0.99):
+        exact = values[math.ceil(q * len(values)) - 1]
+        assert histogram.percentile(q) == pytest.approx(exact, rel=tolerance)
+    assert histogram.percentile(1.0) == values[-1]
+    assert histogram.max == values[-1]
+    assert histogram.mean() == pytest.approx(sum(values) / len(values))
+
+
+def test_histogram_memory_is_constant():
+    """Test the bucket array does not grow with the number of samples."""
+    histogram = LatencyHistogram()
+    size = len(histogram.buckets)
+    for i in range(100_000):
+        histogram.record((i % 1000) * 1e-4)
+    histogram.record(0.0)
+    histogram.record(1e9)
+    
+    assert len(histogram.buckets) == size
+    assert histogram.count == 100_002
+    assert histogram.percentile(0.0) == 0.0
+    assert histogram.percentile(1.0) == 1e9
+
+
+def test_empty_histogram():
+    """Test an empty histogram reports zeros."""
+    summary = LatencyHistogram().summary_ms()
+    assert summary == {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+
+
+def test_metrics_stage_timings():
+    """Test per-stage timings are recorded and reported."""
+    metrics = Metrics()
+    with metrics.time_stage("observe"):
+        pass
+    metrics.record_stage_time("execute", 0.25)
+    metrics.record_decision_time(0.5)
+    
+    stats = metrics.to_dict()
+    
+    assert set(stats["stage_time_ms"]) == set(STAGES)
+    assert stats["stage_time_ms"]["observe"]["count"] == 1
+    assert stats["stage_time_ms"]["execute"]["max"] == pytest.approx(250.0)
+    assert stats["decision_time_ms"]["p50"] == pytest.approx(500.0)
+    assert stats["average_decision_time_ms"] == pytest.approx(500.0)
@@ -0,0 +1,75 @@
+"""Tests for the browser state observer."""
+import asyncio
+
+from thirdlayer_prototype.agent.observer import Observer
+
+from fakes import FakePage
+
+
+class FakeFrame:
+    """Frame stand-in; only parent_frame is read by the observer."""
+    
+    def __init__(self, parent_frame=None):
+        self.parent_frame = parent_frame
+
+
+def title_calls(page):
+    return sum(1 for call in page.calls if call[0] == "title")
+
+
+def test_polling_observer_fetches_title_every_time():
+    """Test the default observer asks the browser on every observe()."""
+    page = FakePage([])
+    observer = Observer(page)
+    
+    asyncio.run(observer.observe())
+    asyncio.run(observer.observe())
+    
+    assert title_calls(page) == 2
+    assert page.listeners == {}
+
+
+def test_event_driven_observer_caches_until_navigation():
+    """Test cached state is returned until a main-frame navigation."""
+    page = FakePage([])
+    observer = Observer(page, event_driven=True)
+    
+    first = asyncio.run(observer.observe())
+    asyncio.run(observer.observe())
+    assert title_calls(page) == 1
+    assert first.title == "Example"
+    
+    page.emit("framenavigated", FakeFrame(parent_frame=FakeFrame()))
+    asyncio.run(observer.observe())
+    assert title_calls(page) == 1
+    assert not observer.changed_since(first.navigation_count)
+    
+    page.url = "https://example.com/next"
+    page.emit("framenavigated", FakeFrame())
+    page.emit("domcontentloaded", page)
+    page.emit("load", page)
+    state = asyncio.run(observer.observe())
+    
+    assert title_calls(page) == 2
+    assert state.url == "https://example.com/next"
+    assert state.navigation_count == 1
+    assert state.load_state == "load"
+    assert observer.changed_since(first.navigation_count)
+
+
+def test_event_during_title_fetch_keeps_state_dirty():
+    """Test an event racing the title round trip forces another fetch."""
+    page = FakePage([])
+    observer = Observer(page, event_driven=True)
+    title = page.title
+    
+    async def racing_title():
+        page.emit("load", page)
+        return await title()
+    
+    page.title = racing_title
+    asyncio.run(observer.observe())
+    
+    assert observer.is_dirty()
+    observer.close()
+    assert page.listeners == {"framenavigated": [], "domcontentloaded": [], "load": []}
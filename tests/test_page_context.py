@@ -0,0 +1,128 @@
+"""Tests for page-conditioned transitions."""
+import os
+import tempfile
+
+import pytest
+
+from thirdlayer_prototype.agent.predictor import Predictor, VariableOrderPredictor
+from thirdlayer_prototype.db.compaction import Compactor
+from thirdlayer_prototype.db.rebuild import rebuild_transitions
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import navigate, click, press
+from thirdlayer_prototype.models.state import page_pattern
+
+
+SHOP = "https://shop.test/item/{}"
+DOCS = "https://docs.test/guide/{}"
+
+
+def _record(storage, n=4):
+    """Record the same key press leading to different actions on two sites."""
+    for i in range(n):
+        storage.record_session(
+            [navigate(SHOP.format(i)), press("Enter"), click("#buy")],
+            urls=["", SHOP.format(i), SHOP.format(i)],
+        )
+        storage.record_session(
+            [navigate(DOCS.format(i)), press("Enter"), click("#next")],
+            urls=["", DOCS.format(i), DOCS.format(i)],
+        )
+
+
+def test_page_pattern():
+    """Test URLs are reduced to host plus literal leading path segments."""
+    assert page_pattern("https://en.wikipedia.org/wiki/Python?x=1#y") == "en.wikipedia.org/wiki/*"
+    assert page_pattern("https://www.example.com/") == "example.com"
+    assert page_pattern("http://shop.test:8080/item/42/reviews") == "shop.test/item/*/*"
+    assert page_pattern("https://shop.test/42", literal_depth=2) == "shop.test/*"
+    assert page_pattern("https://shop.test/cart/checkout", literal_depth=2) == (
+        "shop.test/cart/checkout"
+    )
+    assert page_pattern("about:blank") == ""
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_page_top_k_separates_pages(cache):
+    """Test successors are kept per page pattern, with a support threshold."""
+    storage = Storage(":memory:", cache_transitions=cache, page_context=True)
+    storage.connect()
+    _record(storage)
+    
+    # Context-free, the key press is a coin flip between the two sites.
+    rows, total = storage.get_first_order_top_k(press("Enter"), k=5)
+    assert [row["weight"] / total for row in rows] == [0.5, 0.5]
+    
+    rows, total = storage.get_page_top_k(SHOP.format(99), press("Enter"), k=5)
+    assert [(row["to_action"], row["count"]) for row in rows] == [(click("#buy").signature(), 4)]
+    assert total == 4
+    assert storage.get_page_top_k(SHOP.format(99), press("Enter"), min_support=5) == ([], 0)
+    assert storage.get_page_top_k("https://other.test/", press("Enter")) == ([], 0)
+    assert storage.get_page_top_k("about:blank", press("Enter")) == ([], 0)
+    
+    storage.record_transitions([press("Enter")], click("#help"), url=DOCS.format(0))
+    rows, total = storage.get_page_top_k(DOCS.format(1), press("Enter"), k=5)
+    assert [row["count"] for row in rows] == [4, 1]
+    assert total == 5
+    storage.close()
+
+
+def test_page_context_is_opt_in():
+    """Test no page rows are written without page_context."""
+    storage = Storage(":memory:")
+    storage.connect()
+    _record(storage)
+    assert storage.conn.execute("SELECT COUNT(*) FROM transitions_page").fetchone()[0] == 0
+    storage.close()
+
+
+def test_predictor_prefers_page_and_backs_off():
+    """Test page predictions are sharper and sparse pages fall back."""
+    storage = Storage(":memory:", page_context=True, context_order=2)
+    storage.connect()
+    _record(storage)
+    history = [navigate(SHOP.format(7)), press("Enter")]
+    
+    for predictor in (Predictor(storage), VariableOrderPredictor(storage)):
+        (prediction,) = predictor.predict(history, k=5, url=SHOP.format(7))
+        assert (prediction.action, prediction.confidence, prediction.source) == (
+            click("#buy"), 1.0, "page"
+        )
+        # Unknown pages and no URL use the context-free counts.
+        assert len(predictor.predict(history, k=5, url="https://other.test/")) == 2
+        assert len(predictor.predict(history, k=5)) == 2
+        
+        urls = [SHOP.format(1), DOCS.format(1), None, "https://other.test/"]
+        histories = [history] * len(urls)
+        assert predictor.predict_many(histories, k=5, urls=urls) == [
+            predictor.predict(history, k=5, url=url) for url in urls
+        ]
+    
+    sparse = Predictor(storage, min_page_support=5).predict(history, k=5, url=SHOP.format(1))
+    assert {p.source for p in sparse} == {"first_order"}
+    storage.close()
+
+
+def test_rebuild_and_compaction_keep_page_tables():
+    """Test a rebuild recounts page rows and compaction keeps totals."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    storage = Storage(path, page_context=True)
+    storage.connect()
+    _record(storage)
+    query = "SELECT * FROM transitions_page ORDER BY 1, 2, 3"
+    before = [tuple(row) for row in storage.conn.execute(query)]
+    assert len(before) == 10
+    
+    storage.conn.execute("DELETE FROM transitions_page")
+    storage.conn.commit()
+    report = rebuild_transitions(storage, workers=1)
+    assert report.rows["transitions_page"] == 10
+    assert [tuple(row) for row in storage.conn.execute(query)] == before
+    
+    storage.record_transitions([press("Enter")], click("#help"), url=SHOP.format(0))
+    Compactor(max_successors=1, min_count=1).run(storage)
+    rows, total = storage.get_page_top_k(SHOP.format(1), press("Enter"), k=5)
+    assert [row["to_action"] for row in rows] == [click("#buy").signature()]
+    assert total == 5
+    storage.close()
+    os.unlink(path)
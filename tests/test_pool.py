@@ -0,0 +1,151 @@
+"""Tests for the concurrent agent pool."""
+import asyncio
+
+import pytest
+
+from thirdlayer_prototype.agent.pool import AgentPool, drive_session
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import navigate, click
+
+from fakes import FakePage
+
+
+class SlowFakePage(FakePage):
+    """FakePage whose clicks yield to the event loop and track overlap."""
+    
+    active = 0
+    peak = 0
+    
+    async def click(self, selector, timeout=None):
+        SlowFakePage.active += 1
+        SlowFakePage.peak = max(SlowFakePage.peak, SlowFakePage.active)
+        await asyncio.sleep(0.01)
+        SlowFakePage.active -= 1
+        await super().click(selector, timeout)
+    
+    async def goto(self, url, timeout=None):
+        self.url = url
+
+
+class FakeContext:
+    """Browser context stand-in owning one page."""
+    
+    def __init__(self, elements, broken=False):
+        self.elements = elements
+        self.broken = broken
+        self.closed = False
+        self.cookie_clears = 0
+    
+    async def new_page(self):
+        return SlowFakePage(self.elements)
+    
+    async def clear_cookies(self):
+        if self.broken:
+            raise RuntimeError("target closed")
+        self.cookie_clears += 1
+    
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    """Browser stand-in that hands out FakeContexts."""
+    
+    def __init__(self, elements, broken_contexts=0):
+        self.elements = elements
+        self.broken_contexts = broken_contexts
+        self.contexts = []
+    
+    async def new_context(self, **options):
+        context = FakeContext(self.elements, broken=len(self.contexts) < self.broken_contexts)
+        self.contexts.append(context)
+        return context
+
+
+@pytest.fixture
+def storage():
+    """In-memory storage that learned home -> #a -> #b."""
+    storage = Storage(":memory:", cache_transitions=True)
+    storage.connect()
+    storage.record_session([navigate("https://example.com"), click("#a"), click("#b")])
+    yield storage
+    storage.close()
+
+
+def test_pool_runs_sessions_concurrently_with_bounded_slots(storage):
+    """Test sessions share storage, overlap, and never exceed the pool size."""
+    browser = FakeBrowser(["#a", "#b"])
+    SlowFakePage.active = SlowFakePage.peak = 0
+    
+    async def run():
+        async with AgentPool(browser, storage, size=3) as pool:
+            results = await pool.run_all(
+                drive_session(navigate("https://example.com"), max_steps=3)
+                for _ in range(8)
+            )
+            return results, pool.get_stats()
+    
+    results, stats = asyncio.run(run())
+    
+    assert len(browser.contexts) == 3
+    assert all(context.closed for context in browser.contexts)
+    assert sum(context.cookie_clears for context in browser.contexts) == 8
+    assert 1 < SlowFakePage.peak <= 3
+    assert stats["sessions_completed"] == 8
+    assert stats["sessions_per_second"] > 0
+    for steps in results:
+        assert [s["execution"]["success"] for s in steps[:2]] == [True, True]
+    # Every session recorded its transitions into the shared storage.
+    transitions, _ = storage.get_first_order_top_k(click("#a"), k=1)
+    assert transitions == [{"to_action": click("#b").signature(), "count": 1 + 8, "weight": 1 + 8}]
+
+
+def test_pool_counts_failed_sessions(storage):
+    """Test a raising session frees its slot and is counted as failed."""
+    async def broken(agent):
+        raise RuntimeError("boom")
+    
+    async def ok(agent):
+        return agent.page
+    
+    async def run():
+        async with AgentPool(FakeBrowser([]), storage, size=1) as pool:
+            results = await pool.run_all([broken, ok], return_exceptions=True)
+            return results, pool.get_stats()
+    
+    results, stats = asyncio.run(run())
+    
+    assert isinstance(results[0], RuntimeError)
+    assert isinstance(results[1], SlowFakePage)
+    assert stats["sessions_failed"] == 1
+    assert stats["sessions_completed"] == 1
+
+
+def test_pool_discards_context_when_cookies_cannot_be_cleared(storage):
+    """Test a context that fails to clear cookies is replaced, not reused."""
+    browser = FakeBrowser([], broken_contexts=1)
+    
+    async def ok(agent):
+        return agent.page
+    
+    async def run():
+        async with AgentPool(browser, storage, size=1) as pool:
+            first = await pool.run(ok)
+            second = await pool.run(ok)
+            return first, second, pool.get_stats()
+    
+    first, second, stats = asyncio.run(run())
+    
+    assert first is not second
+    assert len(browser.contexts) == 2
+    assert browser.contexts[0].closed
+    assert browser.contexts[1].cookie_clears == 1
+    assert stats["contexts_discarded"] == 1
+    assert stats["sessions_completed"] == 2
+
+
+def test_pool_requires_start(storage):
+    """Test running before start() raises."""
+    pool = AgentPool(FakeBrowser([]), storage)
+    with pytest.raises(RuntimeError):
+        asyncio.run(pool.run(lambda agent: asyncio.sleep(0)))
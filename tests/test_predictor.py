@@ -2,19 +2,20 @@
 import pytest
 import tempfile
 import os
+import time
 
 from thirdlayer_prototype.db.storage import Storage
-from thirdlayer_prototype.agent.predictor import Predictor
+from thirdlayer_prototype.agent.predictor import Predictor, VariableOrderPredictor
 from thirdlayer_prototype.models.action import navigate, click, type_text
 
 
-@pytest.fixture
-def storage_with_data():
-    """Create storage with test data."""
+@pytest.fixture(params=[False, True], ids=["sqlite", "cached"])
+def storage_with_data(request):
+    """Create storage with test data, with and without the transition cache."""
     fd, path = tempfile.mkstemp(suffix=".db")
     os.close(fd)
     
-    storage = Storage(path)
+    storage = Storage(path, cache_transitions=request.param)
     storage.connect()
     
     action1 = navigate("https://example.com")
@@ -94,3 +95,120 @@ def test_predict_no_history():
     
     storage.close()
     os.unlink(path)
+
+
+@pytest.fixture
+def context_storage():
+    """Create storage with the context tree enabled."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    
+    storage = Storage(path, context_order=3)
+    storage.connect()
+    
+    yield storage
+    
+    storage.close()
+    os.unlink(path)
+
+
+def test_variable_order_uses_longest_context(context_storage):
+    """Test that longer contexts disambiguate what lower orders cannot."""
+    a, b, c, d = click("#a"), click("#b"), click("#c"), click("#d")
+    x, y = type_text("#x", "x"), type_text("#y", "y")
+    
+    context_storage.record_session([a, c, d, x])
+    context_storage.record_session([b, c, d, y])
+    context_storage.record_session([b, c, d, y])
+    
+    predictor = VariableOrderPredictor(context_storage)
+    
+    predictions = predictor.predict([a, c, d], k=5)
+    assert len(predictions) == 1
+    assert predictions[0].action == x
+    assert predictions[0].confidence == 1.0
+    assert predictions[0].source == "order_3"
+    
+    predictions = predictor.predict([click("#unseen"), c, d], k=5)
+    assert predictions[0].action == y
+    assert predictions[0].confidence == pytest.approx(2/3, rel=0.01)
+    assert predictions[0].source == "order_2"
+
+
+def test_variable_order_persists_and_matches_incremental_updates(context_storage):
+    """Test that the context tree reloads from SQLite with the same counts."""
+    a, b, c = navigate("https://example.com"), click("#b"), click("#c")
+    
+    history = []
+    for action in [a, b, c, a, b, c, a, b]:
+        context_storage.record_transitions(history, action)
+        history.append(action)
+    
+    reloaded = Storage(context_storage.db_path, context_order=3)
+    reloaded.connect()
+    try:
+        for query in ([a], [a, b], [c, a, b], [b, c, a]):
+            assert reloaded.get_context_top_k(query, k=5) == (
+                context_storage.get_context_top_k(query, k=5)
+            )
+        transitions, total, order = reloaded.get_context_top_k([c, a, b], k=5)
+        assert transitions == [{"to_action": c.signature(), "count": 1, "weight": 1}]
+        assert (total, order) == (1, 3)
+    finally:
+        reloaded.close()
+
+
+def test_variable_order_follows_recent_behavior():
+    """Test context weights decay with the storage half-life, as transitions do."""
+    a, b = click("#a"), click("#b")
+    old, new = click("#old"), click("#new")
+    storage = Storage(":memory:", context_order=2, half_life=3600.0)
+    storage.connect()
+    now = time.time()
+    for _ in range(4):
+        storage.record_session([a, b, old], timestamps=[now - 86400] * 3)
+    storage.record_session([a, b, new], timestamps=[now] * 3)
+    
+    (top, *_) = VariableOrderPredictor(storage).predict([a, b], k=2)
+    assert top.action == new
+    assert top.source == "order_2"
+    assert top.confidence == pytest.approx(1.0, rel=1e-6)
+    # Support still counts raw observations: all five sessions.
+    _, _, order = storage.get_context_top_k([a, b], k=1, min_support=5)
+    assert order == 2
+    storage.close()
+
+
+def test_variable_order_requires_context_tree(storage_with_data):
+    """Test that the predictor rejects storage without a context tree."""
+    with pytest.raises(ValueError):
+        VariableOrderPredictor(storage_with_data)
+
+
+def test_predict_many_matches_predict(storage_with_data):
+    """Test that batch prediction returns the same results as predict(), aligned."""
+    predictor = Predictor(storage_with_data)
+    
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    action_unknown = type_text("#unknown", "foo")
+    
+    histories = [
+        [action1, action2],
+        [],
+        [action1],
+        [action_unknown, action1],
+        [action_unknown],
+        [action1, action2],
+        [action2, action1],
+    ]
+    
+    for use_second_order in (True, False):
+        results = predictor.predict_many(histories, k=5, use_second_order=use_second_order)
+        
+        assert len(results) == len(histories)
+        for history, predictions in zip(histories, results):
+            expected = predictor.predict(history, k=5, use_second_order=use_second_order)
+            assert [(p.action, p.confidence, p.source) for p in predictions] == [
+                (p.action, p.confidence, p.source) for p in expected
+            ]
@@ -0,0 +1,157 @@
+"""Tests for rebuilding the transition tables from the action history."""
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+from thirdlayer_prototype.cli import main
+from thirdlayer_prototype.db.archive import archive_sessions
+from thirdlayer_prototype.db.rebuild import rebuild_transitions
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import navigate, click, type_text
+
+
+DAY = 24 * 3600.0
+
+
+def _snapshot(storage):
+    """Get every transition and total row, keyed by vocab id."""
+    return {
+        table: storage.conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2, 3").fetchall()
+        for table in (
+            "transitions_first_order",
+            "transitions_second_order",
+            "transition_totals_first_order",
+        )
+    }
+
+
+def _counts(storage):
+    """Get (from, to, count, weight) of the first-order rows."""
+    return [
+        tuple(row)
+        for row in storage.conn.execute(
+            "SELECT from_id, to_id, count, weight FROM transitions_first_order ORDER BY 1, 2"
+        )
+    ]
+
+
+@pytest.fixture
+def db_path():
+    """Create a database recorded session by session, with failures and old sessions."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.db")
+        storage = Storage(path)
+        storage.connect()
+        now = time.time()
+        home = navigate("https://example.com")
+        for i in range(40):
+            started = now - (40 - i) * DAY
+            storage.record_session(
+                [home, click(f"#tab{i % 3}"), type_text("#q", f"q{i % 5}"), click("#go")],
+                successes=[True, True, i % 4 != 0, True],
+                timestamps=[started + step for step in range(4)],
+            )
+        storage.close()
+        yield path
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_rebuild_reproduces_incremental_counts(db_path, workers):
+    """Test that a rebuild recounts exactly what recording counted."""
+    storage = Storage(db_path, cache_transitions=True)
+    storage.connect()
+    before = _snapshot(storage)
+    top = storage.get_first_order_top_k(navigate("https://example.com"), k=3)
+    storage.conn.execute("UPDATE transitions_first_order SET count = count + 100")
+    storage.conn.commit()
+    
+    report = rebuild_transitions(storage, workers=workers)
+    assert report.sessions == 40
+    assert report.actions == 160
+    assert report.shards >= workers
+    assert _snapshot(storage) == before
+    assert storage.get_first_order_top_k(navigate("https://example.com"), k=3) == top
+    
+    # Indexes and triggers are back on the swapped-in tables.
+    names = {row[0] for row in storage.conn.execute("SELECT name FROM sqlite_master")}
+    assert {"idx_transitions_first_weight", "trg_transitions_first_insert"} <= names
+    assert not any(name.startswith("rebuild_") for name in names)
+    storage.record_transition_first_order(click("#go"), click("#new"))
+    (total,) = storage.conn.execute(
+        "SELECT total FROM transition_totals_first_order WHERE from_id = ?",
+        (storage._action_id(click("#go").signature()),),
+    ).fetchone()
+    assert total == 1
+    storage.close()
+
+
+def test_rebuild_applies_new_filtering_and_order(db_path):
+    """Test dropping failed actions and adding context orders on rebuild."""
+    storage = Storage(db_path)
+    storage.connect()
+    home = navigate("https://example.com")
+    # By default the failed type_text stays a source state.
+    assert storage.get_first_order_transitions(type_text("#q", "q0"))
+    
+    report = rebuild_transitions(storage, workers=1, context_order=3, drop_failed=True)
+    assert report.context_order == 3
+    assert report.rows["transitions_context"] > 0
+    after_failure = {
+        row["to_action"] for row in storage.get_first_order_transitions(click("#tab0"))
+    }
+    assert click("#go").signature() in after_failure
+    storage.close()
+    
+    storage = Storage(db_path, context_order=3)
+    storage.connect()
+    history = [home, click("#tab1"), type_text("#q", "q1")]
+    rows, _, order = storage.get_context_top_k(history, k=1)
+    assert order == 3
+    assert rows[0]["to_action"] == click("#go").signature()
+    storage.close()
+
+
+def test_rebuild_counts_archived_sessions(db_path, tmp_path):
+    """Test that archived sessions are counted alongside the actions log."""
+    storage = Storage(db_path)
+    storage.connect()
+    before = _counts(storage)
+    archived = archive_sessions(storage, tmp_path, older_than_seconds=20 * DAY)
+    assert 0 < archived.sessions < 40
+    
+    report = rebuild_transitions(storage, archive_dir=tmp_path, workers=2)
+    assert report.sessions == 40
+    assert _counts(storage) == before
+    
+    rebuild_transitions(storage, workers=1)
+    assert sum(row[2] for row in _counts(storage)) < sum(row[2] for row in before)
+    storage.close()
+
+
+def test_rebuild_sets_decay_half_life(db_path):
+    """Test that rebuilt weights decay with a new half-life."""
+    storage = Storage(db_path)
+    storage.connect()
+    rebuild_transitions(storage, workers=1, half_life=10 * DAY)
+    assert storage.half_life == 10 * DAY
+    
+    rows, total = storage.get_first_order_top_k(navigate("https://example.com"), k=5)
+    assert all(row["weight"] < row["count"] for row in rows)
+    assert total == pytest.approx(sum(row["weight"] for row in rows))
+    storage.close()
+    
+    reopened = Storage(db_path)
+    reopened.connect()
+    assert reopened.half_life == 10 * DAY
+    reopened.close()
+
+
+def test_cli_rebuild(db_path, capsys):
+    """Test the rebuild subcommand prints a report."""
+    assert main(["rebuild", "--db", db_path, "--workers", "1", "--context-order", "2"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["sessions"] == 40
+    assert report["context_order"] == 2
@@ -0,0 +1,94 @@
+"""Tests for offline replay evaluation."""
+import json
+import pytest
+import tempfile
+import os
+
+from thirdlayer_prototype.cli import main
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.agent.predictor import Predictor
+from thirdlayer_prototype.eval.replay import (
+    ReplayEvaluator,
+    load_sessions_from_jsonl,
+    split_sessions,
+    train_storage,
+)
+from thirdlayer_prototype.models.action import navigate, click, type_text
+
+
+def make_sessions():
+    """Build a small set of sessions with one deterministic workflow."""
+    home = navigate("https://example.com")
+    search = type_text("#search", "query")
+    sessions = [[home, search, click("#go"), click("#result")] for _ in range(4)]
+    sessions.append([home, click("#about")])
+    return sessions
+
+
+def test_replay_scores_accuracy_and_coverage():
+    """Test top-1/top-k accuracy and coverage on an in-sample replay."""
+    sessions = make_sessions()
+    storage = train_storage(sessions)
+    
+    report = ReplayEvaluator(Predictor(storage), k=2).evaluate(sessions)
+    stats = report.to_dict()
+    
+    assert stats["steps"] == 4 * 3 + 1
+    assert stats["coverage"] == 1.0
+    assert stats["top1_accuracy"] == pytest.approx(12 / 13)
+    assert stats["topk_accuracy"] == 1.0
+    assert stats["metrics"]["total_predictions"] == 13
+    assert sum(b["count"] for b in stats["calibration"]) == 13
+    assert stats["latency_ms"]["max"] >= stats["latency_ms"]["p50"] >= 0.0
+    
+    storage.close()
+
+
+def test_split_sessions_is_chronological_by_default():
+    """Test that the held-out sessions are the most recent ones."""
+    sessions = [[click(f"#{i}")] for i in range(10)]
+    
+    train, test = split_sessions(sessions, test_fraction=0.3)
+    
+    assert train == sessions[:7]
+    assert test == sessions[7:]
+    
+    shuffled_train, shuffled_test = split_sessions(sessions, test_fraction=0.3, shuffle=True)
+    assert len(shuffled_train) == 7
+    assert sorted(map(str, shuffled_train + shuffled_test)) == sorted(map(str, sessions))
+
+
+def test_iter_sessions_splits_log_on_gaps():
+    """Test that the actions log is split into sessions on inactivity gaps."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    
+    storage = Storage(path)
+    storage.connect()
+    try:
+        first, second = make_sessions()[0], make_sessions()[-1]
+        storage.record_session(first, timestamps=[100.0, 101.0, 102.0, 103.0])
+        storage.record_session(
+            second, successes=[True, False], timestamps=[5000.0, 5001.0]
+        )
+        
+        assert list(storage.iter_sessions(gap_seconds=60)) == [first, second[:1]]
+    finally:
+        storage.close()
+        os.unlink(path)
+
+
+def test_cli_replay_from_jsonl(tmp_path, capsys):
+    """Test the replay command with a train/test split over a JSONL file."""
+    path = tmp_path / "sessions.jsonl"
+    with open(path, "w") as f:
+        for session in make_sessions():
+            f.write(json.dumps({"actions": [a.to_dict() for a in session]}) + "\n")
+    
+    assert len(list(load_sessions_from_jsonl(str(path)))) == 5
+    
+    assert main(["replay", "--jsonl", str(path), "--test-fraction", "0.2", "-k", "3"]) == 0
+    stats = json.loads(capsys.readouterr().out)
+    
+    assert stats["steps"] == 1
+    assert stats["k"] == 3
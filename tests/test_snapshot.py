@@ -0,0 +1,173 @@
+"""Tests for memory-mapped model snapshots."""
+import json
+import os
+import threading
+
+import pytest
+
+from thirdlayer_prototype.agent.predictor import Predictor
+from thirdlayer_prototype.agent.snapshot_predictor import SnapshotPredictor
+from thirdlayer_prototype.cli import main
+from thirdlayer_prototype.db.compaction import Compactor
+from thirdlayer_prototype.db.snapshot import Snapshot
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import navigate, click, type_text, press
+from thirdlayer_prototype.models.template import Templater
+
+
+HOME = navigate("https://example.com")
+SEARCH = type_text("#search", "query")
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """Create an on-disk storage with a few recorded sessions."""
+    storage = Storage(str(tmp_path / "test.db"), cache_transitions=True, half_life=3600.0)
+    storage.connect()
+    storage.record_session([HOME, click("#a"), SEARCH, click("#b")])
+    storage.record_session([HOME, click("#a"), SEARCH, click("#c")])
+    storage.record_session([HOME, click("#d"), SEARCH, click("#b")])
+    storage.record_session([click("#d"), HOME, click("#a")])
+    storage.record_session([HOME, click("#a"), SEARCH, click("#b")])
+    yield storage
+    storage.close()
+
+
+def _as_tuples(predictions):
+    """Get (action, rounded confidence, source) of each prediction."""
+    return [(p.action, round(p.confidence, 12), p.source) for p in predictions]
+
+
+def test_snapshot_matches_live_predictor(storage, tmp_path):
+    """Test every history gets the live predictor's predictions."""
+    path = str(tmp_path / "model.snap")
+    info = storage.export_snapshot(path)
+    assert info.vocab_size == 6
+    assert info.bytes == os.path.getsize(path)
+
+    live = Predictor(storage)
+    predictor = SnapshotPredictor(path)
+    actions = [HOME, SEARCH, *(click(s) for s in "#a #b #c #d #unknown".split())]
+    for prev in actions:
+        for current in actions:
+            for k in (1, 5):
+                history = [prev, current]
+                assert _as_tuples(predictor.predict(history, k=k)) == _as_tuples(
+                    live.predict(history, k=k)
+                )
+                assert _as_tuples(
+                    predictor.predict(history, k=k, use_second_order=False)
+                ) == _as_tuples(live.predict(history, k=k, use_second_order=False))
+    assert predictor.predict([]) == []
+    predictor.close()
+
+
+def test_snapshot_keeps_compacted_totals(storage, tmp_path):
+    """Test confidences use the totals, including compacted-away weight."""
+    Compactor(max_successors=1, min_count=1).run(storage)
+    path = str(tmp_path / "model.snap")
+    storage.export_snapshot(path)
+    with Snapshot(path) as snapshot:
+        rows = snapshot.first_order_top_k(snapshot.index_of(SEARCH.signature()), k=5)
+        assert [snapshot.signature(index) for index, _ in rows] == [click("#b").signature()]
+        assert rows[0][1] == pytest.approx(0.75)
+
+
+def test_snapshot_rejects_bad_files(storage, tmp_path):
+    """Test the header and size are validated on open."""
+    path = tmp_path / "model.snap"
+    storage.export_snapshot(str(path))
+    data = path.read_bytes()
+
+    path.write_bytes(b"NOTASNAP" + data[8:])
+    with pytest.raises(ValueError, match="not a snapshot"):
+        Snapshot(str(path))
+    path.write_bytes(data[:8] + (99).to_bytes(4, "little") + data[12:])
+    with pytest.raises(ValueError, match="version 99"):
+        Snapshot(str(path))
+    path.write_bytes(data[:-8])
+    with pytest.raises(ValueError, match="truncated"):
+        Snapshot(str(path))
+
+
+def test_snapshot_predictor_fills_templates(tmp_path):
+    """Test a templated model stores its rules and predictions come back filled."""
+    storage = Storage(str(tmp_path / "test.db"), templater=Templater())
+    storage.connect()
+    for query in ("python", "rust"):
+        storage.record_session([
+            navigate(f"https://x.org/?q={query}"),
+            click("#searchInput"),
+            type_text("#searchInput", query),
+            press("Enter"),
+        ])
+    path = str(tmp_path / "model.snap")
+    assert storage.export_snapshot(path).templated is True
+
+    predictor = SnapshotPredictor(path)
+    assert predictor.snapshot.templater.rules == storage.templater.rules
+    history = [navigate("https://x.org/?q=ocaml"), click("#searchInput")]
+    (prediction,) = predictor.predict(history, k=1)
+    assert prediction.action == type_text("#searchInput", "ocaml")
+    assert predictor.predict(history, k=1) == Predictor(storage).predict(history, k=1)
+    # Without a binding for <query> the template cannot be executed.
+    assert predictor.predict([click("#searchInput")], k=1) == []
+    filled = SnapshotPredictor(path, slot_values={"query": "go"})
+    assert filled.predict([click("#searchInput")], k=1)[0].action == type_text(
+        "#searchInput", "go"
+    )
+    predictor.close()
+    filled.close()
+    storage.close()
+
+
+def test_hot_swap_to_newer_snapshot(storage, tmp_path):
+    """Test reload_if_changed() swaps in a replaced file without disturbing readers."""
+    path = str(tmp_path / "model.snap")
+    storage.export_snapshot(path)
+    predictor = SnapshotPredictor(path)
+    old = predictor.snapshot
+    assert predictor.reload_if_changed() is False
+
+    for _ in range(5):
+        storage.record_session([SEARCH, click("#e")])
+    storage.export_snapshot(path)
+
+    errors = []
+
+    def predict_while_swapping():
+        try:
+            for _ in range(200):
+                (top, *_) = predictor.predict([SEARCH], k=1)
+                assert top.action in (click("#b"), click("#e"))
+        except Exception as e:
+            errors.append(e)
+
+    reader = threading.Thread(target=predict_while_swapping)
+    reader.start()
+    assert predictor.reload_if_changed() is True
+    reader.join()
+    assert errors == []
+
+    assert predictor.predict([SEARCH], k=1)[0].action == click("#e")
+    # The replaced mapping still serves predictions that started on it.
+    rows = old.first_order_top_k(old.index_of(SEARCH.signature()), k=1)
+    assert old.signature(rows[0][0]) == click("#b").signature()
+    old.close()
+
+    (tmp_path / "bad.snap").write_bytes(b"garbage")
+    with pytest.raises(ValueError):
+        predictor.reload(str(tmp_path / "bad.snap"))
+    assert predictor.path == path
+    predictor.close()
+
+
+def test_cli_snapshot(storage, tmp_path, capsys):
+    """Test the snapshot subcommand exports from a database."""
+    out = str(tmp_path / "cli.snap")
+    assert main(["snapshot", "--db", storage.db_path, "--out", out]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["path"] == out
+    assert report["vocab_size"] == 6
+    with Snapshot(out) as snapshot:
+        assert snapshot.info.first_order_edges == report["first_order_edges"]
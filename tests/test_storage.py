@@ -1,9 +1,11 @@
 """Tests for storage module."""
 import pytest
+import sqlite3
 import tempfile
 import os
+import time
 
-from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.db.storage import SCHEMA_VERSION, Storage
 from thirdlayer_prototype.models.action import navigate, click, type_text
 
 
@@ -104,3 +106,478 @@ def test_get_top_transitions(temp_storage):
     assert len(top) == 2
     assert top[0]["count"] == 2
     assert top[1]["count"] == 1
+
+
+def test_record_session_aggregates_transitions(temp_storage):
+    """Test bulk session ingestion counts repeated transitions once per occurrence."""
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    
+    count = temp_storage.record_session([action1, action2, action1, action2])
+    
+    assert count == 4
+    assert len(temp_storage.get_recent_actions(limit=10)) == 4
+    
+    first = temp_storage.get_first_order_transitions(action1)
+    assert first == [{"to_action": action2.signature(), "count": 2, "weight": 2}]
+    
+    second = temp_storage.get_second_order_transitions(action1, action2)
+    assert second == [{"to_action": action1.signature(), "count": 1, "weight": 1}]
+
+
+def test_record_session_skips_transitions_into_failures(temp_storage):
+    """Test that failed actions are logged but not counted as transition targets."""
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    action3 = type_text("#input", "test")
+    
+    temp_storage.record_session(
+        [action1, action2, action3],
+        successes=[True, False, True],
+    )
+    
+    assert temp_storage.get_first_order_transitions(action1) == []
+    assert len(temp_storage.get_first_order_transitions(action2)) == 1
+    assert len(temp_storage.get_second_order_transitions(action1, action2)) == 1
+
+
+def test_batch_rolls_back_on_error(temp_storage):
+    """Test that a failing batch leaves no partial writes behind."""
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    
+    with pytest.raises(RuntimeError):
+        with temp_storage.batch():
+            temp_storage.record_action(action1)
+            temp_storage.record_transition_first_order(action1, action2)
+            raise RuntimeError("boom")
+    
+    assert temp_storage.get_recent_actions(limit=10) == []
+    assert temp_storage.get_first_order_transitions(action1) == []
+
+
+def test_transition_cache_warm_and_write_through(temp_storage):
+    """Test that the cache is warmed at connect and mirrors later writes."""
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    action3 = type_text("#input", "test")
+    
+    temp_storage.record_transition_first_order(action1, action2)
+    temp_storage.record_transition_second_order(action1, action2, action3)
+    
+    cached = Storage(temp_storage.db_path, cache_transitions=True)
+    cached.connect()
+    try:
+        assert cached.get_first_order_transitions(action1) == (
+            temp_storage.get_first_order_transitions(action1)
+        )
+        
+        cached.record_transition_first_order(action1, action3)
+        cached.record_transition_first_order(action1, action3)
+        cached.record_session([action1, action3])
+        
+        from_cache = cached.get_first_order_transitions(action1)
+        cached.cache = None
+        assert from_cache == cached.get_first_order_transitions(action1)
+        assert [t["count"] for t in from_cache] == [3, 1]
+    finally:
+        cached.close()
+
+
+def test_cached_lookups_skip_vocab_queries(temp_storage):
+    """Test that the cache loads the whole vocab, so unknown actions need no query."""
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    temp_storage.record_transition_first_order(action1, action2)
+    
+    cached = Storage(temp_storage.db_path, cache_transitions=True)
+    cached.connect()
+    try:
+        statements = []
+        cached.conn.set_trace_callback(statements.append)
+        
+        assert cached.get_first_order_transitions(click("#unknown")) == []
+        assert [t["to_action"] for t in cached.get_first_order_transitions(action1)] == [
+            action2.signature()
+        ]
+        assert not [s for s in statements if "action_vocab" in s]
+        
+        # Actions recorded by another process show up after reload_cache().
+        temp_storage.record_transition_first_order(action2, action1)
+        assert cached.get_first_order_transitions(action2) == []
+        cached.reload_cache()
+        assert len(cached.get_first_order_transitions(action2)) == 1
+    finally:
+        cached.close()
+
+
+def test_transitions_reference_interned_action_ids(temp_storage):
+    """Test that transitions store vocab ids instead of signature text."""
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    
+    temp_storage.record_transition_first_order(action1, action2)
+    temp_storage.record_transition_first_order(action2, action1)
+    
+    vocab = temp_storage.conn.execute("SELECT signature FROM action_vocab").fetchall()
+    assert sorted(row[0] for row in vocab) == sorted([action1.signature(), action2.signature()])
+    
+    row = temp_storage.conn.execute("SELECT from_id, to_id FROM transitions_first_order").fetchone()
+    assert isinstance(row["from_id"], int)
+    assert isinstance(row["to_id"], int)
+
+
+def test_migrate_signature_keyed_database():
+    """Test that a database with signature-keyed transitions is migrated in place."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    action3 = type_text("#input", "test")
+    
+    legacy = sqlite3.connect(path)
+    legacy.executescript(
+        """
+        CREATE TABLE actions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action_signature TEXT NOT NULL,
+            action_json TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            url TEXT,
+            success INTEGER DEFAULT 1
+        );
+        CREATE TABLE transitions_first_order (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_action TEXT NOT NULL,
+            to_action TEXT NOT NULL,
+            count INTEGER DEFAULT 1,
+            UNIQUE(from_action, to_action)
+        );
+        CREATE TABLE transitions_second_order (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_action_1 TEXT NOT NULL,
+            from_action_2 TEXT NOT NULL,
+            to_action TEXT NOT NULL,
+            count INTEGER DEFAULT 1,
+            UNIQUE(from_action_1, from_action_2, to_action)
+        );
+        CREATE INDEX idx_transitions_first_from ON transitions_first_order(from_action);
+        """
+    )
+    legacy.execute(
+        "INSERT INTO transitions_first_order (from_action, to_action, count) VALUES (?, ?, ?)",
+        (action1.signature(), action2.signature(), 4),
+    )
+    legacy.execute(
+        "INSERT INTO transitions_second_order (from_action_1, from_action_2, to_action, count) "
+        "VALUES (?, ?, ?, ?)",
+        (action1.signature(), action2.signature(), action3.signature(), 2),
+    )
+    legacy.commit()
+    legacy.close()
+    
+    storage = Storage(path)
+    storage.connect()
+    try:
+        assert storage.get_first_order_transitions(action1) == [
+            {"to_action": action2.signature(), "count": 4, "weight": 4}
+        ]
+        assert storage.get_second_order_transitions(action1, action2) == [
+            {"to_action": action3.signature(), "count": 2, "weight": 2}
+        ]
+        storage.record_transition_first_order(action1, action2)
+        assert storage.get_first_order_transitions(action1)[0]["count"] == 5
+        assert storage.get_first_order_top_k(action1, k=1)[1] == 5
+        assert storage.get_second_order_top_k(action1, action2, k=1)[1] == 2
+    finally:
+        storage.close()
+    
+    storage = Storage(path)
+    storage.connect()
+    try:
+        assert storage.get_first_order_transitions(action1)[0]["count"] == 5
+    finally:
+        storage.close()
+        os.unlink(path)
+
+
+@pytest.mark.parametrize("cache_transitions", [False, True])
+def test_top_k_returns_limited_rows_with_full_total(cache_transitions):
+    """Test that top-K queries return only K successors plus the full denominator."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    
+    storage = Storage(path, cache_transitions=cache_transitions)
+    storage.connect()
+    try:
+        hub = navigate("https://example.com")
+        for i in range(10):
+            for _ in range(i + 1):
+                storage.record_transition_first_order(hub, click(f"#link{i}"))
+        storage.record_session([hub, click("#link9"), click("#link0")])
+        
+        transitions, total = storage.get_first_order_top_k(hub, k=3)
+        assert [t["to_action"] for t in transitions] == [
+            click("#link9").signature(),
+            click("#link8").signature(),
+            click("#link7").signature(),
+        ]
+        assert [t["count"] for t in transitions] == [11, 9, 8]
+        assert total == sum(range(1, 11)) + 1
+        
+        transitions, total = storage.get_second_order_top_k(hub, click("#link9"), k=3)
+        assert transitions == [{"to_action": click("#link0").signature(), "count": 1, "weight": 1}]
+        assert total == 1
+        
+        assert storage.get_first_order_top_k(click("#unknown"), k=3) == ([], 0)
+    finally:
+        storage.close()
+        os.unlink(path)
+
+
+def test_transition_totals_track_deletes(temp_storage):
+    """Test that triggers keep per-source totals in step with row changes."""
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    action3 = type_text("#input", "test")
+    
+    temp_storage.record_transition_first_order(action1, action2)
+    temp_storage.record_transition_first_order(action1, action2)
+    temp_storage.record_transition_first_order(action1, action3)
+    assert temp_storage.get_total_transition_count() == 3
+    
+    temp_storage.conn.execute(
+        "DELETE FROM transitions_first_order WHERE to_id = "
+        "(SELECT id FROM action_vocab WHERE signature = ?)",
+        (action3.signature(),),
+    )
+    temp_storage.conn.commit()
+    
+    assert temp_storage.get_first_order_top_k(action1, k=5)[1] == 2
+    assert temp_storage.get_total_transition_count() == 2
+
+
+@pytest.fixture
+def wal_storage():
+    """Create temporary WAL-mode storage with a reader pool."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = Storage(os.path.join(tmpdir, "test.db"), wal=True, reader_pool_size=2)
+        storage.connect()
+        yield storage
+        storage.close()
+
+
+def test_wal_mode_pragmas(wal_storage):
+    """Test WAL journaling and tuning pragmas on writer and readers."""
+    assert wal_storage.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert wal_storage.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert wal_storage.conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    assert len(wal_storage._reader_conns) == 2
+    for reader in wal_storage._reader_conns:
+        assert reader.execute("PRAGMA query_only").fetchone()[0] == 1
+        with pytest.raises(sqlite3.OperationalError):
+            reader.execute("DELETE FROM actions")
+
+
+def test_wal_reads_do_not_block_on_open_write(wal_storage):
+    """Test other threads read committed data while a batch is open."""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    action3 = type_text("#input", "test")
+    wal_storage.record_transition_first_order(action1, action2)
+    
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with wal_storage.batch():
+            wal_storage.record_transition_first_order(action1, action3)
+            # The writer sees its own uncommitted rows...
+            assert wal_storage.get_total_transition_count() == 2
+            # ...while readers see the last commit without waiting.
+            assert executor.submit(wal_storage.get_total_transition_count).result(timeout=2) == 1
+        assert executor.submit(wal_storage.get_total_transition_count).result(timeout=2) == 2
+
+
+def test_wal_checkpoint_truncates_log(wal_storage):
+    """Test that a TRUNCATE checkpoint empties the WAL file."""
+    wal_storage.record_session([navigate("https://example.com"), click("#a"), click("#b")])
+    assert os.path.getsize(wal_storage.db_path + "-wal") > 0
+    
+    busy, _, _ = wal_storage.checkpoint("truncate")
+    
+    assert busy == 0
+    assert os.path.getsize(wal_storage.db_path + "-wal") == 0
+    with pytest.raises(ValueError):
+        wal_storage.checkpoint("sometimes")
+
+
+def test_wal_requires_file_database():
+    """Test WAL mode rejects in-memory databases."""
+    with pytest.raises(ValueError):
+        Storage(":memory:", wal=True)
+
+
+@pytest.mark.parametrize("cache_transitions", [False, True])
+def test_decayed_weights_favor_recent_transitions(cache_transitions):
+    """Test weights halve per half-life while counts stay raw."""
+    storage = Storage(":memory:", cache_transitions=cache_transitions, half_life=10.0)
+    storage.connect()
+    try:
+        home = navigate("https://example.com")
+        now = time.time()
+        for _ in range(3):
+            storage.record_session([home, click("#old")], timestamps=[now - 20, now - 20])
+        storage.record_session([home, click("#new")], timestamps=[now, now])
+        
+        transitions, total = storage.get_first_order_top_k(home, k=5)
+        assert [t["to_action"] for t in transitions] == [
+            click("#new").signature(),
+            click("#old").signature(),
+        ]
+        assert [t["count"] for t in transitions] == [1, 3]
+        assert [t["weight"] for t in transitions] == pytest.approx([1.0, 0.75], rel=1e-3)
+        assert total == pytest.approx(1.75, rel=1e-3)
+        assert [
+            (t["to_action"], t["count"]) for t in storage.get_first_order_transitions(home)
+        ] == [(t["to_action"], t["count"]) for t in transitions]
+    finally:
+        storage.close()
+
+
+def test_decay_clock_persists_and_rebases(temp_storage):
+    """Test the half-life is stored and changing it keeps decayed weights."""
+    path = temp_storage.db_path
+    temp_storage.close()
+    home = navigate("https://example.com")
+    
+    storage = Storage(path, half_life=10.0)
+    storage.connect()
+    now = time.time()
+    storage.record_session([home, click("#a")], timestamps=[now - 10, now - 10])
+    storage.close()
+    
+    storage = Storage(path)
+    storage.connect()
+    assert storage.half_life == 10.0
+    storage.close()
+    
+    storage = Storage(path, half_life=20.0)
+    storage.connect()
+    try:
+        assert storage.half_life == 20.0
+        transitions, _ = storage.get_first_order_top_k(home, k=1)
+        assert transitions[0]["weight"] == pytest.approx(0.5, rel=1e-3)
+        
+        # Writing far past the epoch moves it forward instead of overflowing.
+        later = storage.decay_epoch + 100 * storage.half_life
+        storage.record_session([home, click("#a")], timestamps=[later, later])
+        assert storage.decay_epoch == later
+        row = storage.conn.execute("SELECT count, weight FROM transitions_first_order").fetchone()
+        assert row["count"] == 2
+        assert row["weight"] == pytest.approx(1.0)
+    finally:
+        storage.close()
+
+
+def test_migrate_database_without_decay_weights():
+    """Test that a v2 database gains weights equal to its counts."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    
+    legacy = sqlite3.connect(path)
+    legacy.executescript(
+        """
+        CREATE TABLE actions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action_signature TEXT NOT NULL,
+            action_json TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            url TEXT,
+            success INTEGER DEFAULT 1
+        );
+        CREATE TABLE action_vocab (id INTEGER PRIMARY KEY, signature TEXT NOT NULL UNIQUE);
+        CREATE TABLE transitions_first_order (
+            from_id INTEGER NOT NULL,
+            to_id INTEGER NOT NULL,
+            count INTEGER DEFAULT 1,
+            PRIMARY KEY (from_id, to_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE transition_totals_first_order (
+            from_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX idx_transitions_first_top ON transitions_first_order(from_id, count DESC);
+        CREATE TRIGGER trg_transitions_first_insert
+        AFTER INSERT ON transitions_first_order
+        BEGIN
+            INSERT INTO transition_totals_first_order (from_id, total)
+            VALUES (NEW.from_id, NEW.count)
+            ON CONFLICT(from_id) DO UPDATE SET total = total + excluded.total;
+        END;
+        PRAGMA user_version = 2;
+        """
+    )
+    action1 = navigate("https://example.com")
+    action2 = click("#button")
+    legacy.executemany(
+        "INSERT INTO action_vocab (id, signature) VALUES (?, ?)",
+        [(1, action1.signature()), (2, action2.signature())],
+    )
+    legacy.execute("INSERT INTO transitions_first_order VALUES (1, 2, 4)")
+    legacy.commit()
+    legacy.close()
+    
+    storage = Storage(path)
+    storage.connect()
+    try:
+        assert storage.conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert storage.get_first_order_top_k(action1, k=1) == (
+            [{"to_action": action2.signature(), "count": 4, "weight": 4.0}],
+            4.0,
+        )
+        storage.record_transition_first_order(action1, action2)
+        assert storage.get_first_order_top_k(action1, k=1)[1] == 5.0
+    finally:
+        storage.close()
+        os.unlink(path)
+
+
+def test_migrate_context_counts_to_weights(tmp_path):
+    """Test v5 context counts gain decay weights equal to their counts."""
+    path = str(tmp_path / "v5.db")
+    a, b, c = click("#a"), click("#b"), click("#c")
+    storage = Storage(path, context_order=2, half_life=3600.0)
+    storage.connect()
+    storage.record_session([a, b, c])
+    storage.record_session([a, b, c])
+    storage.close()
+    
+    legacy = sqlite3.connect(path)
+    legacy.executescript(
+        """
+        CREATE TABLE legacy AS SELECT context, to_id, count FROM transitions_context;
+        DROP TABLE transitions_context;
+        CREATE TABLE transitions_context (
+            context TEXT NOT NULL,
+            to_id INTEGER NOT NULL,
+            count INTEGER DEFAULT 1,
+            PRIMARY KEY (context, to_id)
+        ) WITHOUT ROWID;
+        INSERT INTO transitions_context SELECT * FROM legacy;
+        DROP TABLE legacy;
+        PRAGMA user_version = 5;
+        """
+    )
+    legacy.close()
+    
+    storage = Storage(path, context_order=2)
+    storage.connect()
+    try:
+        rows, total, order = storage.get_context_top_k([a, b], k=1)
+        assert rows == [
+            {"to_action": c.signature(), "count": 2, "weight": pytest.approx(2.0)}
+        ]
+        assert (total, order) == (pytest.approx(2.0), 2)
+    finally:
+        storage.close()
@@ -0,0 +1,288 @@
+"""Tests for action templates."""
+import os
+import random
+import tempfile
+
+import pytest
+
+from thirdlayer_prototype.agent.predictor import (
+    Prediction,
+    Predictor,
+    VariableOrderPredictor,
+    fill_predictions,
+)
+from thirdlayer_prototype.db.rebuild import rebuild_transitions
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.eval.replay import ReplayEvaluator, train_storage
+from thirdlayer_prototype.models.action import navigate, click, type_text, press
+from thirdlayer_prototype.models.template import TemplateRule, Templater, slots
+
+
+def _search_session(query: str) -> list:
+    """One Wikipedia search for query."""
+    title = query.title().replace(" ", "_")
+    return [
+        navigate("https://en.wikipedia.org"),
+        click("#searchInput"),
+        type_text("#searchInput", query),
+        press("Enter"),
+        navigate(f"https://en.wikipedia.org/wiki/{title}"),
+        click("#toc"),
+    ]
+
+
+def test_templatize_and_fill_round_trip():
+    """Test that default rules turn free text and article paths into slots."""
+    templater = Templater()
+    
+    template, bindings = templater.templatize(type_text("#searchInput", "python"))
+    assert template == type_text("#searchInput", "<query>")
+    assert bindings == {"query": "python"}
+    assert templater.fill(template, bindings) == type_text("#searchInput", "python")
+    
+    template, bindings = templater.templatize(navigate("https://en.wikipedia.org/wiki/Python"))
+    assert template == navigate("https://en.wikipedia.org/wiki/<title>")
+    assert slots(template) == ["title"]
+    assert templater.fill(template, {}) is None
+    
+    assert templater.template(type_text("#email", "a@b.c")) == type_text("#email", "<text>")
+    assert templater.template(click("#go")) is click("#go")
+
+
+def test_url_slots_are_decoded_and_encoded():
+    """Test slot values move between typed text and URLs with escaping."""
+    templater = Templater()
+    search_url = navigate("https://example.com/s?q=<query>")
+    
+    # URL -> text: the query parameter binds the decoded query.
+    history = [navigate("https://example.com/s?search=machine%20learning")]
+    assert templater.bindings(history) == {"query": "machine learning"}
+    typed = templater.fill(type_text("#search", "<query>"), templater.bindings(history))
+    assert typed == type_text("#search", "machine learning")
+    assert templater.bindings([navigate("https://example.com/s?q=AT%26T+stock")]) == {
+        "query": "AT&T stock"
+    }
+    
+    # Text -> URL: the typed query is encoded as one parameter value.
+    history = [type_text("#search", "AT&T stock")]
+    filled = templater.fill(search_url, templater.bindings(history))
+    assert filled == navigate("https://example.com/s?q=AT%26T+stock")
+    assert templater.bindings([filled]) == {"query": "AT&T stock"}
+    
+    # An article path binds its decoded title, which also fills <query>.
+    history = [navigate("https://en.wikipedia.org/wiki/C%2B%2B")]
+    assert templater.bindings(history) == {"title": "C++", "query": "C++"}
+    typed = templater.fill(type_text("#searchInput", "<query>"), templater.bindings(history))
+    assert typed == type_text("#searchInput", "C++")
+    article = templater.fill(
+        navigate("https://en.wikipedia.org/wiki/<title>"), {"title": "AT&T Inc?"}
+    )
+    assert article == navigate("https://en.wikipedia.org/wiki/AT%26T%20Inc%3F")
+    assert templater.bindings([article])["title"] == "AT&T Inc?"
+
+
+def test_custom_rules_apply_first_match_per_attribute():
+    """Test rule order, selector filters and validation."""
+    templater = Templater(
+        [
+            TemplateRule("navigate", "url", r"/item/(?P<item_id>\d+)"),
+            TemplateRule("navigate", "url", r"/(?P<page>[^/]+)$"),
+        ]
+    )
+    assert templater.template(navigate("https://shop.test/item/42")) == navigate(
+        "https://shop.test/item/<item_id>"
+    )
+    assert templater.template(navigate("https://shop.test/about")) == navigate(
+        "https://shop.test/<page>"
+    )
+    with pytest.raises(ValueError):
+        TemplateRule("type", "text", r".+")
+
+
+def test_storage_records_templates_and_predictor_fills_them():
+    """Test that queries share one state and predictions are filled from history."""
+    storage = Storage(":memory:", templater=Templater())
+    storage.connect()
+    for query in ("python", "rust", "haskell"):
+        storage.record_session(_search_session(query))
+    
+    rows = storage.conn.execute("SELECT COUNT(*) FROM action_vocab").fetchone()[0]
+    assert rows == 6
+    logged = storage.conn.execute("SELECT COUNT(DISTINCT action_signature) FROM actions")
+    assert logged.fetchone()[0] == 10
+    
+    # An article never seen in training still maps to a known state.
+    history = _search_session("ocaml")
+    (prediction,) = Predictor(storage).predict(history[:5], k=1)
+    assert prediction.action == click("#toc")
+    assert prediction.confidence == 1.0
+    
+    # The predicted type needs a <query>: unbound, it is dropped; bound by
+    # slot_values, it is filled in.
+    assert Predictor(storage).predict(history[:2], k=1) == []
+    filled = Predictor(storage, slot_values={"query": "ocaml"}).predict(history[:2], k=1)
+    assert filled[0].action == type_text("#searchInput", "ocaml")
+    storage.close()
+
+
+def test_fill_skips_bindings_of_the_templates_own_type():
+    """Test a predicted article is not filled with the article already open."""
+    storage = Storage(":memory:", templater=Templater())
+    storage.connect()
+    article = navigate("https://en.wikipedia.org/wiki/<title>")
+    history = [navigate("https://en.wikipedia.org/wiki/Python"), click("#toc")]
+    predictor = Predictor(storage)
+    
+    assert predictor.fill([Prediction(article, 1.0, "first_order")], history) == []
+    
+    typed = history + [type_text("#search", "Rust")]
+    templater = Templater([TemplateRule("navigate", "url", r"/wiki/(?P<query>[^?#]+)")])
+    (filled,) = fill_predictions(
+        templater,
+        [Prediction(navigate("https://en.wikipedia.org/wiki/<query>"), 1.0, "first_order")],
+        typed + [navigate("https://en.wikipedia.org/wiki/Python")],
+        {"query": "Rust"},
+    )
+    assert filled.action == navigate("https://en.wikipedia.org/wiki/Rust")
+    storage.close()
+
+
+def test_fill_drops_duplicate_actions():
+    """Test templates filling to the same action leave one candidate."""
+    templater = Templater([TemplateRule("navigate", "url", r"/wiki/(?P<query>[^?#]+)")])
+    predictions = [
+        Prediction(navigate("https://en.wikipedia.org/wiki/<query>"), 0.6, "first_order"),
+        Prediction(navigate("https://en.wikipedia.org/wiki/Rust"), 0.3, "first_order"),
+    ]
+    
+    filled = fill_predictions(templater, predictions, [], {"query": "Rust"})
+    
+    assert filled == [
+        Prediction(navigate("https://en.wikipedia.org/wiki/Rust"), 0.6, "first_order")
+    ]
+
+
+def test_unfillable_templates_back_off_to_lower_order():
+    """Test a context whose templates cannot be filled falls back to a shorter one."""
+    storage = Storage(":memory:", templater=Templater(), context_order=2)
+    storage.connect()
+    storage.record_session([click("#a"), click("#b"), type_text("#email", "a@b.c")])
+    storage.record_session([click("#c"), click("#b"), click("#d")])
+    history = [click("#a"), click("#b")]
+    
+    for predictor in (Predictor(storage), VariableOrderPredictor(storage)):
+        (prediction,) = predictor.predict(history, k=5)
+        assert prediction.action == click("#d")
+        assert predictor.predict_many([history], k=5) == [[prediction]]
+    storage.close()
+
+
+def test_storage_stores_and_checks_template_rules():
+    """Test a database remembers its rules, adopting them or refusing others."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    rules = [TemplateRule("navigate", "url", r"/item/(?P<item>\d+)")]
+    storage = Storage(path, templater=Templater(rules))
+    storage.connect()
+    storage.record_session([navigate("https://shop.test/item/1"), click("#buy")])
+    storage.close()
+    
+    storage = Storage(path)
+    storage.connect()
+    assert storage.templater.rules == tuple(rules)
+    rows, _ = storage.get_first_order_top_k(navigate("https://shop.test/item/2"), k=1)
+    assert rows[0]["to_action"] == click("#buy").signature()
+    storage.close()
+    
+    with pytest.raises(ValueError, match="other template rules"):
+        Storage(path, templater=Templater()).connect()
+    
+    plain = Storage(":memory:")
+    plain.connect()
+    assert plain.templater is None
+    assert Templater.from_json(Templater(rules).to_json()).rules == tuple(rules)
+    plain.close()
+    os.unlink(path)
+
+
+def test_predict_many_fills_per_history():
+    """Test batched prediction fills each history from its own bindings."""
+    storage = Storage(":memory:", templater=Templater(), context_order=3)
+    storage.connect()
+    for query in ("python", "rust"):
+        storage.record_session(_search_session(query))
+    histories = [
+        [type_text("#searchInput", "a"), press("Enter"), navigate("https://x.org/?q=a")],
+        [type_text("#searchInput", "b"), press("Enter"), navigate("https://x.org/?q=b")],
+    ]
+    storage.record_session(histories[0] + [type_text("#searchInput", "a")])
+    
+    for predictor in (Predictor(storage), VariableOrderPredictor(storage)):
+        results = predictor.predict_many(histories, k=1)
+        assert results == [predictor.predict(history, k=1) for history in histories]
+        assert [r[0].action for r in results] == [
+            type_text("#searchInput", "a"),
+            type_text("#searchInput", "b"),
+        ]
+    storage.close()
+
+
+def test_templates_shrink_model_and_misses():
+    """Test templating collapses states and turns lookup misses into hits."""
+    rng = random.Random(0)
+    words = [f"topic{i}" for i in range(500)]
+    train = [_search_session(rng.choice(words)) for _ in range(200)]
+    test = [_search_session(f"unseen {i}") for i in range(50)]
+    
+    plain = train_storage(train)
+    templated = train_storage(train, templater=Templater())
+    vocab = "SELECT COUNT(*) FROM action_vocab"
+    plain_states = plain.conn.execute(vocab).fetchone()[0]
+    assert plain_states > 50 * templated.conn.execute(vocab).fetchone()[0]
+    
+    def misses(storage):
+        return sum(
+            not storage.get_first_order_top_k(action, k=1)[0]
+            for session in test
+            for action in session[:-1]
+        )
+    
+    assert misses(plain) == 100
+    assert misses(templated) == 0
+    
+    plain_report = ReplayEvaluator(Predictor(plain), k=1).evaluate(test)
+    templated_report = ReplayEvaluator(Predictor(templated), k=1).evaluate(test)
+    assert templated_report.get_top1_accuracy() > plain_report.get_top1_accuracy()
+    plain.close()
+    templated.close()
+
+
+def test_rebuild_converts_database_to_templates():
+    """Test reopening with a templater and rebuilding recounts over templates."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    storage = Storage(path)
+    storage.connect()
+    for query in ("python", "rust", "haskell"):
+        storage.record_session(_search_session(query))
+    storage.close()
+    
+    with pytest.raises(ValueError, match="without templates"):
+        Storage(path, templater=Templater()).connect()
+    
+    storage = Storage(path)
+    storage.connect()
+    report = rebuild_transitions(storage, workers=1, templater=Templater())
+    assert storage.templater is not None
+    assert report.rows["transitions_first_order"] == 5
+    rows, _ = storage.get_first_order_top_k(click("#searchInput"), k=1)
+    assert rows[0]["to_action"] == type_text("#searchInput", "<query>").signature()
+    assert rows[0]["count"] == 3
+    storage.close()
+    
+    # Reopened without a templater, the stored rules are adopted.
+    storage = Storage(path)
+    storage.connect(read_only=True)
+    assert storage.templater.rules == Templater().rules
+    storage.close()
+    os.unlink(path)
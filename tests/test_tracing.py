@@ -0,0 +1,137 @@
+"""Tests for trace spans, the ring buffer and the JSONL sink."""
+import asyncio
+import json
+import os
+import tempfile
+
+import pytest
+
+from thirdlayer_prototype.agent.loop import AgentLoop
+from thirdlayer_prototype.agent.tracing import JsonlSpanSink, Tracer, read_recent_spans
+from thirdlayer_prototype.db.storage import Storage
+from thirdlayer_prototype.models.action import navigate, click
+
+from fakes import FakePage
+
+
+def test_ring_buffer_keeps_most_recent_spans():
+    """Test the buffer is bounded and recent() filters newest first."""
+    tracer = Tracer(capacity=3)
+    for i in range(5):
+        with tracer.span("step", index=i):
+            pass
+    
+    assert len(tracer.spans) == 3
+    assert [s["attributes"]["index"] for s in tracer.recent()] == [4, 3, 2]
+    assert tracer.recent(limit=1)[0]["attributes"]["index"] == 4
+    assert tracer.recent(name="execute") == []
+
+
+def test_span_records_parent_and_error():
+    """Test child spans share the trace and exceptions are captured."""
+    tracer = Tracer()
+    with pytest.raises(ValueError):
+        with tracer.span("step", trace_id="abc") as parent:
+            with tracer.span("execute", parent=parent):
+                raise ValueError("boom")
+    
+    root, child = tracer.recent()
+    assert child["parent_id"] == root["span_id"]
+    assert child["trace_id"] == root["trace_id"] == "abc"
+    assert child["error"] == root["error"] == "ValueError_boom"
+
+
+def test_agent_loop_emits_step_and_stage_spans():
+    """Test a traced step produces a step span with stage children."""
+    storage = Storage(":memory:", cache_transitions=True)
+    storage.connect()
+    storage.record_session([navigate("https://example.com"), click("#a")])
+    tracer = Tracer()
+    agent = AgentLoop(FakePage(["#a"]), storage, tracer=tracer)
+    agent.add_action_to_history(navigate("https://example.com"))
+    
+    asyncio.run(agent.step())
+    storage.close()
+    
+    step = tracer.recent(name="step")[0]
+    children = [s for s in tracer.recent() if s["parent_id"] == step["span_id"]]
+    assert {s["name"] for s in children} == {
+        "observe", "predict", "validate", "plan", "execute", "storage_write"
+    }
+    assert step["trace_id"] == agent.trace_id
+    assert step["attributes"]["plan_reason"].startswith("confidence_above_threshold")
+    assert step["attributes"]["execution_success"] is True
+    assert step["attributes"]["predictions"][0]["action"]["selector"] == "#a"
+
+
+def test_jsonl_sink_writes_batches():
+    """Test spans queued on the sink are written on close."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "spans.jsonl")
+        
+        async def run():
+            sink = JsonlSpanSink(path, batch_size=2, flush_interval=0.0)
+            sink.start()
+            tracer = Tracer(sink=sink)
+            for i in range(5):
+                with tracer.span("step", index=i):
+                    pass
+                await asyncio.sleep(0)
+            await sink.close()
+        
+        asyncio.run(run())
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+    
+    assert [r["attributes"]["index"] for r in records] == [0, 1, 2, 3, 4]
+
+
+def test_read_recent_spans_tails_the_file(tmp_path):
+    """Test spans are read newest first across blocks, skipping partial lines."""
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer()
+    for i in range(50):
+        with tracer.span("step" if i % 2 else "execute", index=i):
+            pass
+    lines = [json.dumps(span.to_dict()) for span in tracer.spans]
+    path.write_text("\n".join(lines) + "\n" + '{"name": "st')
+    
+    spans = read_recent_spans(str(path), limit=3, name="step", block_size=64)
+    
+    assert [s["attributes"]["index"] for s in spans] == [49, 47, 45]
+    assert len(read_recent_spans(str(path), limit=100, block_size=64)) == 50
+    assert read_recent_spans(str(tmp_path / "missing.jsonl")) == []
+
+
+def test_recent_traces_endpoint_serves_agent_spans(tmp_path, monkeypatch):
+    """Test a span from a real AgentLoop step is served by the API."""
+    from fastapi.testclient import TestClient
+    
+    from thirdlayer_prototype import main
+    
+    path = str(tmp_path / "spans.jsonl")
+    monkeypatch.setattr(main, "TRACES_PATH", path)
+    storage = Storage(":memory:", cache_transitions=True)
+    storage.connect()
+    storage.record_session([navigate("https://example.com"), click("#a")])
+    
+    async def run():
+        sink = JsonlSpanSink(path, flush_interval=0.0)
+        sink.start()
+        agent = AgentLoop(FakePage(["#a"]), storage, tracer=Tracer(sink=sink))
+        agent.add_action_to_history(navigate("https://example.com"))
+        await agent.step()
+        await sink.close()
+        return agent
+    
+    agent = asyncio.run(run())
+    storage.close()
+    
+    client = TestClient(main.app)
+    spans = client.get(
+        "/traces/recent", params={"trace_id": agent.trace_id, "name": "step"}
+    ).json()
+    
+    assert len(spans) == 1
+    assert spans[0]["attributes"]["execution_success"] is True
+    assert spans[0]["attributes"]["predictions"][0]["action"]["selector"] == "#a"